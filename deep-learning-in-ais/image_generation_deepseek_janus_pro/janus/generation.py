@@ -0,0 +1,802 @@
+# Copyright (c) 2023-2024 DeepSeek.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Text-to-image generation for Janus with a preallocated key/value cache.
+
+The language model's decoder layers are driven directly instead of through
+`LlamaModel.forward`, so the keys and values of every step are written in place
+into buffers sized for the prompt plus all image tokens, rather than concatenated
+onto a growing `past_key_values`. The buffers are kept by the `ImageGenerator` and
+reused by later calls of the same or a smaller size.
+
+Classifier-free guidance needs a conditional and an unconditional sequence per
+image. By default the two prompts are prefilled once each and their keys and values
+are shared by all images (`SharedPrefixKVCache`); only the image tokens of each
+sequence get rows of their own. With `share_prefix=False`, every sequence keeps a
+full copy of its prompt (`StaticKVCache`).
+
+Image tokens are sampled in row-major order over the token grid, so the rows sampled
+so far can be decoded before the image is finished; `stream_images` yields such
+previews every few rows.
+"""
+
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+
+def _rotate_half(x: torch.Tensor) -> torch.Tensor:
+    x1, x2 = x.chunk(2, dim=-1)
+    return torch.cat((-x2, x1), dim=-1)
+
+
+def _apply_rotary(
+    x: torch.Tensor, cos: torch.Tensor, sin: torch.Tensor
+) -> torch.Tensor:
+    # x: [b, heads, T, head_dim], cos/sin: [b, T, head_dim]
+    return x * cos.unsqueeze(1) + _rotate_half(x) * sin.unsqueeze(1)
+
+
+def _attention(
+    query: torch.Tensor,
+    key: torch.Tensor,
+    value: torch.Tensor,
+    mask: Optional[torch.Tensor] = None,
+) -> torch.Tensor:
+    """
+
+    Eager attention of the Llama model, reading keys and values straight from the cache.
+
+    Query heads that share a key/value head are folded into the query length, so
+    grouped-query attention needs no `repeat_kv` copy of the cached keys and values.
+
+    Args:
+        query (torch.Tensor): [b, heads, T, head_dim]
+        key (torch.Tensor): [b, kv_heads, L, head_dim], may be a view of a cache buffer
+        value (torch.Tensor): [b, kv_heads, L, head_dim], may be a view of a cache buffer
+        mask (torch.Tensor, optional): additive mask broadcastable to [b, 1, 1, T, L]
+
+    Returns:
+        output (torch.Tensor): [b, heads, T, head_dim]
+    """
+
+    batch_size, heads, length, head_dim = query.shape
+    kv_heads = key.shape[1]
+    query = query.reshape(batch_size, kv_heads, heads // kv_heads * length, head_dim)
+
+    scores = torch.matmul(query, key.transpose(2, 3)) * head_dim**-0.5
+    if mask is not None:
+        scores = scores.view(batch_size, kv_heads, -1, length, scores.shape[-1])
+        scores = (scores + mask).flatten(2, 3)
+    probs = torch.softmax(scores, dim=-1, dtype=torch.float32).to(query.dtype)
+    return torch.matmul(probs, value).view(batch_size, heads, length, head_dim)
+
+
+def _shared_prefix_attention(
+    query: torch.Tensor,
+    prefix_key: torch.Tensor,
+    prefix_value: torch.Tensor,
+    key: torch.Tensor,
+    value: torch.Tensor,
+) -> torch.Tensor:
+    """
+
+    Attention of one new position per sequence over a prefix shared by groups of sequences
+    followed by each sequence's own positions.
+
+    Sequences are ordered by prefix, `n` per prefix. For the prefix part, the `n` queries
+    of a prefix are folded into its query length, so the shared keys and values are read
+    once per prefix and never copied per sequence.
+
+    Args:
+        query (torch.Tensor): [p x n, heads, 1, head_dim]
+        prefix_key (torch.Tensor): [p, kv_heads, P, head_dim]
+        prefix_value (torch.Tensor): [p, kv_heads, P, head_dim]
+        key (torch.Tensor): [p x n, kv_heads, L, head_dim]
+        value (torch.Tensor): [p x n, kv_heads, L, head_dim]
+
+    Returns:
+        output (torch.Tensor): [p x n, heads, 1, head_dim]
+    """
+
+    rows, heads, length, head_dim = query.shape
+    if length != 1:
+        raise ValueError(f"Shared-prefix attention decodes one position at a time, got {length}.")
+    prefixes, kv_heads, prefix_length, _ = prefix_key.shape
+    groups, n = heads // kv_heads, rows // prefixes
+    scale = head_dim**-0.5
+
+    # [p x n, kv_heads, groups, head_dim] <-> [p, kv_heads, n x groups, head_dim]
+    def to_prefix(x):
+        x = x.reshape(prefixes, n, kv_heads, groups, x.shape[-1]).transpose(1, 2)
+        return x.reshape(prefixes, kv_heads, n * groups, -1)
+
+    def from_prefix(x):
+        x = x.reshape(prefixes, kv_heads, n, groups, x.shape[-1]).transpose(1, 2)
+        return x.reshape(rows, kv_heads, groups, -1)
+
+    query = query.view(rows, kv_heads, groups, head_dim)
+    prefix_scores = torch.matmul(to_prefix(query), prefix_key.transpose(2, 3)) * scale
+    own_scores = torch.matmul(query, key.transpose(2, 3)) * scale
+    scores = torch.cat([from_prefix(prefix_scores), own_scores], dim=-1)
+    probs = torch.softmax(scores, dim=-1, dtype=torch.float32).to(query.dtype)
+
+    output = from_prefix(torch.matmul(to_prefix(probs[..., :prefix_length]), prefix_value))
+    output = output + torch.matmul(probs[..., prefix_length:], value)
+    return output.view(rows, heads, 1, head_dim)
+
+
+def causal_mask(
+    length: int, past_length: int, dtype: torch.dtype, device: torch.device
+) -> torch.Tensor:
+    """Additive mask letting each of `length` new positions attend to itself and everything before it."""
+    mask = torch.full(
+        (length, past_length + length), torch.finfo(dtype).min, dtype=dtype, device=device
+    )
+    return mask.triu_(past_length + 1)
+
+
+class StaticKVCache(object):
+    """
+
+    Key/value buffers for every layer, allocated once for `batch_size` rows of up to
+    `max_length` positions and written in place as the sequences grow.
+
+    """
+
+    def __init__(
+        self,
+        num_layers: int,
+        batch_size: int,
+        max_length: int,
+        kv_heads: int,
+        head_dim: int,
+        dtype: torch.dtype,
+        device: torch.device,
+    ):
+        shape = (num_layers, batch_size, kv_heads, max_length, head_dim)
+        self.keys = torch.zeros(shape, dtype=dtype, device=device)
+        self.values = torch.zeros(shape, dtype=dtype, device=device)
+        self.batch_size = batch_size
+        self.length = 0
+
+    @property
+    def sizes(self) -> Tuple[int, int]:
+        """(batch_size, max_length) the buffers were allocated for."""
+        return self.keys.shape[1], self.keys.shape[3]
+
+    @property
+    def max_length(self) -> int:
+        return self.keys.shape[3]
+
+    @property
+    def nbytes(self) -> int:
+        return self.keys.nbytes + self.values.nbytes
+
+    def fits(self, *sizes: int, dtype: torch.dtype, device: torch.device) -> bool:
+        return (
+            all(size <= allocated for size, allocated in zip(sizes, self.sizes))
+            and self.keys.dtype == dtype
+            and self.keys.device == torch.device(device)
+        )
+
+    def reset(self, batch_size: int):
+        """Start new sequences in the first `batch_size` rows, keeping the buffers."""
+        self.batch_size = batch_size
+        self.length = 0
+
+    def attend(
+        self,
+        layer_idx: int,
+        query: torch.Tensor,
+        key: torch.Tensor,
+        value: torch.Tensor,
+        mask: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        """Store the new keys and values of one layer after the cached ones, then attend over all of them."""
+        start, stop = self.length, self.length + key.shape[2]
+        if stop > self.max_length:
+            raise ValueError(
+                f"KV cache holds {self.max_length} positions, {stop} were requested."
+            )
+        keys = self.keys[layer_idx, : self.batch_size]
+        values = self.values[layer_idx, : self.batch_size]
+        keys[:, :, start:stop] = key
+        values[:, :, start:stop] = value
+        return _attention(query, keys[:, :, :stop], values[:, :, :stop], mask)
+
+    def advance(self, length: int):
+        """Mark `length` more positions as written, once every layer has stored them."""
+        self.length += length
+
+
+class SharedPrefixKVCache(StaticKVCache):
+    """
+
+    KV cache for `parallel_size` images guided by one conditional and one unconditional
+    prompt.
+
+    The first forward pass prefills the two prompts, one row each, into the prefix
+    buffers, which are read-only afterwards. Later passes write the image tokens of each
+    of the `2 x parallel_size` sequences (conditional ones first) into rows of its own
+    and attend over its prompt's shared prefix followed by those rows, so a prompt's keys
+    and values are stored and computed once instead of once per image.
+
+    """
+
+    def __init__(
+        self,
+        num_layers: int,
+        parallel_size: int,
+        prefix_length: int,
+        max_length: int,
+        kv_heads: int,
+        head_dim: int,
+        dtype: torch.dtype,
+        device: torch.device,
+    ):
+        super().__init__(
+            num_layers, parallel_size * 2, max_length, kv_heads, head_dim, dtype, device
+        )
+        shape = (num_layers, 2, kv_heads, prefix_length, head_dim)
+        self.prefix_keys = torch.zeros(shape, dtype=dtype, device=device)
+        self.prefix_values = torch.zeros(shape, dtype=dtype, device=device)
+        self.prefix_length = 0
+
+    @property
+    def sizes(self) -> Tuple[int, int, int]:
+        """(parallel_size, prefix_length, max_length) the buffers were allocated for."""
+        return self.keys.shape[1] // 2, self.prefix_keys.shape[3], self.keys.shape[3]
+
+    @property
+    def nbytes(self) -> int:
+        return super().nbytes + self.prefix_keys.nbytes + self.prefix_values.nbytes
+
+    def reset(self, batch_size: int):
+        super().reset(batch_size)
+        self.prefix_length = 0
+
+    def attend(
+        self,
+        layer_idx: int,
+        query: torch.Tensor,
+        key: torch.Tensor,
+        value: torch.Tensor,
+        mask: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        if self.prefix_length == 0:
+            length = key.shape[2]
+            if length > self.prefix_keys.shape[3]:
+                raise ValueError(
+                    f"KV cache holds {self.prefix_keys.shape[3]} prompt positions, {length} were requested."
+                )
+            prefix_keys = self.prefix_keys[layer_idx, :, :, :length]
+            prefix_values = self.prefix_values[layer_idx, :, :, :length]
+            prefix_keys.copy_(key)
+            prefix_values.copy_(value)
+            return _attention(query, prefix_keys, prefix_values, mask)
+
+        start, stop = self.length, self.length + key.shape[2]
+        if stop > self.max_length:
+            raise ValueError(
+                f"KV cache holds {self.max_length} positions, {stop} were requested."
+            )
+        keys = self.keys[layer_idx, : self.batch_size]
+        values = self.values[layer_idx, : self.batch_size]
+        keys[:, :, start:stop] = key
+        values[:, :, start:stop] = value
+        return _shared_prefix_attention(
+            query,
+            self.prefix_keys[layer_idx, :, :, : self.prefix_length],
+            self.prefix_values[layer_idx, :, :, : self.prefix_length],
+            keys[:, :, :stop],
+            values[:, :, :stop],
+        )
+
+    def advance(self, length: int):
+        if self.prefix_length == 0:
+            self.prefix_length = length
+        else:
+            self.length += length
+
+
+class SlotKVCache(StaticKVCache):
+    """
+
+    KV cache whose rows are independent sequences of different lengths, for
+    continuous batching.
+
+    Active sequences always occupy rows `[0, batch_size)`: `add` appends new ones after
+    them and `remove` moves the later rows down over the removed ones, so attention
+    reads the buffers as views without gathering rows. Every forward pass adds one
+    position to every active sequence, at that sequence's own length.
+
+    """
+
+    def __init__(
+        self,
+        num_layers: int,
+        batch_size: int,
+        max_length: int,
+        kv_heads: int,
+        head_dim: int,
+        dtype: torch.dtype,
+        device: torch.device,
+    ):
+        super().__init__(
+            num_layers, batch_size, max_length, kv_heads, head_dim, dtype, device
+        )
+        self.lengths = torch.zeros(batch_size, dtype=torch.long, device=device)
+        self.batch_size = 0
+        self._stop = 0
+
+    def reset(self, batch_size: int = 0):
+        self.batch_size = batch_size
+        self.lengths.zero_()
+
+    def add(self, keys: torch.Tensor, values: torch.Tensor, copies: int) -> int:
+        """
+
+        Append `copies` sequences starting from each prefilled row of `keys` and `values`.
+
+        Args:
+            keys (torch.Tensor): [num_layers, p, kv_heads, P, head_dim]
+            values (torch.Tensor): [num_layers, p, kv_heads, P, head_dim]
+            copies (int): sequences per prefilled row, stored next to each other
+
+        Returns:
+            start (int): the row of the first new sequence
+        """
+
+        start, rows = self.batch_size, keys.shape[1] * copies
+        length = keys.shape[3]
+        if start + rows > self.keys.shape[1] or length >= self.max_length:
+            raise ValueError(
+                f"KV cache has {self.keys.shape[1] - start} free rows of {self.max_length} positions, "
+                f"{rows} rows of {length} positions were requested."
+            )
+        for i in range(keys.shape[1]):
+            block = slice(start + i * copies, start + (i + 1) * copies)
+            self.keys[:, block, :, :length] = keys[:, i : i + 1]
+            self.values[:, block, :, :length] = values[:, i : i + 1]
+        self.lengths[start : start + rows] = length
+        self.batch_size += rows
+        return start
+
+    def remove(self, start: int, rows: int):
+        """Drop rows `[start, start + rows)`, moving the rows after them down."""
+        stop = self.batch_size
+        if start + rows < stop:
+            used = int(self.lengths[start + rows : stop].max())
+            moved = slice(start, stop - rows)
+            self.keys[:, moved, :, :used] = self.keys[:, start + rows : stop, :, :used].clone()
+            self.values[:, moved, :, :used] = self.values[:, start + rows : stop, :, :used].clone()
+            self.lengths[moved] = self.lengths[start + rows : stop].clone()
+        self.lengths[stop - rows : stop] = 0
+        self.batch_size -= rows
+
+    def position_ids(self) -> torch.LongTensor:
+        """[batch_size, 1] position of the next token of every active sequence."""
+        return self.lengths[: self.batch_size].unsqueeze(1)
+
+    def step_mask(self, dtype: torch.dtype) -> torch.Tensor:
+        """Additive mask for the next forward pass, hiding the unused tail of shorter rows."""
+        lengths = self.lengths[: self.batch_size]
+        self._stop = int(lengths.max()) + 1
+        if self._stop > self.max_length:
+            raise ValueError(
+                f"KV cache holds {self.max_length} positions, {self._stop} were requested."
+            )
+        positions = torch.arange(self._stop, device=lengths.device)
+        mask = torch.zeros((len(lengths), self._stop), dtype=dtype, device=lengths.device)
+        mask.masked_fill_(positions > lengths.unsqueeze(1), torch.finfo(dtype).min)
+        return mask.view(len(lengths), 1, 1, 1, self._stop)
+
+    def attend(
+        self,
+        layer_idx: int,
+        query: torch.Tensor,
+        key: torch.Tensor,
+        value: torch.Tensor,
+        mask: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        """Store one new position per row at that row's length, then attend with the `step_mask`."""
+        if key.shape[2] != 1:
+            raise ValueError(f"Slots decode one position at a time, got {key.shape[2]}.")
+        rows = torch.arange(self.batch_size, device=key.device)
+        lengths = self.lengths[: self.batch_size]
+        keys = self.keys[layer_idx, : self.batch_size]
+        values = self.values[layer_idx, : self.batch_size]
+        keys[rows, :, lengths] = key[:, :, 0]
+        values[rows, :, lengths] = value[:, :, 0]
+        return _attention(
+            query, keys[:, :, : self._stop], values[:, :, : self._stop], mask
+        )
+
+    def advance(self, length: int):
+        self.lengths[: self.batch_size] += length
+
+
+class ImageGenerator(object):
+    """
+
+    Reusable text-to-image sampler for a `MultiModalityCausalLM`.
+
+    Each call samples `image_token_num_per_image` image tokens for `parallel_size`
+    images with classifier-free guidance, conditional rows first and unconditional
+    rows (the prompt replaced by padding) after them. With `share_prefix`, the two
+    prompts are prefilled once and shared by all images. The model may run on GPU or,
+    in float16/bfloat16/float32, on CPU.
+
+    Tokens are decoded to pixels by the VQ decoder, at most `decode_batch_size` images
+    at a time and, with `decode_tile_size`, in overlapping tiles of that many tokens
+    per side (see `VQModel.decode`), so that decoding many images or larger token
+    grids keeps a bounded peak memory.
+
+    Example:
+        generator = ImageGenerator(vl_gpt, vl_chat_processor)
+        images = generator.generate_images("A red fox in the snow", seed=42)
+
+    """
+
+    def __init__(
+        self,
+        vl_gpt,
+        vl_chat_processor,
+        image_token_num_per_image: int = 576,
+        img_size: int = 384,
+        patch_size: int = 16,
+        share_prefix: bool = True,
+        decode_batch_size: Optional[int] = None,
+        decode_tile_size: Optional[int] = None,
+    ):
+        self.vl_gpt = vl_gpt
+        self.vl_chat_processor = vl_chat_processor
+        self.image_token_num_per_image = image_token_num_per_image
+        self.img_size = img_size
+        self.patch_size = patch_size
+        self.share_prefix = share_prefix
+        self.decode_batch_size = decode_batch_size
+        self.decode_tile_size = decode_tile_size
+
+        self.llm = vl_gpt.language_model.model
+        config = vl_gpt.language_model.config
+        self.num_heads = config.num_attention_heads
+        self.kv_heads = getattr(config, "num_key_value_heads", None) or self.num_heads
+        self.head_dim = (
+            getattr(config, "head_dim", None)
+            or config.hidden_size // config.num_attention_heads
+        )
+        # newer transformers keep one rotary embedding on the model, older ones one per layer
+        self.rotary_emb = getattr(self.llm, "rotary_emb", None) or (
+            self.llm.layers[0].self_attn.rotary_emb
+        )
+        self.cache: Optional[StaticKVCache] = None
+
+    @property
+    def device(self) -> torch.device:
+        return self.vl_gpt.gen_head.vision_head.weight.device
+
+    @property
+    def dtype(self) -> torch.dtype:
+        return self.vl_gpt.gen_head.vision_head.weight.dtype
+
+    def prompt_ids(self, prompt: str) -> torch.LongTensor:
+        """Token ids of a user prompt in the SFT template, ending with the image start tag."""
+        messages = [
+            {"role": "<|User|>", "content": prompt},
+            {"role": "<|Assistant|>", "content": ""},
+        ]
+        text = self.vl_chat_processor.apply_sft_template_for_multi_turn_prompts(
+            conversations=messages,
+            sft_format=self.vl_chat_processor.sft_format,
+            system_prompt="",
+        )
+        text = text + self.vl_chat_processor.image_start_tag
+        return torch.LongTensor(self.vl_chat_processor.tokenizer.encode(text))
+
+    def allocate(
+        self, parallel_size: int, prompt_length: int, num_tokens: int
+    ) -> StaticKVCache:
+        """Return the KV cache, reallocating it only if it is too small for this call."""
+        if self.share_prefix:
+            cache_cls, sizes = SharedPrefixKVCache, (parallel_size, prompt_length, num_tokens)
+        else:
+            cache_cls, sizes = StaticKVCache, (parallel_size * 2, prompt_length + num_tokens)
+
+        if type(self.cache) is not cache_cls or not self.cache.fits(
+            *sizes, dtype=self.dtype, device=self.device
+        ):
+            if type(self.cache) is cache_cls:
+                sizes = tuple(max(size, old) for size, old in zip(sizes, self.cache.sizes))
+            # free the old buffers before allocating the new ones
+            self.cache = None
+            self.cache = cache_cls(
+                len(self.llm.layers),
+                *sizes,
+                self.kv_heads,
+                self.head_dim,
+                self.dtype,
+                self.device,
+            )
+        return self.cache
+
+    def forward(
+        self,
+        cache,
+        inputs_embeds: torch.Tensor,
+        position_ids: torch.LongTensor,
+        mask: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        """
+
+        Run the decoder layers on new positions, with attention handled by the cache.
+
+        Args:
+            cache: a KV cache with `attend(layer_idx, q, k, v, mask)` and `advance(length)`
+            inputs_embeds (torch.Tensor): [b, T, D]
+            position_ids (torch.LongTensor): [b, T]
+            mask (torch.Tensor, optional): additive attention mask, see `_attention`
+
+        Returns:
+            hidden_states (torch.Tensor): [b, T, D], after the final norm
+        """
+
+        batch_size, length, _ = inputs_embeds.shape
+        cos, sin = self.rotary_emb(inputs_embeds, position_ids)
+
+        hidden_states = inputs_embeds
+        for layer_idx, layer in enumerate(self.llm.layers):
+            attn = layer.self_attn
+            x = layer.input_layernorm(hidden_states)
+            query = attn.q_proj(x).view(batch_size, length, -1, self.head_dim)
+            key = attn.k_proj(x).view(batch_size, length, -1, self.head_dim)
+            value = attn.v_proj(x).view(batch_size, length, -1, self.head_dim)
+            query = _apply_rotary(query.transpose(1, 2), cos, sin)
+            key = _apply_rotary(key.transpose(1, 2), cos, sin)
+
+            output = cache.attend(layer_idx, query, key, value.transpose(1, 2), mask)
+            output = output.transpose(1, 2).reshape(batch_size, length, -1)
+            hidden_states = hidden_states + attn.o_proj(output)
+            hidden_states = hidden_states + layer.mlp(
+                layer.post_attention_layernorm(hidden_states)
+            )
+
+        cache.advance(length)
+        return self.llm.norm(hidden_states)
+
+    def sample(
+        self,
+        hidden_states: torch.Tensor,
+        cfg_weight: float,
+        temperature: float,
+        generator: Optional[torch.Generator] = None,
+    ) -> torch.LongTensor:
+        """Sample one image token per image from conditional rows followed by unconditional rows."""
+        logits = self.vl_gpt.gen_head(hidden_states).float()
+        logit_cond, logit_uncond = logits.chunk(2)
+        logits = logit_uncond + cfg_weight * (logit_cond - logit_uncond)
+        probs = torch.softmax(logits / temperature, dim=-1)
+        return torch.multinomial(probs, num_samples=1, generator=generator).squeeze(-1)
+
+    @torch.inference_mode()
+    def generate_tokens(
+        self,
+        input_ids: torch.LongTensor,
+        parallel_size: int = 5,
+        cfg_weight: float = 5,
+        temperature: float = 1,
+        generator: Optional[torch.Generator] = None,
+        image_token_num_per_image: Optional[int] = None,
+    ) -> torch.Tensor:
+        """
+
+        Sample the image tokens of `parallel_size` images for one prompt.
+
+        Args:
+            input_ids (torch.LongTensor): [T] prompt ids, e.g. from `prompt_ids`
+            parallel_size (int): number of images
+            cfg_weight (float): classifier-free guidance scale
+            temperature (float): sampling temperature
+            generator (torch.Generator, optional): random generator on the model's device
+            image_token_num_per_image (int, optional): defaults to the generator's setting
+
+        Returns:
+            generated_tokens (torch.Tensor): [parallel_size, image_token_num_per_image], int
+        """
+
+        for _, generated_tokens in self._sample_tokens(
+            input_ids,
+            parallel_size,
+            cfg_weight,
+            temperature,
+            generator,
+            image_token_num_per_image or self.image_token_num_per_image,
+        ):
+            pass
+        return generated_tokens
+
+    @torch.inference_mode()
+    def _sample_tokens(
+        self,
+        input_ids: torch.LongTensor,
+        parallel_size: int,
+        cfg_weight: float,
+        temperature: float,
+        generator: Optional[torch.Generator],
+        num_tokens: int,
+    ) -> Iterator[Tuple[int, torch.Tensor]]:
+        """Yield the number of tokens sampled so far and the token buffer after every token."""
+        device = self.device
+        prompt_length = len(input_ids)
+        batch_size = parallel_size * 2
+        cache = self.allocate(parallel_size, prompt_length, num_tokens)
+        cache.reset(batch_size)
+
+        # the conditional prompt, then the unconditional one, once per image unless shared
+        prompt_rows = 1 if self.share_prefix else parallel_size
+        tokens = input_ids.to(device).repeat(2 * prompt_rows, 1)
+        tokens[prompt_rows:, 1:-1] = self.vl_chat_processor.pad_id
+        inputs_embeds = self.vl_gpt.language_model.get_input_embeddings()(tokens)
+        position_ids = torch.arange(prompt_length, device=device).expand(len(tokens), -1)
+        mask = causal_mask(prompt_length, 0, inputs_embeds.dtype, device)
+        hidden_states = self.forward(cache, inputs_embeds, position_ids, mask)
+        if self.share_prefix:
+            hidden_states = hidden_states[:, -1:].repeat_interleave(parallel_size, dim=0)
+
+        generated_tokens = torch.zeros(
+            (parallel_size, num_tokens), dtype=torch.int, device=device
+        )
+        position_ids = torch.empty((batch_size, 1), dtype=torch.long, device=device)
+        for i in range(num_tokens):
+            next_token = self.sample(
+                hidden_states[:, -1, :], cfg_weight, temperature, generator
+            )
+            generated_tokens[:, i] = next_token
+            yield i + 1, generated_tokens
+            if i == num_tokens - 1:
+                break
+
+            # both rows of an image continue with the same token, embedded once
+            img_embeds = self.vl_gpt.prepare_gen_img_embeds(next_token)
+            inputs_embeds = img_embeds.repeat(2, 1).unsqueeze(1)
+            position_ids.fill_(prompt_length + i)
+            hidden_states = self.forward(cache, inputs_embeds, position_ids)
+
+    @torch.inference_mode()
+    def decode(
+        self,
+        generated_tokens: torch.Tensor,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+    ) -> torch.Tensor:
+        """Decode image tokens to [n, 3, height, width] pixel values in [-1, 1]."""
+        width = width or self.img_size
+        height = height or self.img_size
+        return self.vl_gpt.gen_vision_model.decode_code(
+            generated_tokens.to(dtype=torch.int),
+            shape=[
+                generated_tokens.shape[0],
+                self.vl_gpt.gen_vision_model.quantize.e_dim,
+                height // self.patch_size,
+                width // self.patch_size,
+            ],
+            batch_size=self.decode_batch_size,
+            tile_size=self.decode_tile_size,
+        )
+
+    @torch.inference_mode()
+    def preview(
+        self,
+        generated_tokens: torch.Tensor,
+        num_sampled: int,
+        placeholder_code: Optional[int] = None,
+    ) -> torch.Tensor:
+        """
+
+        Decode partly sampled images, filling the tokens not sampled yet with a placeholder.
+
+        Args:
+            generated_tokens (torch.Tensor): [n, image_token_num_per_image], valid up to `num_sampled`
+            num_sampled (int): tokens sampled so far, in row-major order
+            placeholder_code (int, optional): codebook entry for the rest of the grid;
+                by default each image's most frequent code so far, which fills it with
+                that image's dominant colour
+
+        Returns:
+            patches (torch.Tensor): [n, 3, img_size, img_size] pixel values in [-1, 1]
+        """
+
+        tokens = generated_tokens.clone()
+        if 0 < num_sampled < tokens.shape[1]:
+            if placeholder_code is None:
+                fill = tokens[:, :num_sampled].mode(dim=1).values.unsqueeze(1)
+            else:
+                fill = placeholder_code
+            tokens[:, num_sampled:] = fill
+        return self.decode(tokens)
+
+    @staticmethod
+    def to_numpy(patches: torch.Tensor) -> np.ndarray:
+        """Pixel values in [-1, 1] to [n, h, w, 3] uint8 images."""
+        dec = patches.to(torch.float32).cpu().numpy().transpose(0, 2, 3, 1)
+        return np.clip((dec + 1) / 2 * 255, 0, 255).astype(np.uint8)
+
+    def generate_images(
+        self,
+        prompt: str,
+        parallel_size: int = 5,
+        cfg_weight: float = 5,
+        temperature: float = 1,
+        seed: Optional[int] = None,
+    ) -> List[np.ndarray]:
+        """Generate `parallel_size` images for a prompt, as [h, w, 3] uint8 arrays."""
+        generator = None
+        if seed is not None:
+            generator = torch.Generator(device=self.device).manual_seed(seed)
+        generated_tokens = self.generate_tokens(
+            self.prompt_ids(prompt), parallel_size, cfg_weight, temperature, generator
+        )
+        return list(self.to_numpy(self.decode(generated_tokens)))
+
+    def stream_images(
+        self,
+        prompt: str,
+        parallel_size: int = 5,
+        cfg_weight: float = 5,
+        temperature: float = 1,
+        seed: Optional[int] = None,
+        preview_rows: int = 4,
+        placeholder_code: Optional[int] = None,
+    ) -> Iterator[Tuple[int, List[np.ndarray]]]:
+        """
+
+        Generate images for a prompt, yielding a preview every `preview_rows` rows of the token grid.
+
+        Each preview costs one VQ decode of the partly sampled images, see `preview`.
+
+        Yields:
+            (rows_done, images): rows of the token grid sampled so far, and [h, w, 3] uint8
+            arrays; the last item holds the finished images
+        """
+
+        generator = None
+        if seed is not None:
+            generator = torch.Generator(device=self.device).manual_seed(seed)
+        grid_width = self.img_size // self.patch_size
+        num_tokens = self.image_token_num_per_image
+        for num_sampled, generated_tokens in self._sample_tokens(
+            self.prompt_ids(prompt),
+            parallel_size,
+            cfg_weight,
+            temperature,
+            generator,
+            num_tokens,
+        ):
+            if num_sampled == num_tokens:
+                images = self.to_numpy(self.decode(generated_tokens))
+            elif preview_rows and num_sampled % (preview_rows * grid_width) == 0:
+                images = self.to_numpy(
+                    self.preview(generated_tokens, num_sampled, placeholder_code)
+                )
+            else:
+                continue
+            yield num_sampled // grid_width, list(images)
@@ -19,7 +19,7 @@
 
 
 from dataclasses import dataclass, field
-from typing import List
+from typing import List, Optional
 
 import torch
 import torch.nn as nn
@@ -417,7 +417,7 @@ class Upsample(nn.Module):
     def forward(self, x):
         if x.dtype != torch.float32:
             x = F.interpolate(x.to(torch.float), scale_factor=2.0, mode="nearest").to(
-                torch.bfloat16
+                x.dtype
             )
         else:
             x = F.interpolate(x, scale_factor=2.0, mode="nearest")
@@ -497,14 +497,90 @@ class VQModel(nn.Module):
         quant, emb_loss, info = self.quantize(h)
         return quant, emb_loss, info
 
-    def decode(self, quant):
-        quant = self.post_quant_conv(quant)
-        dec = self.decoder(quant)
+    @property
+    def upsample_factor(self):
+        return 2 ** (len(self.config.decoder_ch_mult) - 1)
+
+    def decode(
+        self,
+        quant,
+        batch_size: Optional[int] = None,
+        tile_size: Optional[int] = None,
+        tile_overlap: Optional[int] = None,
+    ):
+        # quant: [b, codebook_embed_dim, h, w] -> [b, 3, h * upsample_factor, w * upsample_factor]
+        #
+        # batch_size decodes at most that many samples at a time, which gives the same
+        # images (up to float rounding) with activation memory bounded by the micro-batch. tile_size decodes
+        # latents larger than tile_size x tile_size as overlapping tiles of that size,
+        # linearly cross-faded over tile_overlap latent positions (a quarter of a tile
+        # by default), bounding memory whatever the output size. Tiles do not see each
+        # other in the decoder's attention and group norm, so tiled images are close
+        # to, not equal to, a whole-latent decode.
+        if batch_size is None and tile_size is None:
+            quant = self.post_quant_conv(quant)
+            dec = self.decoder(quant)
+            return dec
+
+        b, _, h, w = quant.shape
+        batch_size = batch_size or b
+        if tile_size is None or (h <= tile_size and w <= tile_size):
+            decode_chunk = self.decode
+        else:
+            if tile_overlap is None:
+                tile_overlap = tile_size // 4
+            if not 0 <= tile_overlap < tile_size:
+                raise ValueError(
+                    f"tile_overlap must be in [0, {tile_size}), got {tile_overlap}."
+                )
+
+            def decode_chunk(chunk):
+                return self._decode_tiles(chunk, tile_size, tile_overlap)
+
+        dec = None
+        for start in range(0, b, batch_size):
+            chunk = decode_chunk(quant[start : start + batch_size])
+            if dec is None:
+                dec = chunk.new_empty((b,) + chunk.shape[1:])
+            dec[start : start + batch_size] = chunk
         return dec
 
-    def decode_code(self, code_b, shape=None, channel_first=True):
+    def _decode_tiles(self, quant, tile_size, tile_overlap):
+        b, _, h, w = quant.shape
+        f = self.upsample_factor
+        th, tw = min(tile_size, h), min(tile_size, w)
+        ys = _tile_starts(h, th, tile_overlap)
+        xs = _tile_starts(w, tw, tile_overlap)
+
+        # accumulate in float32, only the tiles run in the model dtype
+        dec = None
+        weight = quant.new_zeros((h * f, w * f), dtype=torch.float32)
+        for y in ys:
+            wy = _blend_weights(th * f, tile_overlap * f, y > ys[0], y < ys[-1])
+            for x in xs:
+                tile = self.decode(quant[:, :, y : y + th, x : x + tw])
+                if dec is None:
+                    dec = quant.new_zeros(
+                        (b, tile.shape[1], h * f, w * f), dtype=torch.float32
+                    )
+                wx = _blend_weights(tw * f, tile_overlap * f, x > xs[0], x < xs[-1])
+                tile_weight = (wy[:, None] * wx[None, :]).to(quant.device)
+                region = (slice(y * f, (y + th) * f), slice(x * f, (x + tw) * f))
+                dec[(slice(None), slice(None)) + region] += tile * tile_weight
+                weight[region] += tile_weight
+        return (dec / weight).to(quant.dtype)
+
+    def decode_code(
+        self,
+        code_b,
+        shape=None,
+        channel_first=True,
+        batch_size: Optional[int] = None,
+        tile_size: Optional[int] = None,
+        tile_overlap: Optional[int] = None,
+    ):
         quant_b = self.quantize.get_codebook_entry(code_b, shape, channel_first)
-        dec = self.decode(quant_b)
+        dec = self.decode(quant_b, batch_size, tile_size, tile_overlap)
         return dec
 
     def forward(self, input):
@@ -513,6 +589,26 @@ class VQModel(nn.Module):
         return dec, diff
 
 
+def _tile_starts(length, tile_size, tile_overlap):
+    # tiles every tile_size - tile_overlap positions, the last one flush with the end
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, tile_size - tile_overlap))
+    return starts + [length - tile_size]
+
+
+def _blend_weights(length, overlap, ramp_in, ramp_out):
+    # per pixel along one side of a tile: a linear ramp over the overlap shared with
+    # the previous (ramp_in) and the next (ramp_out) tile, 1 elsewhere; never 0
+    weights = torch.ones(length)
+    ramp = (torch.arange(overlap) + 0.5) / overlap
+    if ramp_in and overlap:
+        weights[:overlap] *= ramp
+    if ramp_out and overlap:
+        weights[length - overlap :] *= ramp.flip(0)
+    return weights
+
+
 #################################################################################
 #                              VQ Model Configs                                 #
 #################################################################################
@@ -0,0 +1,608 @@
+# Copyright (c) 2023-2024 DeepSeek.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Continuous batching of text-to-image requests for Janus.
+
+`ImageGenerationServer` keeps one decode batch running. Between two decode steps,
+waiting requests are admitted into free KV cache slots and finished ones are
+retired, so a new prompt starts sampling at the next step instead of waiting for
+the whole batch to finish all of its image tokens.
+
+Example:
+    server = ImageGenerationServer(ImageGenerator(vl_gpt, vl_chat_processor))
+    images = await asyncio.gather(
+        server.generate_images("A red fox in the snow", parallel_size=2),
+        server.generate_images("A lighthouse at dusk"),
+    )
+    print(server.metrics())
+
+    async for rows_done, images in server.stream_images("A red fox", preview_rows=4):
+        ...  # a preview every 4 rows of the token grid, then the finished images
+
+Running this module serves the model over HTTP, streaming the previews of each
+request as a chunked `multipart/x-mixed-replace` response that browsers render in
+place (requires fastapi and uvicorn, installed with gradio):
+
+    python -m janus.serving --model-path deepseek-ai/Janus-Pro-1B --port 8000
+    # open http://localhost:8000/generate?prompt=A+red+fox&parallel_size=2
+"""
+
+import asyncio
+import io
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import torch
+
+from janus.generation import (
+    ImageGenerator,
+    SlotKVCache,
+    StaticKVCache,
+    causal_mask,
+)
+
+
+@dataclass(eq=False)
+class GenerationRequest:
+    input_ids: torch.LongTensor
+    parallel_size: int
+    cfg_weight: float
+    temperature: float
+    generator: Optional[torch.Generator]
+    future: asyncio.Future
+    tokens: Optional[torch.Tensor] = None
+    step: int = 0
+    row: int = 0
+    # tokens are snapshotted every `preview_rows` rows of the grid, 0 disables previews
+    preview_rows: int = 0
+    preview: Optional[Tuple[int, torch.Tensor]] = None
+    preview_ready: Optional[asyncio.Event] = None
+
+    @property
+    def rows(self) -> int:
+        # a conditional and an unconditional sequence per image
+        return self.parallel_size * 2
+
+
+class ImageGenerationServer(object):
+    """
+
+    In-process scheduler running the image token loop of many requests in one batch.
+
+    Each image of a request takes two KV cache slots, its conditional and unconditional
+    sequence. A request's prompts are prefilled once and copied into its slots when it
+    is admitted; requests are admitted first come, first served, as soon as enough
+    slots are free. All model work runs on one background thread, so the event loop
+    stays responsive while the batch decodes.
+
+    Args:
+        image_generator (ImageGenerator): the model, processor and image settings
+        max_batch_size (int): KV cache slots, i.e. at most `max_batch_size // 2` images decode together
+        max_prompt_length (int): longest prompt in tokens a request may have
+        metrics_window (int): decode steps the `tokens_per_sec` metric averages over
+
+    """
+
+    def __init__(
+        self,
+        image_generator: ImageGenerator,
+        max_batch_size: int = 16,
+        max_prompt_length: int = 256,
+        metrics_window: int = 50,
+    ):
+        self.image_generator = image_generator
+        self.max_batch_size = max_batch_size
+        self.max_prompt_length = max_prompt_length
+        self.num_tokens = image_generator.image_token_num_per_image
+
+        self.waiting: deque = deque()
+        self.active: List[GenerationRequest] = []
+        self.cache: Optional[SlotKVCache] = None
+        self.prefill_cache: Optional[StaticKVCache] = None
+        self.hidden_states: Optional[torch.Tensor] = None
+
+        self.completed_requests = 0
+        self.generated_tokens = 0
+        self.steps = 0
+        self._recent_steps: deque = deque(maxlen=metrics_window)
+
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _allocate(self):
+        generator = self.image_generator
+        sizes = (
+            len(generator.llm.layers),
+            self.max_batch_size,
+            self.max_prompt_length + self.num_tokens,
+            generator.kv_heads,
+            generator.head_dim,
+            generator.dtype,
+            generator.device,
+        )
+        self.cache = SlotKVCache(*sizes)
+        self.prefill_cache = StaticKVCache(
+            sizes[0], 2, self.max_prompt_length, *sizes[3:]
+        )
+        self.hidden_states = torch.zeros(
+            (self.max_batch_size, generator.vl_gpt.language_model.config.hidden_size),
+            dtype=generator.dtype,
+            device=generator.device,
+        )
+
+    def submit(
+        self,
+        prompt: Union[str, torch.LongTensor],
+        parallel_size: int = 1,
+        cfg_weight: float = 5,
+        temperature: float = 1,
+        seed: Optional[int] = None,
+    ) -> asyncio.Future:
+        """
+
+        Queue a prompt for generation. Must be called from a running event loop.
+
+        Args:
+            prompt (str or torch.LongTensor): prompt text, or its ids from `ImageGenerator.prompt_ids`
+            parallel_size (int): number of images
+            cfg_weight (float): classifier-free guidance scale
+            temperature (float): sampling temperature
+            seed (int, optional): seed of this request's random generator
+
+        Returns:
+            future (asyncio.Future): resolves to the [parallel_size, image_token_num_per_image] image tokens
+        """
+
+        return self._enqueue(
+            prompt, parallel_size, cfg_weight, temperature, seed
+        ).future
+
+    def _enqueue(
+        self,
+        prompt: Union[str, torch.LongTensor],
+        parallel_size: int,
+        cfg_weight: float,
+        temperature: float,
+        seed: Optional[int],
+        preview_rows: int = 0,
+    ) -> GenerationRequest:
+        if parallel_size < 1:
+            raise ValueError(f"parallel_size must be at least 1, got {parallel_size}.")
+        if temperature <= 0:
+            raise ValueError(f"temperature must be positive, got {temperature}.")
+        if preview_rows < 0:
+            raise ValueError(f"preview_rows must not be negative, got {preview_rows}.")
+        input_ids = (
+            self.image_generator.prompt_ids(prompt) if isinstance(prompt, str) else prompt
+        )
+        if len(input_ids) > self.max_prompt_length:
+            raise ValueError(
+                f"Prompt has {len(input_ids)} tokens, the server accepts up to {self.max_prompt_length}."
+            )
+        if parallel_size * 2 > self.max_batch_size:
+            raise ValueError(
+                f"{parallel_size} images need {parallel_size * 2} slots, the server has {self.max_batch_size}."
+            )
+
+        generator = None
+        if seed is not None:
+            generator = torch.Generator(device=self.image_generator.device).manual_seed(seed)
+        loop = asyncio.get_running_loop()
+        request = GenerationRequest(
+            input_ids=input_ids,
+            parallel_size=parallel_size,
+            cfg_weight=cfg_weight,
+            temperature=temperature,
+            generator=generator,
+            future=loop.create_future(),
+            preview_rows=preview_rows,
+            preview_ready=asyncio.Event(),
+        )
+        self.waiting.append(request)
+
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._serve())
+        self._wakeup.set()
+        return request
+
+    async def generate(self, prompt: Union[str, torch.LongTensor], **kwargs) -> torch.Tensor:
+        """Image tokens for a prompt, see `submit` for the arguments."""
+        return await self.submit(prompt, **kwargs)
+
+    async def generate_images(
+        self, prompt: Union[str, torch.LongTensor], **kwargs
+    ) -> List[np.ndarray]:
+        """Images for a prompt as [h, w, 3] uint8 arrays, see `submit` for the arguments."""
+        tokens = await self.submit(prompt, **kwargs)
+        loop = asyncio.get_running_loop()
+        patches = await loop.run_in_executor(
+            self._executor, self.image_generator.decode, tokens
+        )
+        return list(self.image_generator.to_numpy(patches))
+
+    def stream_images(
+        self,
+        prompt: Union[str, torch.LongTensor],
+        parallel_size: int = 1,
+        cfg_weight: float = 5,
+        temperature: float = 1,
+        seed: Optional[int] = None,
+        preview_rows: int = 4,
+        placeholder_code: Optional[int] = None,
+    ) -> AsyncIterator[Tuple[int, List[np.ndarray]]]:
+        """
+
+        Queue a prompt and iterate over previews of its images while they are sampled.
+
+        The request is queued (and validated) right away. Previews are decoded on the
+        model thread, between two decode steps; a consumer that falls behind skips to
+        the latest preview. Closing the iterator early cancels the request.
+
+        Args:
+            preview_rows (int): rows of the token grid between two previews
+            placeholder_code (int, optional): see `ImageGenerator.preview`
+            other arguments: see `submit`
+
+        Returns:
+            An async iterator of (rows_done, images), as in `ImageGenerator.stream_images`.
+        """
+
+        request = self._enqueue(
+            prompt, parallel_size, cfg_weight, temperature, seed, preview_rows
+        )
+        return self._stream(request, placeholder_code)
+
+    async def _stream(
+        self, request: GenerationRequest, placeholder_code: Optional[int]
+    ) -> AsyncIterator[Tuple[int, List[np.ndarray]]]:
+        loop = asyncio.get_running_loop()
+        generator = self.image_generator
+        grid_width = generator.img_size // generator.patch_size
+        try:
+            while not request.future.done():
+                preview_ready = asyncio.ensure_future(request.preview_ready.wait())
+                await asyncio.wait(
+                    [preview_ready, request.future], return_when=asyncio.FIRST_COMPLETED
+                )
+                preview_ready.cancel()
+                # take the latest snapshot; `_serve` publishes it on this loop, so the
+                # event and the snapshot cannot change between these lines
+                request.preview_ready.clear()
+                snapshot, request.preview = request.preview, None
+                if snapshot is None or request.future.done():
+                    continue
+
+                num_sampled, tokens = snapshot
+                patches = await loop.run_in_executor(
+                    self._executor, generator.preview, tokens, num_sampled, placeholder_code
+                )
+                yield num_sampled // grid_width, list(generator.to_numpy(patches))
+
+            tokens = request.future.result()
+            patches = await loop.run_in_executor(self._executor, generator.decode, tokens)
+            yield self.num_tokens // grid_width, list(generator.to_numpy(patches))
+        finally:
+            # the consumer stopped early, e.g. an HTTP client disconnected: free the slots
+            if not request.future.done():
+                request.future.cancel()
+
+    def metrics(self) -> Dict[str, float]:
+        """Queue depth, batch occupancy and image tokens sampled per second over recent steps."""
+        seconds = sum(step_seconds for _, step_seconds in self._recent_steps)
+        tokens = sum(step_tokens for step_tokens, _ in self._recent_steps)
+        return {
+            "queue_depth": len(self.waiting),
+            "active_requests": len(self.active),
+            "active_images": sum(request.parallel_size for request in self.active),
+            "free_slots": self.max_batch_size - (self.cache.batch_size if self.cache else 0),
+            "completed_requests": self.completed_requests,
+            "generated_tokens": self.generated_tokens,
+            "steps": self.steps,
+            "tokens_per_sec": tokens / seconds if seconds > 0 else 0.0,
+        }
+
+    async def close(self):
+        """Stop the scheduler, failing any request that has not finished."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        for request in list(self.waiting) + self.active:
+            if not request.future.done():
+                request.future.cancel()
+        self.waiting.clear()
+        self.active = []
+        self._executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _serve(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.waiting and not self.active:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+
+            # admit waiting requests at the step boundary, oldest first; requests cancelled
+            # while queued are dropped first, so they never hold up the ones behind them
+            while self.waiting:
+                if self.waiting[0].future.cancelled():
+                    self.waiting.popleft()
+                    continue
+                if self._free_slots() < self.waiting[0].rows:
+                    break
+                request = self.waiting.popleft()
+                try:
+                    await loop.run_in_executor(self._executor, self._admit, request)
+                except Exception as e:
+                    request.future.set_exception(e)
+            if not self.active:
+                continue
+
+            try:
+                finished, previewed = await loop.run_in_executor(
+                    self._executor, self._step
+                )
+            except Exception as e:
+                # a failed step leaves the batch in an unknown state, so fail all of it
+                for request in self.active:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                self.active = []
+                await loop.run_in_executor(self._executor, self._reset)
+                continue
+
+            for request, snapshot in previewed:
+                request.preview = snapshot
+                request.preview_ready.set()
+            for request in finished:
+                if not request.future.done():
+                    request.future.set_result(request.tokens)
+                    self.completed_requests += 1
+
+    def _free_slots(self) -> int:
+        return self.max_batch_size - (self.cache.batch_size if self.cache else 0)
+
+    @torch.inference_mode()
+    def _reset(self):
+        """Empty the batch; the cache tensors are inference tensors, so this runs on the model thread too."""
+        self.cache.reset()
+
+    @torch.inference_mode()
+    def _admit(self, request: GenerationRequest):
+        """Prefill a request's conditional and unconditional prompt and give it slots in the batch."""
+        generator = self.image_generator
+        if self.cache is None:
+            self._allocate()
+        device = generator.device
+        prompt_length = len(request.input_ids)
+
+        tokens = request.input_ids.to(device).repeat(2, 1)
+        tokens[1, 1:-1] = generator.vl_chat_processor.pad_id
+        inputs_embeds = generator.vl_gpt.language_model.get_input_embeddings()(tokens)
+        position_ids = torch.arange(prompt_length, device=device).expand(2, -1)
+        mask = causal_mask(prompt_length, 0, inputs_embeds.dtype, device)
+        self.prefill_cache.reset(2)
+        hidden_states = generator.forward(
+            self.prefill_cache, inputs_embeds, position_ids, mask
+        )
+
+        row = self.cache.add(
+            self.prefill_cache.keys[:, :2, :, :prompt_length],
+            self.prefill_cache.values[:, :2, :, :prompt_length],
+            request.parallel_size,
+        )
+        n = request.parallel_size
+        self.hidden_states[row : row + n] = hidden_states[0, -1]
+        self.hidden_states[row + n : row + 2 * n] = hidden_states[1, -1]
+
+        request.row = row
+        request.tokens = torch.zeros(
+            (n, self.num_tokens), dtype=torch.int, device=device
+        )
+        self.active.append(request)
+
+    @torch.inference_mode()
+    def _step(
+        self,
+    ) -> Tuple[
+        List[GenerationRequest], List[Tuple[GenerationRequest, Tuple[int, torch.Tensor]]]
+    ]:
+        """
+
+        Sample one image token for every active image, retire finished requests and run
+        the batch one position further.
+
+        Returns:
+            (finished, previewed): retired requests, and (request, snapshot) pairs for the
+            requests with a new preview; `_serve` hands the snapshots over on the event loop
+        """
+
+        generator = self.image_generator
+        grid_width = generator.img_size // generator.patch_size
+        start = time.perf_counter()
+
+        next_tokens, previewed = [], []
+        for request in self.active:
+            rows = self.hidden_states[request.row : request.row + request.rows]
+            token = generator.sample(
+                rows, request.cfg_weight, request.temperature, request.generator
+            )
+            request.tokens[:, request.step] = token
+            request.step += 1
+            next_tokens.append(token)
+            if (
+                request.preview_rows
+                and request.step < self.num_tokens
+                and request.step % (request.preview_rows * grid_width) == 0
+            ):
+                previewed.append((request, (request.step, request.tokens.clone())))
+        sampled = sum(len(token) for token in next_tokens)
+
+        # retire finished and cancelled requests, later rows move down in the cache
+        finished = [
+            request
+            for request in self.active
+            if request.step == self.num_tokens or request.future.done()
+        ]
+        for request in reversed(finished):
+            self.cache.remove(request.row, request.rows)
+        next_tokens = [
+            token
+            for token, request in zip(next_tokens, self.active)
+            if request not in finished
+        ]
+        self.active = [request for request in self.active if request not in finished]
+        row = 0
+        for request in self.active:
+            request.row = row
+            row += request.rows
+
+        if self.active:
+            # both sequences of an image continue with the same token, embedded once
+            img_embeds = [
+                generator.vl_gpt.prepare_gen_img_embeds(token).repeat(2, 1)
+                for token in next_tokens
+            ]
+            inputs_embeds = torch.cat(img_embeds).unsqueeze(1)
+            mask = self.cache.step_mask(inputs_embeds.dtype)
+            hidden_states = generator.forward(
+                self.cache, inputs_embeds, self.cache.position_ids(), mask
+            )
+            self.hidden_states[: self.cache.batch_size] = hidden_states[:, -1]
+
+        self.steps += 1
+        self.generated_tokens += sampled
+        self._recent_steps.append((sampled, time.perf_counter() - start))
+        return finished, previewed
+
+
+def encode_frame(images: List[np.ndarray], image_format: str = "JPEG") -> bytes:
+    """One part of a `multipart/x-mixed-replace` stream: the images side by side."""
+    import PIL.Image
+
+    buffer = io.BytesIO()
+    PIL.Image.fromarray(np.concatenate(images, axis=1)).save(buffer, format=image_format)
+    header = f"--frame\r\nContent-Type: image/{image_format.lower()}\r\n\r\n"
+    return header.encode("ascii") + buffer.getvalue() + b"\r\n"
+
+
+def create_app(server: ImageGenerationServer):
+    """
+
+    FastAPI app serving `server`:
+
+    - `GET /generate?prompt=...&parallel_size=1&cfg_weight=5&temperature=1&seed=&preview_rows=4`
+      streams JPEG previews followed by the finished images as PNG, in one chunked
+      `multipart/x-mixed-replace` response. Out-of-range arguments (`parallel_size < 1`,
+      `temperature <= 0`, `preview_rows < 0`, too many images or prompt tokens) get a
+      400 response;
+    - `GET /metrics` returns `server.metrics()`.
+
+    """
+
+    from fastapi import FastAPI, HTTPException
+    from fastapi.responses import StreamingResponse
+
+    app = FastAPI(title="Janus image generation")
+    rows_per_image = server.num_tokens // (
+        server.image_generator.img_size // server.image_generator.patch_size
+    )
+
+    @app.get("/generate")
+    async def generate(
+        prompt: str,
+        parallel_size: int = 1,
+        cfg_weight: float = 5,
+        temperature: float = 1,
+        seed: Optional[int] = None,
+        preview_rows: int = 4,
+    ):
+        try:
+            frames = server.stream_images(
+                prompt, parallel_size, cfg_weight, temperature, seed, preview_rows
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        async def body():
+            async for rows_done, images in frames:
+                image_format = "PNG" if rows_done == rows_per_image else "JPEG"
+                yield encode_frame(images, image_format)
+
+        return StreamingResponse(
+            body(), media_type="multipart/x-mixed-replace; boundary=frame"
+        )
+
+    @app.get("/metrics")
+    async def metrics():
+        return server.metrics()
+
+    return app
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import uvicorn
+    from transformers import AutoConfig, AutoModelForCausalLM
+
+    from janus.models import VLChatProcessor
+
+    parser = argparse.ArgumentParser(description="Serve Janus text-to-image generation over HTTP")
+    parser.add_argument("--model-path", default="deepseek-ai/Janus-Pro-1B")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=16, help="KV cache slots, two per image")
+    parser.add_argument("--decode-batch-size", type=int, default=None, help="images per VQ decode call")
+    args = parser.parse_args()
+
+    config = AutoConfig.from_pretrained(args.model_path)
+    language_config = config.language_config
+    language_config._attn_implementation = "eager"
+    vl_gpt = AutoModelForCausalLM.from_pretrained(
+        args.model_path, language_config=language_config, trust_remote_code=True
+    )
+    if torch.cuda.is_available():
+        vl_gpt = vl_gpt.to(torch.bfloat16).cuda()
+    else:
+        vl_gpt = vl_gpt.to(torch.float16)
+    vl_gpt = vl_gpt.eval()
+    vl_chat_processor = VLChatProcessor.from_pretrained(args.model_path)
+
+    server = ImageGenerationServer(
+        ImageGenerator(
+            vl_gpt, vl_chat_processor, decode_batch_size=args.decode_batch_size
+        ),
+        max_batch_size=args.max_batch_size,
+    )
+    uvicorn.run(create_app(server), host=args.host, port=args.port)
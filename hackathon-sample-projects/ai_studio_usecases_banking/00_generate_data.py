@@ -1,122 +1,233 @@
+import argparse
+import os
 from pathlib import Path
 import pandas as pd
-import numpy as np  
+import numpy as np
 
 # Generate comprehensive banking dataset and save it as a single CSV
 # Create data directory
 data_dir = Path('data')
 data_dir.mkdir(exist_ok=True)
 
-def generate_comprehensive_banking_dataset(num_customers=1000):
-    print(f"Generating comprehensive banking dataset for {num_customers} customers...")
-    
-    # Product categories
-    products = [
-        'premium_credit_card', 
-        'mortgage_refinance', 
-        'investment_account',
-        'high_yield_savings', 
-        'personal_loan'
-    ]
-    
-    # Customer segments
-    segments = [
-        'Premium', 
-        'Standard', 
-        'Basic', 
-        'Student', 
-        'Senior'
-    ]
-    
-    # Risk profiles
-    risk_profiles = [
-        'Conservative',
-        'Moderate',
-        'Aggressive',
-        'Very Conservative',
-        'Very Aggressive'
-    ]
-    
+# Product categories
+PRODUCTS = [
+    'premium_credit_card',
+    'mortgage_refinance',
+    'investment_account',
+    'high_yield_savings',
+    'personal_loan'
+]
+
+# Customer segments
+SEGMENTS = [
+    'Premium',
+    'Standard',
+    'Basic',
+    'Student',
+    'Senior'
+]
+
+# Risk profiles
+RISK_PROFILES = [
+    'Conservative',
+    'Moderate',
+    'Aggressive',
+    'Very Conservative',
+    'Very Aggressive'
+]
+
+# Rows generated, formatted and written at a time; bounds peak memory
+DEFAULT_CHUNK_SIZE = 100_000
+DEFAULT_SEED = 42
+
+
+# Per-customer description; fields are filled in order by `format_customer_descriptions`
+DESCRIPTION_TEMPLATE = """Customer Profile:
+Age: %d
+Income: $%.2f yearly ($%.2f monthly)
+Credit Score: %d
+Account Balance: $%.2f
+Total Assets: $%.2f
+Monthly Expenses: $%.2f
+Savings Ratio: %.2f
+Debt-to-Income Ratio: %.2f
+Tenure: %d months
+Current Products: %d
+Customer Segment: %s
+Risk Profile: %s
+Last Interaction: %d days ago
+Active Investment: %s
+Has Mortgage: %s
+Has Loan: %s
+Has Credit Card: %s
+Premium Credit Card: %s
+Mortgage Refinance: %s
+Investment Account: %s
+High Yield Savings: %s
+Personal Loan: %s
+"""
+
+DESCRIPTION_COLUMNS = [
+    'age', 'income', 'monthly_income', 'credit_score', 'account_balance', 'total_assets',
+    'monthly_expenses', 'savings_ratio', 'debt_to_income', 'tenure_months', 'num_products',
+    'segment', 'risk_profile', 'last_interaction_days'
+]
+
+DESCRIPTION_FLAGS = [
+    'active_investment', 'has_mortgage', 'has_loan', 'has_credit_card',
+    'has_premium_credit_card', 'has_mortgage_refinance', 'has_investment_account',
+    'has_high_yield_savings', 'has_personal_loan'
+]
+
+YES_NO = np.array(['No', 'Yes'], dtype=object)
+
+
+def format_customer_descriptions(dataset):
+    """
+    Build the `customer_description` column for a whole chunk.
+
+    Columns are converted to Python lists in bulk and each description is a single
+    C-level `%` format of DESCRIPTION_TEMPLATE, instead of a DataFrame row per customer.
+    """
+    fields = [dataset[column].tolist() for column in DESCRIPTION_COLUMNS]
+    fields += [YES_NO[dataset[flag].to_numpy()].tolist() for flag in DESCRIPTION_FLAGS]
+    return [DESCRIPTION_TEMPLATE % values for values in zip(*fields)]
+
+
+def generate_customer_chunk(first_customer_id, num_customers, rng):
+    """
+    Generate one chunk of customers, including their descriptions.
+
+    Args:
+        first_customer_id (int): customer_id of the first row in the chunk.
+        num_customers (int): Rows in the chunk.
+        rng (numpy.random.Generator): Random source for this chunk.
+
+    Returns:
+        pandas.DataFrame: The chunk, with the same columns as the full dataset.
+    """
     # Generate the main customer dataset
     dataset = pd.DataFrame({
-        'customer_id': range(1, num_customers + 1),
-        'age': np.random.randint(18, 80, num_customers),
-        'income': np.round(np.random.normal(70000, 30000, num_customers), 2),
-        'credit_score': np.random.randint(300, 850, num_customers),
-        'account_balance': np.round(np.random.lognormal(10, 1, num_customers), 2),
-        'tenure_months': np.random.randint(1, 240, num_customers),
-        'num_products': np.random.randint(1, 5, num_customers),
-        'active_investment': np.random.randint(0, 2, num_customers),
-        'has_mortgage': np.random.randint(0, 2, num_customers),
-        'has_loan': np.random.randint(0, 2, num_customers),
-        'has_credit_card': np.random.randint(0, 2, num_customers),
-        'segment': np.random.choice(segments, num_customers),
-        'risk_profile': np.random.choice(risk_profiles, num_customers),
-        'total_assets': np.round(np.random.lognormal(11, 1.5, num_customers), 2),
-        'monthly_expenses': np.round(np.random.normal(3000, 1500, num_customers), 2),
-        'last_interaction_days': np.random.randint(1, 100, num_customers)
+        'customer_id': np.arange(first_customer_id, first_customer_id + num_customers),
+        'age': rng.integers(18, 80, num_customers),
+        'income': np.round(rng.normal(70000, 30000, num_customers), 2),
+        'credit_score': rng.integers(300, 850, num_customers),
+        'account_balance': np.round(rng.lognormal(10, 1, num_customers), 2),
+        'tenure_months': rng.integers(1, 240, num_customers),
+        'num_products': rng.integers(1, 5, num_customers),
+        'active_investment': rng.integers(0, 2, num_customers),
+        'has_mortgage': rng.integers(0, 2, num_customers),
+        'has_loan': rng.integers(0, 2, num_customers),
+        'has_credit_card': rng.integers(0, 2, num_customers),
+        'segment': rng.choice(SEGMENTS, num_customers),
+        'risk_profile': rng.choice(RISK_PROFILES, num_customers),
+        'total_assets': np.round(rng.lognormal(11, 1.5, num_customers), 2),
+        'monthly_expenses': np.round(rng.normal(3000, 1500, num_customers), 2),
+        'last_interaction_days': rng.integers(1, 100, num_customers)
     })
-    
+
     # Add product ownership and potential recommendation flags
-    for product in products:
+    for product in PRODUCTS:
         # Current ownership
-        dataset[f'has_{product}'] = np.random.randint(0, 2, num_customers)
-        
-        # Recommendation strength (0-100 score)
-        dataset[f'recommend_{product}'] = np.random.randint(0, 101, num_customers)
-        
-        # For customers who already have the product, set recommendation to 0
-        dataset.loc[dataset[f'has_{product}'] == 1, f'recommend_{product}'] = 0
-    
+        owned = rng.integers(0, 2, num_customers)
+        dataset[f'has_{product}'] = owned
+
+        # Recommendation strength (0-100 score), 0 for customers who already have the product
+        dataset[f'recommend_{product}'] = np.where(owned == 1, 0, rng.integers(0, 101, num_customers))
+
     # Calculate monthly income and round to 2 decimal places
     dataset['monthly_income'] = np.round(dataset['income'] / 12, 2)
-    
+
     # Calculate debt-to-income ratio
-    dataset['debt_to_income'] = np.round(np.random.uniform(0.1, 0.6, num_customers), 2)
-    
-    # Calculate savings ratio
-    dataset['savings_ratio'] = np.round((dataset['monthly_income'] - dataset['monthly_expenses']) / dataset['monthly_income'], 2)
-    dataset.loc[dataset['savings_ratio'] < 0, 'savings_ratio'] = 0
-    dataset.loc[dataset['savings_ratio'] > 0.7, 'savings_ratio'] = 0.7
-    
+    dataset['debt_to_income'] = np.round(rng.uniform(0.1, 0.6, num_customers), 2)
+
+    # Calculate savings ratio, clipped to [0, 0.7]
+    savings_ratio = np.round((dataset['monthly_income'] - dataset['monthly_expenses']) / dataset['monthly_income'], 2)
+    dataset['savings_ratio'] = savings_ratio.clip(0, 0.7)
+
     # Create text descriptions for each customer
-    descriptions = []
-    for _, row in dataset.iterrows():
-        desc = f"""Customer Profile:
-Age: {row['age']}
-Income: ${row['income']:.2f} yearly (${row['monthly_income']:.2f} monthly)
-Credit Score: {row['credit_score']}
-Account Balance: ${row['account_balance']:.2f}
-Total Assets: ${row['total_assets']:.2f}
-Monthly Expenses: ${row['monthly_expenses']:.2f}
-Savings Ratio: {row['savings_ratio']:.2f}
-Debt-to-Income Ratio: {row['debt_to_income']:.2f}
-Tenure: {row['tenure_months']} months
-Current Products: {row['num_products']}
-Customer Segment: {row['segment']}
-Risk Profile: {row['risk_profile']}
-Last Interaction: {row['last_interaction_days']} days ago
-Active Investment: {'Yes' if row['active_investment'] else 'No'}
-Has Mortgage: {'Yes' if row['has_mortgage'] else 'No'}
-Has Loan: {'Yes' if row['has_loan'] else 'No'}
-Has Credit Card: {'Yes' if row['has_credit_card'] else 'No'}
-Premium Credit Card: {'Yes' if row['has_premium_credit_card'] else 'No'}
-Mortgage Refinance: {'Yes' if row['has_mortgage_refinance'] else 'No'}
-Investment Account: {'Yes' if row['has_investment_account'] else 'No'}
-High Yield Savings: {'Yes' if row['has_high_yield_savings'] else 'No'}
-Personal Loan: {'Yes' if row['has_personal_loan'] else 'No'}
-"""
-        descriptions.append(desc)
-    
-    # Add the descriptions to the dataset
-    dataset['customer_description'] = descriptions
-    
+    dataset['customer_description'] = format_customer_descriptions(dataset)
+
+    return dataset
+
+
+def iter_banking_chunks(num_customers, chunk_size=DEFAULT_CHUNK_SIZE, seed=DEFAULT_SEED):
+    """
+    Yield the dataset as DataFrames of at most `chunk_size` customers.
+
+    Chunk i draws from its own generator seeded with (seed, i), so a chunk's rows depend
+    only on the seed, the chunk size and its position, never on what was generated before.
+    """
+    for chunk_index, start in enumerate(range(0, num_customers, chunk_size)):
+        rng = np.random.default_rng([seed, chunk_index])
+        yield generate_customer_chunk(start + 1, min(chunk_size, num_customers - start), rng)
+
+
+def write_banking_dataset(num_customers, output_path, chunk_size=DEFAULT_CHUNK_SIZE, seed=DEFAULT_SEED):
+    """
+    Stream the dataset to a CSV or Parquet file, one chunk at a time.
+
+    Memory stays bounded by `chunk_size`, so this scales to hundreds of millions of rows.
+    The file is written next to `output_path` and renamed into place when complete.
+
+    Args:
+        num_customers (int): Total number of customers.
+        output_path (str or Path): Destination; a `.parquet` suffix writes Parquet, anything else CSV.
+        chunk_size (int): Customers per chunk (and per Parquet row group).
+        seed (int): Base seed; the same seed and chunk size always produce the same file.
+    """
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output_path.with_name(output_path.name + ".tmp")
+    use_parquet = output_path.suffix == ".parquet"
+
+    writer = None
+    written = 0
+    try:
+        for chunk in iter_banking_chunks(num_customers, chunk_size, seed):
+            if use_parquet:
+                # Imported lazily so CSV output does not need pyarrow
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_path, table.schema)
+                writer.write_table(table)
+            else:
+                chunk.to_csv(tmp_path, mode='w' if written == 0 else 'a', header=written == 0, index=False)
+            written += len(chunk)
+            print(f"Wrote {written}/{num_customers} customers")
+    finally:
+        if writer is not None:
+            writer.close()
+
+    os.replace(tmp_path, output_path)
+    print(f"Comprehensive banking dataset saved to {output_path}")
+
+
+def generate_comprehensive_banking_dataset(num_customers=1000, seed=DEFAULT_SEED):
+    """Generate the dataset in memory, save it as CSV and return it (for small datasets)."""
+    print(f"Generating comprehensive banking dataset for {num_customers} customers...")
+
+    dataset = pd.concat(list(iter_banking_chunks(num_customers, seed=seed)), ignore_index=True)
+
     # Save the comprehensive dataset
     dataset.to_csv(data_dir / 'banking_dataset.csv', index=False)
-    
+
     print(f"Comprehensive banking dataset saved to {data_dir / 'banking_dataset.csv'}")
-    
+
     return dataset
 
-# Generate the comprehensive dataset
-banking_dataset = generate_comprehensive_banking_dataset(1000)
\ No newline at end of file
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the synthetic banking dataset")
+    parser.add_argument("--num-customers", type=int, default=1000)
+    parser.add_argument("--output", default=str(data_dir / 'banking_dataset.csv'),
+                        help="Output file; use a .parquet suffix for Parquet")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    args = parser.parse_args()
+
+    # Generate the comprehensive dataset
+    write_banking_dataset(args.num_customers, args.output, chunk_size=args.chunk_size, seed=args.seed)
@@ -5,6 +5,40 @@ import torch
 from pathlib import Path
 from sentence_transformers import SentenceTransformer
 
+from customer_neighbors import CustomerIdIndex, iter_top_k_neighbors, write_neighbors_table
+from parallel_embedding import ParallelEncoder, should_use_process_pool
+from quantization import SALT_SUFFIX, is_quantized, quantize_linear_layers
+from scalar_quantization import load_embeddings, quantized_path, write_quantized
+from streaming_embedding import DEFAULT_CHUNK_ROWS, stream_embeddings
+from token_batching import DEFAULT_MAX_TOKENS, TokenBatchEncoder
+
+# Model name mixed into the content hashes so a model change re-embeds every customer
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+MODEL_DIR = "model/sentence-transformer"
+
+# Worker processes for CPU encoding: None uses every core for large inputs, 1 disables the pool
+EMBEDDING_WORKERS = None
+
+# Padded tokens per encoding batch: None tunes the budget on this machine for large inputs
+EMBEDDING_MAX_TOKENS = None
+
+# Opt in to int8 linear layers when running on CPU; check the accuracy drift with
+# `python quantization.py` first
+EMBEDDING_QUANTIZE = False
+
+# Storage dtype searched by the neighbours job and the deployed model: "float32", or
+# "float16" / "int8" to also write a smaller quantized copy of the embeddings
+# (check the recall against float32 with `python scalar_quantization.py`)
+EMBEDDING_STORAGE = "float32"
+
+# Opt in to rebuilding data/customer_neighbors.csv after embedding. The all-pairs
+# top-k job grows with the square of the customer count; it can also be run on its
+# own with `python customer_neighbors.py`
+WRITE_NEIGHBORS = False
+
+# Columns that make up the text embedded for each customer
+DESCRIPTION_COLUMNS = ['customer_id', 'age', 'income', 'credit_score', 'segment', 'risk_profile']
+
 
 def download_model():
     """Download the sentence-transformers model if it doesn't exist locally"""
@@ -47,23 +81,95 @@ def load_model():
         model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
         print("Sentence transformer model loaded successfully from Hugging Face!")
     
+    # int8 kernels only run on CPU, so a GPU keeps the fp32 model
+    if EMBEDDING_QUANTIZE and model.device.type == "cpu":
+        model = quantize_linear_layers(model)
+        print("Using int8 quantized linear layers")
+    
     return model
 
 
-def generate_embeddings(model, texts, batch_size=32):
-    """Generate embeddings for texts using sentence-transformers"""
-    print(f"Generating embeddings for {len(texts)} texts in batches of {batch_size}")
+def make_pool(encoder, num_workers=EMBEDDING_WORKERS):
+    """
+    Worker pool that encodes like `encoder`, loading the model from MODEL_DIR.
+    
+    The workers start on the first large input and stay up until the pool is closed.
+    """
+    model = encoder.model
+    return ParallelEncoder(
+        MODEL_DIR,
+        model.get_sentence_embedding_dimension(),
+        num_workers=num_workers,
+        quantize=is_quantized(model)
+    )
+
+def generate_embeddings(encoder, texts, num_workers=EMBEDDING_WORKERS, pool=None):
+    """
+    Generate embeddings for texts using sentence-transformers.
     
-    # SentenceTransformer's encode method handles batching internally
-    embeddings = model.encode(texts, batch_size=batch_size, show_progress_bar=True)
+    `encoder` is a TokenBatchEncoder wrapping the loaded model: batches are sized by
+    padded token count rather than by number of texts. On CPU, large inputs are sharded
+    across worker processes that each load the model from MODEL_DIR; on GPU, or with
+    num_workers=1, the loaded model encodes everything. Either way the token budget is
+    tuned on the first large input (in this process, for the workers) and the throughput
+    is reported in tokens/sec. `pool`, from `make_pool`, keeps the worker processes up
+    across calls.
+    """
+    model = encoder.model
+    print(f"Generating embeddings for {len(texts)} texts")
+    
+    if should_use_process_pool(model, len(texts), num_workers) and os.path.exists(MODEL_DIR):
+        if pool is not None:
+            return pool.encode(texts, encoder)
+        with make_pool(encoder, num_workers) as pool:
+            return pool.encode(texts, encoder)
+    
+    # Tunes the token budget on the first large input, then reports tokens/sec
+    embeddings = encoder.encode(texts, show_progress_bar=True)
     
     return embeddings
 
 
-def embed_banking_data(model):
-    """Generate and save embeddings for banking customer data"""
+def build_descriptions(df):
+    """Create the text embedded for each customer in a chunk of the banking dataset"""
+    return [
+        f"Customer ID: {customer_id}, Age: {age}, Income: ${income}, "
+        f"Credit Score: {credit_score}, Segment: {segment}, Risk: {risk_profile}"
+        for customer_id, age, income, credit_score, segment, risk_profile
+        in zip(*(df[column].tolist() for column in DESCRIPTION_COLUMNS))
+    ]
+
+
+def read_descriptions(data_file, rows, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Return the descriptions of the given dataset rows, reading the file in chunks"""
+    rows = np.asarray(rows, dtype=np.int64)
+    found = {}
+    first = 0
+    for chunk in pd.read_csv(data_file, usecols=DESCRIPTION_COLUMNS, chunksize=chunk_rows):
+        in_chunk = rows[(rows >= first) & (rows < first + len(chunk))]
+        found.update(zip(in_chunk.tolist(), build_descriptions(chunk.iloc[in_chunk - first])))
+        first += len(chunk)
+        if len(found) == len(set(rows.tolist())):
+            break
+    return [found[row] for row in rows.tolist()]
+
+
+def embed_banking_data(model, incremental=True, chunk_rows=DEFAULT_CHUNK_ROWS, write_neighbors=WRITE_NEIGHBORS):
+    """
+    Generate and save embeddings for banking customer data.
+    
+    The dataset is streamed in chunks of `chunk_rows` customers (read, describe, encode,
+    append), so memory does not grow with the number of customers, and an interrupted
+    run resumes after the last completed chunk. With `incremental`, customers whose
+    description hash matches the previous run keep their stored vector and only new or
+    changed customers are embedded. With `write_neighbors`, the top-k similar customers
+    of every customer are then written to data/customer_neighbors.csv.
+    """
     # Setup paths
     data_file = "data/banking_dataset.csv"
+    embeddings_file = "data/customer_embeddings.npy"
+    manifest_file = "data/customer_embeddings_hashes.npy"
+    neighbors_file = "data/customer_neighbors.csv"
     os.makedirs("data", exist_ok=True)
     
     # Check for data file
@@ -71,62 +177,83 @@ def embed_banking_data(model):
         print(f"Banking dataset not found at {data_file}")
         return
     
-    # Load and process data
-    df = pd.read_csv(data_file)
-    print(f"Processing {len(df)} customers")
+    # One encoder for the whole run, so the token budget is tuned at most once
+    encoder = TokenBatchEncoder(model, EMBEDDING_MAX_TOKENS)
+    
+    # Stream the customers through the embedding pipeline, saving them with their hashes;
+    # on CPU, one worker pool encodes every chunk
+    print(f"Generating embeddings for {data_file} in chunks of {chunk_rows} customers")
+    with make_pool(encoder) as pool:
+        stats = stream_embeddings(
+            data_file,
+            build_descriptions,
+            lambda texts: generate_embeddings(encoder, texts, pool=pool),
+            embeddings_file,
+            manifest_file,
+            salt=EMBEDDING_MODEL_NAME + (SALT_SUFFIX if is_quantized(model) else ""),
+            chunk_rows=chunk_rows,
+            reuse_previous=incremental,
+            read_csv_kwargs={"usecols": DESCRIPTION_COLUMNS}
+        )
+    print(f"Embedded {stats['embedded']} customers, reused {stats['reused']}, "
+          f"recovered {stats['resumed']} from a checkpoint")
+    
+    print(f"Embeddings saved to {embeddings_file}")
+    
+    # The float32 file stays the source for incremental runs; search uses the stored dtype
+    search_file = quantized_path(embeddings_file, EMBEDDING_STORAGE)
+    if search_file != embeddings_file:
+        write_quantized(np.load(embeddings_file, mmap_mode="r"), search_file, EMBEDDING_STORAGE)
     
-    # Create descriptions - remove slice to process all customers
-    descriptions = []
-    for _, row in df.iterrows():  # Removed the slice to process all customers
-        desc = f"Customer ID: {row['customer_id']}, Age: {row['age']}, Income: ${row['income']}, " + \
-               f"Credit Score: {row['credit_score']}, Segment: {row['segment']}, Risk: {row['risk_profile']}"
-        descriptions.append(desc)
+    embeddings = load_embeddings(search_file)
+    customer_ids = pd.read_csv(data_file, usecols=['customer_id'])['customer_id'].to_numpy()
     
-    # Generate and save embeddings
-    print(f"Generating embeddings for {len(descriptions)} customers")
-    embeddings = generate_embeddings(model, descriptions)
-    np.save("data/customer_embeddings.npy", embeddings)
+    # Top-k similar customers for every customer, for campaign targeting
+    if write_neighbors:
+        write_neighbors_table(embeddings, customer_ids, neighbors_file)
     
     # Demo similarity search
-    find_similar_customers(embeddings, descriptions, customer_id=1)
-    print(f"Embeddings saved to data/customer_embeddings.npy")
+    find_similar_customers(
+        embeddings,
+        lambda rows: read_descriptions(data_file, rows, chunk_rows),
+        customer_id=1,
+        customer_ids=customer_ids
+    )
 
 
-def find_similar_customers(embeddings, descriptions, customer_id=1, top_n=3):
-    """Find customers similar to the target customer based on embeddings"""
-    # Find the index of the target customer (assuming customer_ids start at 1)
-    target_idx = customer_id - 1
+def find_similar_customers(embeddings, descriptions, customer_id=1, top_n=3, customer_ids=None):
+    """
+    Find customers similar to the target customer based on embeddings.
     
-    if target_idx < 0 or target_idx >= len(embeddings):
+    `descriptions` is either a list with one description per row or a function that
+    returns the descriptions of a list of rows.
+    """
+    # Map the customer id to its embedding row (ids default to 1..N in row order)
+    if customer_ids is None:
+        customer_ids = np.arange(1, len(embeddings) + 1)
+    
+    try:
+        target_idx = CustomerIdIndex(customer_ids).row(customer_id)
+    except KeyError:
         print(f"Customer ID {customer_id} not found in embeddings")
         return
     
-    # Get the target embedding
-    target_embedding = embeddings[target_idx]
-    
-    # Calculate cosine similarity using numpy operations
-    from sklearn.metrics.pairwise import cosine_similarity
-    
-    # Reshape to 2D arrays as required by sklearn
-    target_embedding_2d = target_embedding.reshape(1, -1)
-    all_embeddings = embeddings.reshape(embeddings.shape[0], -1)
+    # Top-n neighbours with the target itself excluded inside the similarity kernel
+    _, neighbor_rows, similarities = next(iter_top_k_neighbors(embeddings, top_n, query_rows=[target_idx]))
     
-    # Compute similarity
-    similarities = cosine_similarity(target_embedding_2d, all_embeddings)[0]
-    
-    # Create list of (index, similarity) tuples, excluding the target customer
-    similarity_scores = [(i, similarities[i]) for i in range(len(similarities)) if i != target_idx]
-    
-    # Sort by similarity (descending)
-    similarity_scores.sort(key=lambda x: x[1], reverse=True)
+    # Look up only the descriptions that are printed
+    rows = [target_idx] + neighbor_rows[0].tolist()
+    if callable(descriptions):
+        texts = descriptions(rows)
+    else:
+        texts = [descriptions[row] for row in rows]
     
     # Print the results
-    print(f"\nTarget customer: {descriptions[target_idx]}")
+    print(f"\nTarget customer: {texts[0]}")
     print(f"\nTop {top_n} similar customers:")
-    for i in range(min(top_n, len(similarity_scores))):
-        idx, similarity = similarity_scores[i]
+    for text, similarity in zip(texts[1:], similarities[0]):
         print(f"Similarity: {similarity:.4f}")
-        print(f"Customer: {descriptions[idx]}")
+        print(f"Customer: {text}")
         print("-" * 50)
 
 
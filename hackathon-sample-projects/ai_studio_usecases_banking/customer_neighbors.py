@@ -0,0 +1,194 @@
+"""
+Top-k similar customers for every customer in the banking base.
+
+Cosine similarities are computed in tiles of `row_block` x `col_block`, so memory stays
+bounded no matter how many customers there are. Each tile's best candidates are merged
+into a running top-k per row, and a customer's own column is masked out inside the tile
+so a customer is never its own neighbour. Rows are mapped to customer ids through an
+explicit id index instead of assuming `customer_id - 1` is the row number.
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from scalar_quantization import load_embeddings
+
+DEFAULT_K = 10
+DEFAULT_ROW_BLOCK = 1024
+DEFAULT_COL_BLOCK = 16384
+
+
+def normalize_rows(matrix):
+    """Return a float32 copy of `matrix` with unit-length rows; zero rows stay zero."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+class CustomerIdIndex:
+    """Maps customer ids to embedding rows and back."""
+
+    def __init__(self, customer_ids):
+        """
+        Args:
+            customer_ids (array-like): Customer id of each embedding row, in row order.
+        """
+        self.ids = np.asarray(customer_ids)
+        self._index = pd.Index(self.ids)
+        if not self._index.is_unique:
+            raise ValueError("Customer ids must be unique")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rows(self, customer_ids):
+        """Return the embedding rows of the given customer ids; raises KeyError for unknown ids."""
+        rows = self._index.get_indexer(np.atleast_1d(customer_ids))
+        if (rows < 0).any():
+            missing = np.atleast_1d(customer_ids)[rows < 0]
+            raise KeyError(f"Unknown customer ids: {missing[:10].tolist()}")
+        return rows
+
+    def row(self, customer_id):
+        return int(self.rows(customer_id)[0])
+
+
+def _merge_top_k(best_scores, best_rows, scores, rows, k):
+    """Keep the k highest scores per row out of the running best and a new candidate set."""
+    scores = np.concatenate([best_scores, scores], axis=1)
+    rows = np.concatenate([best_rows, rows], axis=1)
+    keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(scores, keep, axis=1), np.take_along_axis(rows, keep, axis=1)
+
+
+def iter_top_k_neighbors(embeddings, k=DEFAULT_K, query_rows=None, row_block=DEFAULT_ROW_BLOCK,
+                         col_block=DEFAULT_COL_BLOCK):
+    """
+    Yield the k most similar other rows for blocks of query rows.
+
+    Args:
+        embeddings (numpy.ndarray or QuantizedEmbeddings): Matrix of shape [rows, dim]; may
+            be a memory map or quantized storage, which is dequantized one tile at a time.
+        k (int): Neighbours per query, capped at rows - 1.
+        query_rows (numpy.ndarray, optional): Rows to find neighbours for. Defaults to all rows.
+        row_block (int): Query rows per tile.
+        col_block (int): Candidate rows per tile.
+
+    Yields:
+        tuple: (query rows, neighbour rows [block, k], cosine similarities [block, k]),
+        neighbours sorted from most to least similar.
+    """
+    num_rows = len(embeddings)
+    k = min(k, num_rows - 1)
+    if query_rows is None:
+        query_rows = np.arange(num_rows)
+    query_rows = np.asarray(query_rows, dtype=np.int64)
+    if k <= 0:
+        for start in range(0, len(query_rows), row_block):
+            block = query_rows[start:start + row_block]
+            yield block, np.empty((len(block), 0), dtype=np.int64), np.empty((len(block), 0), dtype=np.float32)
+        return
+
+    for start in range(0, len(query_rows), row_block):
+        block = query_rows[start:start + row_block]
+        queries = normalize_rows(embeddings[np.sort(block)])[np.argsort(np.argsort(block))]
+        best_scores = np.full((len(block), 0), -np.inf, dtype=np.float32)
+        best_rows = np.empty((len(block), 0), dtype=np.int64)
+
+        for col_start in range(0, num_rows, col_block):
+            col_stop = min(col_start + col_block, num_rows)
+            scores = queries @ normalize_rows(embeddings[col_start:col_stop]).T
+
+            # Mask each query's own column if it falls inside this tile
+            own = (block >= col_start) & (block < col_stop)
+            scores[np.flatnonzero(own), block[own] - col_start] = -np.inf
+
+            # Shortlist the tile before merging so the merge stays k + k wide
+            tile_k = min(k, col_stop - col_start)
+            candidates = np.argpartition(-scores, tile_k - 1, axis=1)[:, :tile_k]
+            best_scores, best_rows = _merge_top_k(
+                best_scores, best_rows,
+                np.take_along_axis(scores, candidates, axis=1), candidates + col_start,
+                min(k, best_scores.shape[1] + tile_k)
+            )
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        yield block, np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+def neighbors_frame(id_index, query_rows, neighbor_rows, scores):
+    """Convert one block of results to the long neighbours table format."""
+    k = neighbor_rows.shape[1]
+    return pd.DataFrame({
+        "customer_id": np.repeat(id_index.ids[query_rows], k),
+        "rank": np.tile(np.arange(1, k + 1), len(query_rows)),
+        "neighbor_id": id_index.ids[neighbor_rows.ravel()],
+        "similarity": scores.ravel(),
+    })
+
+
+def write_neighbors_table(embeddings, customer_ids, output_path, k=DEFAULT_K, row_block=DEFAULT_ROW_BLOCK,
+                          col_block=DEFAULT_COL_BLOCK):
+    """
+    Compute the top-k neighbours of every customer and stream them to a table.
+
+    The table has one row per (customer_id, rank) with the neighbour's customer id and
+    cosine similarity. A `.parquet` suffix writes Parquet (requires pyarrow), anything
+    else CSV. Results are written block by block, and the file is renamed into place
+    once complete.
+
+    Args:
+        embeddings (numpy.ndarray): Customer embeddings of shape [rows, dim].
+        customer_ids (array-like): Customer id of each embedding row.
+        output_path (str): Destination file.
+        k (int): Neighbours per customer.
+        row_block (int): Query rows per tile.
+        col_block (int): Candidate rows per tile.
+    """
+    id_index = CustomerIdIndex(customer_ids)
+    if len(id_index) != len(embeddings):
+        raise ValueError(f"Got {len(id_index)} customer ids for {len(embeddings)} embeddings")
+
+    tmp_path = f"{output_path}.tmp"
+    use_parquet = output_path.endswith(".parquet")
+    writer = None
+    done = 0
+    try:
+        for query_rows, neighbor_rows, scores in iter_top_k_neighbors(embeddings, k, None, row_block, col_block):
+            frame = neighbors_frame(id_index, query_rows, neighbor_rows, scores)
+            if use_parquet:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+
+                table = pa.Table.from_pandas(frame, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_path, table.schema)
+                writer.write_table(table)
+            else:
+                frame.to_csv(tmp_path, mode="w" if done == 0 else "a", header=done == 0, index=False, float_format="%.6f")
+            done += len(query_rows)
+            print(f"Neighbours computed for {done}/{len(id_index)} customers")
+    finally:
+        if writer is not None:
+            writer.close()
+
+    os.replace(tmp_path, output_path)
+    print(f"Neighbours table saved to {output_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the top-k similar customers for every customer")
+    parser.add_argument("--embeddings", default="data/customer_embeddings.npy",
+                        help="float32 or float16 .npy, or .int8.npz from scalar_quantization.py")
+    parser.add_argument("--dataset", default="data/banking_dataset.csv", help="CSV with a customer_id column in embedding order")
+    parser.add_argument("--output", default="data/customer_neighbors.csv")
+    parser.add_argument("--k", type=int, default=DEFAULT_K)
+    parser.add_argument("--row-block", type=int, default=DEFAULT_ROW_BLOCK)
+    parser.add_argument("--col-block", type=int, default=DEFAULT_COL_BLOCK)
+    args = parser.parse_args()
+
+    embeddings = load_embeddings(args.embeddings)
+    customer_ids = pd.read_csv(args.dataset, usecols=["customer_id"])["customer_id"].to_numpy()
+    write_neighbors_table(embeddings, customer_ids, args.output, args.k, args.row_block, args.col_block)
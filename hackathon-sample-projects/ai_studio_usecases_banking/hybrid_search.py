@@ -0,0 +1,251 @@
+"""
+Vector search restricted by structured customer attributes.
+
+Next to the embedding matrix we keep columnar attribute indexes:
+
+- categorical columns (segment, risk_profile, 0/1 product flags, ...) get one packed
+  bitmap per value, so value lists are ORed and different columns ANDed a byte at a time;
+- numeric columns (credit_score, income, age, ...) get a sorted copy of their values and
+  the row order that sorts them, so a range is two binary searches.
+
+Both give exact match counts without touching the embeddings, which is used to estimate
+the selectivity of a filter. Selective filters are applied before scoring (only the
+matching rows are multiplied with the query); broad filters score every row and check
+the filter only on an oversampled shortlist of the best matches.
+
+Filters are a dict keyed by column:
+
+    {"segment": ["Premium", "Standard"], "risk_profile": "Moderate", "credit_score": [700, null]}
+
+A categorical filter is a value or a list of values. A numeric filter is [min, max]
+(inclusive, null for an open end), {"min": ..., "max": ...} or a single value.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+from scalar_quantization import QuantizedEmbeddings
+
+# Estimated fraction of matching rows below which the filter is applied before scoring
+DEFAULT_PREFILTER_THRESHOLD = 0.2
+
+# Non-numeric columns with at most this many distinct values get bitmaps when columns are inferred
+MAX_CATEGORIES = 64
+
+# Number of set bits in each byte value
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def _top_k(scores, k):
+    """Indices of the k highest scores, best first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def _normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+class AttributeIndex:
+    """Bitmap and sorted-array indexes over the attribute columns of a DataFrame."""
+
+    def __init__(self, df, categorical_columns=None, numeric_columns=None):
+        """
+        Args:
+            df (pandas.DataFrame): Attributes, one row per embedding row.
+            categorical_columns (list[str], optional): Columns indexed with bitmaps.
+                Defaults to bool columns, 0/1 integer flags and string columns with at most
+                MAX_CATEGORIES values.
+            numeric_columns (list[str], optional): Columns indexed with sorted arrays.
+                Defaults to the other numeric columns, so ranges work on every one of them.
+        """
+        self.num_rows = len(df)
+        if categorical_columns is None or numeric_columns is None:
+            inferred_categorical, inferred_numeric = self.infer_columns(df)
+            categorical_columns = inferred_categorical if categorical_columns is None else categorical_columns
+            numeric_columns = inferred_numeric if numeric_columns is None else numeric_columns
+
+        # value -> packed bitmap of the rows holding that value
+        self.bitmaps = {}
+        for column in categorical_columns:
+            values = df[column].to_numpy()
+            self.bitmaps[column] = {
+                value: np.packbits(values == value) for value in pd.unique(values)
+            }
+
+        # column -> (values in row order, row order that sorts them, sorted values)
+        self.sorted_columns = {}
+        for column in numeric_columns:
+            values = df[column].to_numpy()
+            order = np.argsort(values, kind="stable")
+            self.sorted_columns[column] = (values, order, values[order])
+
+    @staticmethod
+    def infer_columns(df):
+        """Split the columns of `df` into bitmap-indexed and range-indexed columns."""
+        categorical, numeric = [], []
+        for column in df.columns:
+            series = df[column]
+            if pd.api.types.is_bool_dtype(series):
+                categorical.append(column)
+            elif pd.api.types.is_integer_dtype(series) and series.isin([0, 1]).all():
+                # Product flags such as has_loan are filtered by value, not by range
+                categorical.append(column)
+            elif pd.api.types.is_numeric_dtype(series):
+                numeric.append(column)
+            elif series.nunique() <= MAX_CATEGORIES:
+                categorical.append(column)
+        return categorical, numeric
+
+    def _range(self, column, condition):
+        """Return (start, stop) positions of a numeric condition in the sorted values."""
+        if isinstance(condition, dict):
+            low, high = condition.get("min"), condition.get("max")
+        elif isinstance(condition, (list, tuple)):
+            low, high = condition
+        else:
+            low = high = condition
+        sorted_values = self.sorted_columns[column][2]
+        start = 0 if low is None else np.searchsorted(sorted_values, low, side="left")
+        stop = len(sorted_values) if high is None else np.searchsorted(sorted_values, high, side="right")
+        return start, max(start, stop)
+
+    def _bitmap(self, column, condition):
+        """Packed bitmap of the rows satisfying one column's condition."""
+        if column in self.bitmaps:
+            values = condition if isinstance(condition, (list, tuple, set)) else [condition]
+            bitmap = np.zeros((self.num_rows + 7) // 8, dtype=np.uint8)
+            for value in values:
+                if value in self.bitmaps[column]:
+                    bitmap |= self.bitmaps[column][value]
+            return bitmap
+        if column in self.sorted_columns:
+            start, stop = self._range(column, condition)
+            mask = np.zeros(self.num_rows, dtype=bool)
+            mask[self.sorted_columns[column][1][start:stop]] = True
+            return np.packbits(mask)
+        raise KeyError(f"Column '{column}' is not indexed")
+
+    def count(self, column, condition):
+        """Exact number of rows satisfying one column's condition, without scanning rows."""
+        if column in self.sorted_columns:
+            start, stop = self._range(column, condition)
+            return stop - start
+        return int(_POPCOUNT[self._bitmap(column, condition)].sum(dtype=np.int64))
+
+    def estimate_selectivity(self, filters):
+        """
+        Estimate the fraction of rows matching all filters.
+
+        Each column's fraction is exact; columns are combined assuming independence.
+        """
+        selectivity = 1.0
+        for column, condition in filters.items():
+            selectivity *= self.count(column, condition) / max(1, self.num_rows)
+        return selectivity
+
+    def matching_rows(self, filters):
+        """Rows matching all filters, in ascending order."""
+        bitmap = None
+        for column, condition in filters.items():
+            column_bitmap = self._bitmap(column, condition)
+            bitmap = column_bitmap if bitmap is None else bitmap & column_bitmap
+        if bitmap is None:
+            return np.arange(self.num_rows)
+        return np.flatnonzero(np.unpackbits(bitmap, count=self.num_rows))
+
+    def contains(self, filters, rows):
+        """Boolean mask of which of `rows` match all filters, checking only those rows."""
+        rows = np.asarray(rows, dtype=np.int64)
+        keep = np.ones(len(rows), dtype=bool)
+        for column, condition in filters.items():
+            if column in self.sorted_columns:
+                values = self.sorted_columns[column][0][rows]
+                start, stop = self._range(column, condition)
+                sorted_values = self.sorted_columns[column][2]
+                if start == stop:
+                    return np.zeros(len(rows), dtype=bool)
+                keep &= (values >= sorted_values[start]) & (values <= sorted_values[stop - 1])
+            else:
+                bitmap = self._bitmap(column, condition)
+                keep &= ((bitmap[rows >> 3] >> (7 - (rows & 7))) & 1).astype(bool)
+        return keep
+
+
+class HybridSearchIndex:
+    """Cosine search over embeddings with attribute filters."""
+
+    def __init__(self, embeddings, df, categorical_columns=None, numeric_columns=None,
+                 prefilter_threshold=DEFAULT_PREFILTER_THRESHOLD, oversample=2.0):
+        """
+        Args:
+            embeddings (numpy.ndarray or QuantizedEmbeddings): Embeddings of shape [rows, dim],
+                one per row of `df`. Quantized embeddings are kept as they are and scored
+                block by block.
+            df (pandas.DataFrame): Customer attributes.
+            categorical_columns (list[str], optional): Columns indexed with bitmaps.
+            numeric_columns (list[str], optional): Columns indexed with sorted arrays.
+            prefilter_threshold (float): Estimated selectivity at or below which filters are
+                applied before scoring.
+            oversample (float): Post-filter shortlist size as a multiple of k / selectivity.
+        """
+        if len(embeddings) != len(df):
+            raise ValueError(f"Got {len(embeddings)} embeddings for {len(df)} attribute rows")
+        if isinstance(embeddings, QuantizedEmbeddings):
+            self.embeddings = embeddings
+        else:
+            self.embeddings = _normalize_rows(embeddings)
+        self.attributes = AttributeIndex(df, categorical_columns, numeric_columns)
+        self.prefilter_threshold = prefilter_threshold
+        self.oversample = oversample
+
+    def _scores(self, query, rows=None):
+        """Cosine similarity of a unit query with every row, or with `rows` only."""
+        if isinstance(self.embeddings, QuantizedEmbeddings):
+            return self.embeddings.cosine(query, rows)
+        return (self.embeddings if rows is None else self.embeddings[rows]) @ query
+
+    def search(self, query_embedding, k, filters=None):
+        """
+        Find the k rows most similar to a query among those matching the filters.
+
+        Args:
+            query_embedding (numpy.ndarray): Query vector of shape [dim] or [1, dim].
+            k (int): Number of results.
+            filters (dict, optional): Attribute filters (see module docstring).
+
+        Returns:
+            tuple: (rows, cosine similarities, plan), best first, where plan is "full",
+            "prefilter" or "postfilter".
+        """
+        query = _normalize_rows(np.asarray(query_embedding).reshape(-1))
+        if not filters:
+            scores = self._scores(query)
+            best = _top_k(scores, k)
+            return best, scores[best], "full"
+
+        selectivity = self.attributes.estimate_selectivity(filters)
+        if selectivity <= self.prefilter_threshold:
+            # Score only the matching rows
+            rows = self.attributes.matching_rows(filters)
+            scores = self._scores(query, rows)
+            best = _top_k(scores, k)
+            return rows[best], scores[best], "prefilter"
+
+        # Score every row, then check the filter on a shortlist large enough to hold k
+        # matches at the estimated selectivity; grow it if the estimate was optimistic
+        scores = self._scores(query)
+        shortlist_size = min(len(scores), math.ceil(k / max(selectivity, 1e-9) * self.oversample))
+        while True:
+            shortlist = _top_k(scores, shortlist_size)
+            matches = shortlist[self.attributes.contains(filters, shortlist)]
+            if len(matches) >= k or shortlist_size == len(scores):
+                matches = matches[:k]
+                return matches, scores[matches], "postfilter"
+            shortlist_size = min(len(scores), shortlist_size * 4)
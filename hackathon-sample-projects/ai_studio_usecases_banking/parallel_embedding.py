@@ -0,0 +1,263 @@
+"""
+Multi-process sentence-transformer encoding for CPU-only machines.
+
+`model.encode` in a single process leaves most cores idle on CPU nodes, because
+PyTorch only parallelizes inside each matrix multiply. Here the texts are split into
+chunks that a pool of worker processes encodes concurrently:
+
+- every worker loads the model once, when it starts, and pins its own thread count so
+  the pool does not oversubscribe the cores;
+- workers write their rows straight into a shared-memory output array at the chunk's
+  offset, so results come back in input order without being pickled through a pipe;
+- chunks are handed out dynamically, so fast and slow workers stay busy until the end;
+- the padded-token budget of the workers' batches is tuned once, in the parent process,
+  under the workers' thread count, and sent along with each chunk.
+
+`encode_parallel` starts a pool for one call. A `ParallelEncoder` keeps its pool up
+across calls, so a pipeline that encodes a stream of chunks starts the workers and loads
+the model in them only once.
+"""
+import os
+import time
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+from tqdm import tqdm
+
+from token_batching import DEFAULT_MAX_TOKENS, TokenBatchEncoder
+
+# Below this many texts, starting the pool costs more than it saves
+MIN_PARALLEL_TEXTS = 2048
+
+# Thread-count variables read by the math libraries when a worker imports them
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+# Per-worker state: the encoder is set once by `_init_worker`, the output array is
+# attached again whenever a task names a different shared-memory block
+_worker_encoder = None
+_worker_output = None
+_worker_shm = None
+
+
+def available_cpus():
+    """Return the number of CPUs this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def default_num_workers(threads_per_worker=1):
+    """One worker per `threads_per_worker` available CPUs."""
+    return max(1, available_cpus() // threads_per_worker)
+
+
+def should_use_process_pool(model, num_texts, num_workers=None):
+    """
+    Decide whether `encode_parallel` is worth it.
+
+    Args:
+        model (SentenceTransformer): The model already loaded in this process.
+        num_texts (int): Number of texts to encode.
+        num_workers (int, optional): Requested workers; 1 disables the pool, None picks automatically.
+    """
+    if num_workers == 1 or model.device.type != "cpu":
+        return False
+    if num_workers is None:
+        return num_texts >= MIN_PARALLEL_TEXTS and default_num_workers() > 1
+    return True
+
+
+def _init_worker(model_path, threads_per_worker, quantize):
+    """Load the model in a new worker."""
+    global _worker_encoder
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    from quantization import quantize_linear_layers
+
+    torch.set_num_threads(threads_per_worker)
+    model = SentenceTransformer(model_path, device="cpu")
+    if quantize:
+        model = quantize_linear_layers(model)
+    _worker_encoder = TokenBatchEncoder(model, DEFAULT_MAX_TOKENS)
+
+
+def _attach_output(shm_name, shape):
+    """Point the worker at the shared output array of the current call."""
+    global _worker_output, _worker_shm
+    if _worker_shm is not None and _worker_shm.name == shm_name:
+        return
+    if _worker_shm is not None:
+        _worker_output = None
+        _worker_shm.close()
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_output = np.ndarray(shape, dtype=np.float32, buffer=_worker_shm.buf)
+
+
+def _encode_chunk(args):
+    """Encode one chunk and write it into the shared array; returns its text, token and padded token counts."""
+    shm_name, shape, start, texts, max_tokens = args
+    _attach_output(shm_name, shape)
+    _worker_encoder.max_tokens = max_tokens
+    embeddings = _worker_encoder.encode(texts, show_progress_bar=False, verbose=False)
+    _worker_output[start:start + len(texts)] = embeddings
+    stats = _worker_encoder.last_stats
+    return len(texts), stats["tokens"], stats["padded_tokens"]
+
+
+class ParallelEncoder:
+    """
+    A pool of CPU worker processes that stays up across `encode` calls.
+
+    The pool starts on the first call, so an encoder that only ever sees small inputs
+    costs nothing; `close` (or leaving the `with` block) stops it.
+    """
+
+    def __init__(self, model_path, dim, num_workers=None, threads_per_worker=1, max_tokens=DEFAULT_MAX_TOKENS,
+                 chunk_size=512, quantize=False):
+        """
+        Args:
+            model_path (str): Directory or Hugging Face name each worker loads the model from.
+            dim (int): Embedding dimension of the model.
+            num_workers (int, optional): Worker processes. Defaults to one per available CPU
+                divided by `threads_per_worker`.
+            threads_per_worker (int): PyTorch threads inside each worker.
+            max_tokens (int): Padded-token budget per batch in the workers (see `token_batching`),
+                unless `encode` is given an encoder to take it from.
+            chunk_size (int): Texts handed to a worker at a time.
+            quantize (bool): Load the model with int8 linear layers in the workers (see `quantization`).
+        """
+        self.model_path = model_path
+        self.dim = dim
+        self.num_workers = num_workers or default_num_workers(threads_per_worker)
+        self.threads_per_worker = threads_per_worker
+        self.max_tokens = max_tokens
+        self.chunk_size = chunk_size
+        self.quantize = quantize
+        self.last_stats = None
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _start(self):
+        print(f"Starting {self.num_workers} worker processes x {self.threads_per_worker} threads")
+
+        # Workers are spawned, so they read these variables when they import torch;
+        # the tokenizer's own thread pool would also compete with the other workers
+        saved_env = {name: os.environ.get(name) for name in THREAD_ENV_VARS + ("TOKENIZERS_PARALLELISM",)}
+        os.environ.update({name: str(self.threads_per_worker) for name in THREAD_ENV_VARS})
+        os.environ["TOKENIZERS_PARALLELISM"] = "false"
+        try:
+            self._pool = get_context("spawn").Pool(
+                self.num_workers,
+                initializer=_init_worker,
+                initargs=(self.model_path, self.threads_per_worker, self.quantize),
+            )
+        finally:
+            for name, value in saved_env.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+    def tune(self, encoder, texts):
+        """
+        Token budget for the workers, from `encoder` (a `TokenBatchEncoder` over the same
+        model in this process). An unset budget is tuned on `texts` first, with this
+        process limited to one worker's thread count so the timings match the workers.
+        """
+        if encoder.max_tokens is not None:
+            return encoder.max_tokens
+        import torch
+
+        num_threads = torch.get_num_threads()
+        torch.set_num_threads(self.threads_per_worker)
+        try:
+            return encoder.budget_for(texts)
+        finally:
+            torch.set_num_threads(num_threads)
+
+    def encode(self, texts, encoder=None, verbose=True):
+        """
+        Encode texts with the worker pool, starting it if needed.
+
+        Throughput of the call is kept in `last_stats` and printed if `verbose`.
+
+        Args:
+            texts (list[str]): Texts to encode.
+            encoder (TokenBatchEncoder, optional): Encoder whose budget the workers use, see `tune`.
+            verbose (bool): Print the throughput.
+
+        Returns:
+            numpy.ndarray: float32 embeddings of shape [len(texts), dim], in input order.
+        """
+        texts = list(texts)
+        shape = (len(texts), self.dim)
+        if not texts:
+            return np.empty(shape, dtype=np.float32)
+        max_tokens = self.max_tokens if encoder is None else self.tune(encoder, texts)
+        if self._pool is None:
+            self._start()
+
+        print(f"Encoding {len(texts)} texts with {self.num_workers} worker processes")
+        shm = shared_memory.SharedMemory(create=True, size=max(1, len(texts) * self.dim * 4))
+        try:
+            chunks = [
+                (shm.name, shape, start, texts[start:start + self.chunk_size], max_tokens)
+                for start in range(0, len(texts), self.chunk_size)
+            ]
+            tokens = padded = 0
+            started = time.perf_counter()
+            with tqdm(total=len(texts), desc="Encoding") as progress:
+                for done, chunk_tokens, chunk_padded in self._pool.imap_unordered(_encode_chunk, chunks):
+                    progress.update(done)
+                    tokens += chunk_tokens
+                    padded += chunk_padded
+            seconds = time.perf_counter() - started
+            embeddings = np.ndarray(shape, dtype=np.float32, buffer=shm.buf).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+
+        self.last_stats = {
+            "texts": len(texts),
+            "tokens": tokens,
+            "padded_tokens": padded,
+            "seconds": seconds,
+            "tokens_per_sec": tokens / max(seconds, 1e-9),
+        }
+        if verbose:
+            print(f"Encoded {len(texts)} texts with a budget of {max_tokens} tokens per batch: "
+                  f"{self.last_stats['tokens_per_sec']:.0f} tokens/sec, {1 - tokens / max(1, padded):.1%} padding")
+        return embeddings
+
+    def close(self):
+        """Stop the workers, letting them exit normally."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+def encode_parallel(model_path, texts, dim, num_workers=None, threads_per_worker=1, max_tokens=DEFAULT_MAX_TOKENS,
+                    chunk_size=512, quantize=False):
+    """
+    Encode texts with a pool of CPU worker processes started for this call.
+
+    Arguments are those of `ParallelEncoder`; fewer workers are started than there are
+    chunks of `chunk_size` texts.
+
+    Returns:
+        numpy.ndarray: float32 embeddings of shape [len(texts), dim], in input order.
+    """
+    texts = list(texts)
+    num_workers = num_workers or default_num_workers(threads_per_worker)
+    num_workers = max(1, min(num_workers, -(-len(texts) // chunk_size)))
+    with ParallelEncoder(
+        model_path, dim, num_workers, threads_per_worker, max_tokens, chunk_size, quantize
+    ) as encoder:
+        return encoder.encode(texts)
@@ -0,0 +1,286 @@
+"""
+Streaming CSV-to-embeddings pipeline with bounded memory.
+
+Four stages run concurrently and hand chunks to each other through bounded queues:
+
+    read CSV chunk -> build texts -> encode -> append to disk
+
+A full queue blocks the stage that feeds it, so a fast reader waits for the encoder
+instead of buffering the dataset; at most `queue_size` chunks wait between two stages.
+The writer appends float32 rows and content hashes to `.part` files and, after every
+chunk, atomically records in a JSON checkpoint how many chunks are safely on disk. A
+rerun over the same input with the same settings cuts the part files back to the
+checkpoint and resumes with the next chunk. Once every chunk is written, the part files
+are copied block by block into the final `.npy` embeddings and hash manifest.
+
+Rows whose text hash is in the previous run's manifest reuse their stored vector, as in
+`incremental_embed`. The previous manifest is the only per-row state held in memory
+(a sorted copy of the hashes, about 40 bytes per row).
+"""
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+import pandas as pd
+
+from incremental_embedding import text_hashes
+
+DEFAULT_CHUNK_ROWS = 20_000
+DEFAULT_QUEUE_SIZE = 2
+
+# Bytes copied at a time when the part files are turned into .npy files
+FINALIZE_BLOCK_BYTES = 16 << 20
+
+# Hex digests from `text_hashes`, stored as bytes in the part file
+HASH_BYTES = 32
+
+# Marks the end of a stage's output
+_DONE = object()
+
+
+class _PreviousRun:
+    """Embeddings and sorted hashes of the last completed run, for reusing vectors."""
+
+    def __init__(self, embeddings_file, manifest_file):
+        self.embeddings = np.load(embeddings_file, mmap_mode="r")
+        hashes = np.load(manifest_file).astype(f"S{HASH_BYTES}")
+        if len(hashes) != len(self.embeddings):
+            raise ValueError("Manifest does not match embeddings")
+        self.order = np.argsort(hashes, kind="stable")
+        self.sorted_hashes = hashes[self.order]
+
+    @classmethod
+    def load(cls, embeddings_file, manifest_file):
+        """Return the previous run, or None if there is none or it is inconsistent."""
+        if not (os.path.exists(embeddings_file) and os.path.exists(manifest_file)):
+            return None
+        try:
+            return cls(embeddings_file, manifest_file)
+        except ValueError:
+            return None
+
+    def find(self, hashes):
+        """Previous row of each hash, -1 where the text was not embedded before."""
+        hashes = np.asarray(hashes).astype(f"S{HASH_BYTES}")
+        if len(self.sorted_hashes) == 0:
+            return np.full(len(hashes), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.sorted_hashes, hashes), len(self.sorted_hashes) - 1)
+        found = self.sorted_hashes[positions] == hashes
+        return np.where(found, self.order[positions], -1)
+
+
+def _source_signature(data_file, chunk_rows, salt):
+    """What a checkpoint must match to be resumed from."""
+    stat = os.stat(data_file)
+    return {
+        "source": os.path.abspath(data_file),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "chunk_rows": chunk_rows,
+        "salt": salt,
+    }
+
+
+def _save_checkpoint(path, checkpoint):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def _load_checkpoint(path, signature, embeddings_part, hashes_part):
+    """Return a checkpoint to resume from, or None to start over."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("signature") != signature or checkpoint.get("dim") is None:
+        return None
+    rows = checkpoint["rows"]
+    if (
+        not os.path.exists(embeddings_part)
+        or not os.path.exists(hashes_part)
+        or os.path.getsize(embeddings_part) < rows * checkpoint["dim"] * 4
+        or os.path.getsize(hashes_part) < rows * HASH_BYTES
+    ):
+        return None
+    return checkpoint
+
+
+def _put(q, item, stop):
+    """Put with back-pressure, giving up if another stage failed."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(q, stop):
+    """Get the next item, or _DONE if another stage failed."""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return _DONE
+
+
+def _finalize(part_path, output_path, part_dtype, output_dtype, shape):
+    """Copy a part file into an .npy file block by block and rename it into place."""
+    tmp_path = f"{output_path}.tmp"
+    row_bytes = np.dtype(part_dtype).itemsize * int(np.prod(shape[1:]))
+    block_bytes = max(1, FINALIZE_BLOCK_BYTES // row_bytes) * row_bytes if row_bytes else 0
+    header = {"descr": np.lib.format.dtype_to_descr(np.dtype(output_dtype)), "fortran_order": False, "shape": shape}
+    with open(tmp_path, "wb") as output, open(part_path, "rb") as part:
+        np.lib.format.write_array_header_1_0(output, header)
+        while block_bytes and (block := part.read(block_bytes)):
+            if np.dtype(part_dtype) != np.dtype(output_dtype):
+                block = np.frombuffer(block, dtype=part_dtype).astype(output_dtype).tobytes()
+            output.write(block)
+    os.replace(tmp_path, output_path)
+
+
+def stream_embeddings(data_file, build_texts, embed_fn, embeddings_file, manifest_file, salt="",
+                      chunk_rows=DEFAULT_CHUNK_ROWS, queue_size=DEFAULT_QUEUE_SIZE, reuse_previous=True,
+                      read_csv_kwargs=None):
+    """
+    Embed a CSV file chunk by chunk into an .npy file and its hash manifest.
+
+    Args:
+        data_file (str): Input CSV.
+        build_texts (callable): Maps a DataFrame chunk to the list of texts to embed.
+        embed_fn (callable): Maps a list of texts to an array of shape [len(texts), dim].
+        embeddings_file (str): Output .npy file.
+        manifest_file (str): Output hash manifest, as written by `write_outputs`.
+        salt (str): Hash salt, normally the model name.
+        chunk_rows (int): CSV rows per chunk, and per checkpoint.
+        queue_size (int): Chunks that may wait between two stages.
+        reuse_previous (bool): Reuse vectors of unchanged texts from the previous run.
+        read_csv_kwargs (dict, optional): Extra arguments for `pandas.read_csv`.
+
+    Returns:
+        dict: Counts of rows written, embedded, reused and recovered from a checkpoint.
+    """
+    embeddings_part = f"{embeddings_file}.part"
+    hashes_part = f"{manifest_file}.part"
+    checkpoint_file = f"{embeddings_file}.checkpoint.json"
+    signature = _source_signature(data_file, chunk_rows, salt)
+
+    checkpoint = _load_checkpoint(checkpoint_file, signature, embeddings_part, hashes_part)
+    if checkpoint is None:
+        checkpoint = {"signature": signature, "chunks": 0, "rows": 0, "dim": None}
+        for path in (embeddings_part, hashes_part):
+            if os.path.exists(path):
+                os.remove(path)
+    else:
+        # Drop anything appended after the last checkpoint
+        with open(embeddings_part, "r+b") as f:
+            f.truncate(checkpoint["rows"] * checkpoint["dim"] * 4)
+        with open(hashes_part, "r+b") as f:
+            f.truncate(checkpoint["rows"] * HASH_BYTES)
+        print(f"Resuming after {checkpoint['rows']} rows ({checkpoint['chunks']} chunks) from {checkpoint_file}")
+
+    previous = _PreviousRun.load(embeddings_file, manifest_file) if reuse_previous else None
+    stats = {"rows": checkpoint["rows"], "embedded": 0, "reused": 0, "resumed": checkpoint["rows"]}
+
+    chunks = queue.Queue(queue_size)
+    texts = queue.Queue(queue_size)
+    encoded = queue.Queue(queue_size)
+    stop = threading.Event()
+    errors = []
+
+    def run_stage(stage):
+        def run():
+            try:
+                stage()
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+        return threading.Thread(target=run, daemon=True)
+
+    def read_chunks():
+        reader = pd.read_csv(data_file, chunksize=chunk_rows, **(read_csv_kwargs or {}))
+        with reader:
+            for index, chunk in enumerate(reader):
+                # Chunks before the checkpoint still have to be parsed to find the next one
+                if index >= checkpoint["chunks"] and not _put(chunks, chunk, stop):
+                    return
+        _put(chunks, _DONE, stop)
+
+    def make_texts():
+        while (chunk := _get(chunks, stop)) is not _DONE:
+            chunk_texts = list(build_texts(chunk))
+            if not _put(texts, (chunk_texts, text_hashes(chunk_texts, salt)), stop):
+                return
+        _put(texts, _DONE, stop)
+
+    def write_chunks():
+        with open(embeddings_part, "ab") as embeddings_out, open(hashes_part, "ab") as hashes_out:
+            while (item := _get(encoded, stop)) is not _DONE:
+                embeddings, hashes = item
+                embeddings_out.write(np.ascontiguousarray(embeddings, dtype=np.float32).tobytes())
+                hashes_out.write(hashes.astype(f"S{HASH_BYTES}").tobytes())
+                for f in (embeddings_out, hashes_out):
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                checkpoint["chunks"] += 1
+                checkpoint["rows"] += len(hashes)
+                checkpoint["dim"] = embeddings.shape[1]
+                _save_checkpoint(checkpoint_file, checkpoint)
+                stats["rows"] = checkpoint["rows"]
+                print(f"Wrote {checkpoint['rows']} embeddings ({checkpoint['chunks']} chunks)")
+
+    threads = [run_stage(read_chunks), run_stage(make_texts), run_stage(write_chunks)]
+    for thread in threads:
+        thread.start()
+
+    # Encode on the calling thread, so the model is only used from one thread
+    try:
+        while (item := _get(texts, stop)) is not _DONE:
+            chunk_texts, hashes = item
+            if not len(hashes):
+                continue
+            source = previous.find(hashes) if previous is not None else np.full(len(hashes), -1)
+            reused = source >= 0
+            new_rows = np.flatnonzero(~reused)
+
+            computed = None
+            if len(new_rows):
+                computed = np.asarray(embed_fn([chunk_texts[i] for i in new_rows]), dtype=np.float32)
+            dim = computed.shape[1] if computed is not None else previous.embeddings.shape[1]
+            embeddings = np.empty((len(hashes), dim), dtype=np.float32)
+            if reused.any():
+                embeddings[reused] = previous.embeddings[source[reused]]
+            if computed is not None:
+                embeddings[new_rows] = computed
+            stats["embedded"] += len(new_rows)
+            stats["reused"] += int(reused.sum())
+
+            if not _put(encoded, (embeddings, hashes), stop):
+                break
+        _put(encoded, _DONE, stop)
+    except BaseException as e:
+        errors.append(e)
+        stop.set()
+
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+    # Same order as `write_outputs`: a crash in between leaves embeddings without a manifest
+    previous = None
+    rows, dim = checkpoint["rows"], checkpoint["dim"] or 0
+    if os.path.exists(manifest_file):
+        os.remove(manifest_file)
+    _finalize(embeddings_part, embeddings_file, np.float32, np.float32, (rows, dim))
+    _finalize(hashes_part, manifest_file, f"S{HASH_BYTES}", f"<U{HASH_BYTES}", (rows,))
+    for path in (embeddings_part, hashes_part, checkpoint_file):
+        os.remove(path)
+    return stats
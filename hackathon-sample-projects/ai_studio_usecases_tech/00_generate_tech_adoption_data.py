@@ -3,7 +3,11 @@ import numpy as np
 from faker import Faker
 import random
 from pathlib import Path
+import argparse
+import multiprocessing
 import os
+import shutil
+import tempfile
 
 # Initialize Faker
 fake = Faker()
@@ -14,6 +18,13 @@ random.seed(42)
 # Define constants
 NUM_USERS = 1000
 OUTPUT_FILE = "data/tech_adoption_dataset.csv"
+SEED = 42
+
+# Users per shard; output depends on the seed and shard size, never on the worker count
+SHARD_SIZE = 10000
+
+# Columns summarized after generation
+STATISTICS_COLUMNS = ["adopter_category", "tech_interest", "budget_category", "technical_proficiency", "persona"]
 # EMBEDDINGS_FILE = "data/tech_embeddings.npy"  # This doesn't belong here
 
 # Create data directory if it doesn't exist
@@ -46,6 +57,131 @@ DIGITAL_PLATFORMS = ["Instagram", "YouTube", "Twitter", "LinkedIn", "TikTok", "R
 # Purchasing factors
 PURCHASING_FACTORS = ["Price", "Features", "Brand Reputation", "Design", "Reviews", "Sustainability", "Compatibility"]
 
+# Younger users are more likely to be earlier adopters, older users later adopters
+ADOPTER_WEIGHTS_UNDER_30 = [0.15, 0.35, 0.30, 0.15, 0.05]
+ADOPTER_WEIGHTS_OVER_55 = [0.05, 0.10, 0.25, 0.40, 0.20]
+
+# Tech interest level correlates with adopter category
+TECH_INTEREST_BY_ADOPTER = {
+    "Innovator": ["Very High", "High"],
+    "Early Adopter": ["Very High", "High", "Moderate"],
+    "Early Majority": ["High", "Moderate"],
+    "Late Majority": ["Moderate", "Low"],
+    "Laggard": ["Low", "Very Low"]
+}
+
+# Income adjustment by adopter category
+ADOPTER_BUDGET_BOOST = {
+    "Innovator": 0.8,
+    "Early Adopter": 0.4,
+    "Early Majority": 0.0,
+    "Late Majority": -0.2,
+    "Laggard": -0.4
+}
+
+# Budget category weights by adopter category
+BUDGET_WEIGHTS_BY_ADOPTER = {
+    "Innovator": [0.3, 0.4, 0.2, 0.08, 0.02],
+    "Early Adopter": [0.3, 0.4, 0.2, 0.08, 0.02],
+    "Early Majority": [0.05, 0.25, 0.5, 0.15, 0.05],
+    "Late Majority": [0.02, 0.08, 0.4, 0.4, 0.1],
+    "Laggard": [0.01, 0.04, 0.15, 0.4, 0.4]
+}
+
+# Preferred platforms by age band: (upper age bound, platforms)
+PLATFORMS_BY_AGE = [
+    (25, ["TikTok", "Instagram", "YouTube", "Twitter", "Reddit"]),
+    (40, ["Instagram", "YouTube", "Twitter", "LinkedIn", "Reddit", "TikTok"]),
+    (55, ["LinkedIn", "Facebook", "YouTube", "Email Newsletter", "Twitter", "Tech Blogs"]),
+    (None, ["Facebook", "Email Newsletter", "YouTube", "Tech Blogs"])
+]
+
+# Probability of adopting each technology category
+ADOPTION_PROBABILITY = {
+    "Innovator": 0.95,
+    "Early Adopter": 0.85,
+    "Early Majority": 0.7,
+    "Late Majority": 0.5,
+    "Laggard": 0.3
+}
+
+# Adoption timing range in months after product release
+ADOPTION_TIMING = {
+    "Innovator": (0, 1),
+    "Early Adopter": (1, 3),
+    "Early Majority": (3, 12),
+    "Late Majority": (12, 24),
+    "Laggard": (24, 48)
+}
+
+# Slice of each category's product list (ordered by price) considered per budget
+PRODUCT_RANGE_BY_BUDGET = {
+    "Premium": (0, 2),
+    "High": (0, 3),
+    "Mid-range": (1, 4),
+    "Budget": (2, 5),
+    "Economy": (3, 5)
+}
+
+# Purchasing factors influenced by adopter category
+PURCHASING_FACTORS_BY_ADOPTER = {
+    "Innovator": ["Features", "Design", "Brand Reputation"],
+    "Early Adopter": ["Features", "Brand Reputation", "Design", "Compatibility"],
+    "Early Majority": ["Features", "Reviews", "Price", "Brand Reputation"],
+    "Late Majority": ["Price", "Reviews", "Brand Reputation", "Compatibility"],
+    "Laggard": ["Price", "Compatibility", "Sustainability"]
+}
+
+# Technical proficiency correlates with adopter category
+PROFICIENCY_BY_ADOPTER = {
+    "Innovator": ["Expert", "Advanced"],
+    "Early Adopter": ["Advanced", "Intermediate"],
+    "Early Majority": ["Intermediate"],
+    "Late Majority": ["Intermediate", "Basic"],
+    "Laggard": ["Basic", "Beginner"]
+}
+
+# Formal education level
+EDUCATION_LEVELS = ["High School", "Some College", "Bachelor's", "Master's", "PhD"]
+EDUCATION_WEIGHTS = [0.1, 0.2, 0.4, 0.2, 0.1]
+
+# Job sectors - tech related roles more likely to be early adopters
+TECH_SECTORS = ["Technology", "Engineering", "Digital Marketing", "Data Science", "UX/UI Design"]
+NON_TECH_SECTORS = ["Finance", "Healthcare", "Education", "Retail", "Manufacturing", "Service Industry",
+                    "Government", "Legal", "Arts", "Hospitality"]
+TECH_SECTOR_PROBABILITY = {
+    "Innovator": 0.7,
+    "Early Adopter": 0.7,
+    "Early Majority": 0.5,
+    "Late Majority": 0.2,
+    "Laggard": 0.2
+}
+
+# US cities with tech hubs, more likely for innovators
+TECH_HUBS = ["San Francisco, CA", "Seattle, WA", "Austin, TX", "Boston, MA", "New York, NY",
+             "Denver, CO", "San Jose, CA", "Raleigh, NC", "Atlanta, GA", "Portland, OR"]
+TECH_HUB_PROBABILITY = {
+    "Innovator": 0.6,
+    "Early Adopter": 0.6,
+    "Early Majority": 0.3,
+    "Late Majority": 0.1,
+    "Laggard": 0.1
+}
+
+GENDERS = ["Male", "Female", "Non-binary"]
+
+# Column prefix for each technology category
+CATEGORY_COLUMNS = {
+    "Smartphones": "smartphone",
+    "Laptops": "laptop",
+    "Smart Home": "smarthome",
+    "Wearables": "wearable",
+    "VR/AR": "vrar"
+}
+
+# Faker cities generated per shard for the vectorized sampler to draw non-hub locations from
+CITY_POOL_SIZE = 1000
+
 def generate_user_id(index):
     """Generate a unique user ID"""
     return f"TU{index+1:04d}"
@@ -113,75 +249,48 @@ def create_user_description(user_data):
     full_description = demographics + tech_profile + purchasing + adoption
     return full_description
 
-def generate_tech_adoption_profile(user_id):
-    """Generate a technology adoption profile for one user"""
-    age = random.randint(18, 75)
+def generate_tech_adoption_profile(user_id, rng=random, fake=fake):
+    """
+    Generate a technology adoption profile for one user.
+    
+    `rng` and `fake` default to the module-level seeded generators; shards pass their own.
+    """
+    age = rng.randint(18, 75)
     
     # Weight adopter category based on age
     if age < 30:
         # Younger users more likely to be earlier adopters
-        adopter_weights = [0.15, 0.35, 0.30, 0.15, 0.05]
+        adopter_weights = ADOPTER_WEIGHTS_UNDER_30
     elif age > 55:
         # Older users more likely to be later adopters
-        adopter_weights = [0.05, 0.10, 0.25, 0.40, 0.20]
+        adopter_weights = ADOPTER_WEIGHTS_OVER_55
     else:
         # Use standard weights for middle-aged users
         adopter_weights = ADOPTER_WEIGHTS
         
-    adopter_category = random.choices(ADOPTER_CATEGORIES, weights=adopter_weights, k=1)[0]
+    adopter_category = rng.choices(ADOPTER_CATEGORIES, weights=adopter_weights, k=1)[0]
     
     # Tech interest level correlates with adopter category
-    tech_interest_map = {
-        "Innovator": ["Very High", "High"],
-        "Early Adopter": ["Very High", "High", "Moderate"],
-        "Early Majority": ["High", "Moderate"],
-        "Late Majority": ["Moderate", "Low"],
-        "Laggard": ["Low", "Very Low"]
-    }
-    tech_interest = random.choice(tech_interest_map[adopter_category])
+    tech_interest = rng.choice(TECH_INTEREST_BY_ADOPTER[adopter_category])
     
     # Budget correlates with age (bell curve) and adopter category
     income_factor = min(1.0, (age - 18) / 30)  # Peaks around age 48
     income_factor = income_factor * (2 - income_factor)  # Create bell curve
     
     # Adjust income based on adopter category
-    adopter_budget_boost = {
-        "Innovator": 0.8,
-        "Early Adopter": 0.4,
-        "Early Majority": 0.0,
-        "Late Majority": -0.2,
-        "Laggard": -0.4
-    }
-    
-    income_factor = max(0.1, min(1.0, income_factor + adopter_budget_boost[adopter_category]))
+    income_factor = max(0.1, min(1.0, income_factor + ADOPTER_BUDGET_BOOST[adopter_category]))
     # Convert to float with 2 decimal places for cents
-    annual_income = round(35000 + (income_factor * 165000) + random.random() * 100, 2)
-    
-    # Determine budget category based on income and adopter profile
-    if "Innovator" in adopter_category or "Early Adopter" in adopter_category:
-        budget_weights = [0.3, 0.4, 0.2, 0.08, 0.02]
-    elif "Early Majority" in adopter_category:
-        budget_weights = [0.05, 0.25, 0.5, 0.15, 0.05]
-    elif "Late Majority" in adopter_category:
-        budget_weights = [0.02, 0.08, 0.4, 0.4, 0.1]
-    else:  # Laggard
-        budget_weights = [0.01, 0.04, 0.15, 0.4, 0.4]
-        
-    budget_category = random.choices(BUDGET_CATEGORIES, weights=budget_weights, k=1)[0]
+    annual_income = round(35000 + (income_factor * 165000) + rng.random() * 100, 2)
+    
+    # Determine budget category based on adopter profile
+    budget_category = rng.choices(BUDGET_CATEGORIES, weights=BUDGET_WEIGHTS_BY_ADOPTER[adopter_category], k=1)[0]
     
     # Preferred platforms based on age and adopter category
-    if age < 25:
-        platform_choices = ["TikTok", "Instagram", "YouTube", "Twitter", "Reddit"]
-    elif age < 40:
-        platform_choices = ["Instagram", "YouTube", "Twitter", "LinkedIn", "Reddit", "TikTok"]
-    elif age < 55:
-        platform_choices = ["LinkedIn", "Facebook", "YouTube", "Email Newsletter", "Twitter", "Tech Blogs"]
-    else:
-        platform_choices = ["Facebook", "Email Newsletter", "YouTube", "Tech Blogs"]
+    platform_choices = next(platforms for max_age, platforms in PLATFORMS_BY_AGE if max_age is None or age < max_age)
         
     # Early adopters more likely to use more diverse platforms
     num_platforms = max(1, min(5, int(6 - ADOPTER_CATEGORIES.index(adopter_category))))
-    preferred_platforms = random.sample(platform_choices, k=min(num_platforms, len(platform_choices)))
+    preferred_platforms = rng.sample(platform_choices, k=min(num_platforms, len(platform_choices)))
     
     # Generate adoption timing for each tech category
     adoption_timing = {}
@@ -189,122 +298,58 @@ def generate_tech_adoption_profile(user_id):
     
     for category, products in TECH_CATEGORIES.items():
         # Determine if user adopts this category
-        adoption_probability = {
-            "Innovator": 0.95,
-            "Early Adopter": 0.85,
-            "Early Majority": 0.7,
-            "Late Majority": 0.5,
-            "Laggard": 0.3
-        }
-        
-        if random.random() < adoption_probability[adopter_category]:
+        if rng.random() < ADOPTION_PROBABILITY[adopter_category]:
             # Set adoption timing in months (how many months after product release)
-            base_timing = {
-                "Innovator": (0, 1),
-                "Early Adopter": (1, 3),
-                "Early Majority": (3, 12),
-                "Late Majority": (12, 24),
-                "Laggard": (24, 48)
-            }
-            
-            timing_range = base_timing[adopter_category]
-            adoption_timing[category] = random.randint(timing_range[0], timing_range[1])
+            timing_range = ADOPTION_TIMING[adopter_category]
+            adoption_timing[category] = rng.randint(timing_range[0], timing_range[1])
             
             # Select product preference based on budget
-            product_by_price = {
-                "Premium": products[0:2],
-                "High": products[0:3],
-                "Mid-range": products[1:4],
-                "Budget": products[2:5],
-                "Economy": products[3:5]
-            }
-            
-            adoption_products[category] = random.choice(product_by_price[budget_category])
+            start, stop = PRODUCT_RANGE_BY_BUDGET[budget_category]
+            adoption_products[category] = rng.choice(products[start:stop])
         else:
             adoption_timing[category] = -1  # -1 indicates non-adoption
             adoption_products[category] = "None"
     
-    # Purchasing factors influenced by adopter category and budget
-    if "Innovator" in adopter_category:
-        factor_choices = ["Features", "Design", "Brand Reputation"]
-    elif "Early Adopter" in adopter_category:
-        factor_choices = ["Features", "Brand Reputation", "Design", "Compatibility"]
-    elif "Early Majority" in adopter_category:
-        factor_choices = ["Features", "Reviews", "Price", "Brand Reputation"]
-    elif "Late Majority" in adopter_category:
-        factor_choices = ["Price", "Reviews", "Brand Reputation", "Compatibility"]
-    else:  # Laggard
-        factor_choices = ["Price", "Compatibility", "Sustainability"]
+    # Purchasing factors influenced by adopter category
+    factor_choices = PURCHASING_FACTORS_BY_ADOPTER[adopter_category]
         
-    # Add some randomness
-    available_factors = list(set(PURCHASING_FACTORS) - set(factor_choices[:2]))
-    additional_factors = random.sample(available_factors, k=1)
+    # Add some randomness (keep list order so the draw does not depend on string hashing)
+    available_factors = [factor for factor in PURCHASING_FACTORS if factor not in factor_choices[:2]]
+    additional_factors = rng.sample(available_factors, k=1)
     purchasing_factors = factor_choices[:2] + additional_factors
     
     # Technical proficiency correlates with adopter category and age
-    proficiency_map = {
-        "Innovator": ["Expert", "Advanced"],
-        "Early Adopter": ["Advanced", "Intermediate"],
-        "Early Majority": ["Intermediate"],
-        "Late Majority": ["Intermediate", "Basic"],
-        "Laggard": ["Basic", "Beginner"]
-    }
-    
-    # Adjust for age
-    if age < 30:
-        proficiency_options = proficiency_map[adopter_category]
-    elif age > 60:
-        proficiency_options = [proficiency_map[adopter_category][-1]]  # Use the lowest option
+    if age > 60:
+        proficiency_options = [PROFICIENCY_BY_ADOPTER[adopter_category][-1]]  # Use the lowest option
     else:
-        proficiency_options = proficiency_map[adopter_category]
+        proficiency_options = PROFICIENCY_BY_ADOPTER[adopter_category]
         
-    technical_proficiency = random.choice(proficiency_options)
+    technical_proficiency = rng.choice(proficiency_options)
     
     # Formal education level
-    education_levels = ["High School", "Some College", "Bachelor's", "Master's", "PhD"]
-    education_weights = [0.1, 0.2, 0.4, 0.2, 0.1]
-    education = random.choices(education_levels, weights=education_weights, k=1)[0]
+    education = rng.choices(EDUCATION_LEVELS, weights=EDUCATION_WEIGHTS, k=1)[0]
     
     # Job sector - tech related roles more likely to be early adopters
-    tech_sectors = ["Technology", "Engineering", "Digital Marketing", "Data Science", "UX/UI Design"]
-    non_tech_sectors = ["Finance", "Healthcare", "Education", "Retail", "Manufacturing", "Service Industry", 
-                        "Government", "Legal", "Arts", "Hospitality"]
-    
-    if "Innovator" in adopter_category or "Early Adopter" in adopter_category:
-        sector_weights = [0.7, 0.3]  # 70% chance of tech sector
-    elif "Early Majority" in adopter_category:
-        sector_weights = [0.5, 0.5]  # 50% chance of tech sector
+    sector_weights = [TECH_SECTOR_PROBABILITY[adopter_category], 1 - TECH_SECTOR_PROBABILITY[adopter_category]]
+    if rng.choices([True, False], weights=sector_weights, k=1)[0]:
+        job_sector = rng.choice(TECH_SECTORS)
     else:
-        sector_weights = [0.2, 0.8]  # 20% chance of tech sector
-        
-    if random.choices([True, False], weights=sector_weights, k=1)[0]:
-        job_sector = random.choice(tech_sectors)
-    else:
-        job_sector = random.choice(non_tech_sectors)
+        job_sector = rng.choice(NON_TECH_SECTORS)
     
     # Generate location (US cities with tech hubs more likely for innovators)
-    tech_hubs = ["San Francisco, CA", "Seattle, WA", "Austin, TX", "Boston, MA", "New York, NY", 
-                 "Denver, CO", "San Jose, CA", "Raleigh, NC", "Atlanta, GA", "Portland, OR"]
-    
     other_cities = [f"{fake.city()}, {fake.state_abbr()}" for _ in range(20)]
     
-    if "Innovator" in adopter_category or "Early Adopter" in adopter_category:
-        location_weights = [0.6, 0.4]  # 60% chance of tech hub
-    elif "Early Majority" in adopter_category:
-        location_weights = [0.3, 0.7]  # 30% chance of tech hub
+    location_weights = [TECH_HUB_PROBABILITY[adopter_category], 1 - TECH_HUB_PROBABILITY[adopter_category]]
+    if rng.choices([True, False], weights=location_weights, k=1)[0]:
+        location = rng.choice(TECH_HUBS)
     else:
-        location_weights = [0.1, 0.9]  # 10% chance of tech hub
-        
-    if random.choices([True, False], weights=location_weights, k=1)[0]:
-        location = random.choice(tech_hubs)
-    else:
-        location = random.choice(other_cities)
+        location = rng.choice(other_cities)
     
     # Create the user profile dictionary
     user_profile = {
         "user_id": user_id,
         "age": age,
-        "gender": random.choice(["Male", "Female", "Non-binary"]),
+        "gender": rng.choice(GENDERS),
         "location": location,
         "education": education,
         "job_sector": job_sector,
@@ -335,7 +380,7 @@ def generate_tech_adoption_profile(user_id):
         else:
             persona = "Value-Conscious Tech Enthusiast"
     elif adopter_category in ["Early Majority"] and tech_interest in ["High", "Moderate"]:
-        if job_sector in tech_sectors:
+        if job_sector in TECH_SECTORS:
             persona = "Practical Professional"
         else:
             persona = "Mainstream Adopter"
@@ -348,18 +393,18 @@ def generate_tech_adoption_profile(user_id):
     
     # Add brand loyalty metrics (0-10 scale)
     if "iPhone" in user_profile["smartphone_preferred_product"]:
-        apple_loyalty = random.randint(7, 10)
+        apple_loyalty = rng.randint(7, 10)
     elif "None" == user_profile["smartphone_preferred_product"]:
-        apple_loyalty = random.randint(0, 3)
+        apple_loyalty = rng.randint(0, 3)
     else:
-        apple_loyalty = random.randint(1, 6)
+        apple_loyalty = rng.randint(1, 6)
     
     if "Samsung" in user_profile["smartphone_preferred_product"] or "Samsung" in user_profile["smarthome_preferred_product"]:
-        samsung_loyalty = random.randint(7, 10)
+        samsung_loyalty = rng.randint(7, 10)
     elif "None" in [user_profile["smartphone_preferred_product"], user_profile["smarthome_preferred_product"]]:
-        samsung_loyalty = random.randint(0, 3)
+        samsung_loyalty = rng.randint(0, 3)
     else:
-        samsung_loyalty = random.randint(1, 6)
+        samsung_loyalty = rng.randint(1, 6)
     
     user_profile["apple_loyalty"] = apple_loyalty
     user_profile["samsung_loyalty"] = samsung_loyalty
@@ -368,55 +413,379 @@ def generate_tech_adoption_profile(user_id):
     # This will be added to the user_profile after it's created since it needs to reference the user_profile values
     return user_profile
 
-def generate_dataset(num_users=NUM_USERS):
-    """Generate a complete dataset of tech adoption profiles"""
-    users = []
+def option_table(options_by_group):
+    """
+    Pad a list of option lists into arrays for `sample_conditional`.
     
-    for i in range(num_users):
-        user_id = generate_user_id(i)
-        user_profile = generate_tech_adoption_profile(user_id)
-        
-        # Create text description
-        description = create_user_description(user_profile)
-        
-        # Add description to user profile
-        user_profile["user_description"] = description
-        
-        # Add to collections
-        users.append(user_profile)
+    Returns:
+        tuple: (weights of shape [groups, max_options] with 1 for real options and 0 for
+        padding, labels of the same shape with "" as padding).
+    """
+    width = max(len(options) for options in options_by_group)
+    weights = np.zeros((len(options_by_group), width))
+    labels = np.full((len(options_by_group), width), "", dtype=object)
+    for group, options in enumerate(options_by_group):
+        weights[group, :len(options)] = 1
+        labels[group, :len(options)] = options
+    return weights, labels
+
+def sample_conditional(rng, weights, groups):
+    """
+    Draw one option index per row from the weight row selected by its group.
     
-    # Create dataframe
-    df = pd.DataFrame(users)
+    Args:
+        rng (numpy.random.Generator): Random source.
+        weights (numpy.ndarray): Unnormalized weights of shape [groups, options].
+        groups (numpy.ndarray): Group index of each row.
     
-    return df
+    Returns:
+        numpy.ndarray: Sampled option index per row.
+    """
+    cumulative = np.cumsum(weights, axis=1)
+    cumulative /= cumulative[:, -1:]
+    draws = rng.random(len(groups))
+    return np.minimum((draws[:, None] >= cumulative[groups]).sum(axis=1), weights.shape[1] - 1)
 
-def main():
-    """Generate and save the technology adoption dataset"""
-    print(f"Generating technology adoption dataset with {NUM_USERS} users...")
-    df = generate_dataset()
+def contains(values, text):
+    """Elementwise `text in value` for an array of strings."""
+    return np.char.find(np.asarray(values).astype(str), text) >= 0
+
+def generate_tech_adoption_profiles(first_index, num_users, rng, city_pool):
+    """
+    Generate many technology adoption profiles at once, column by column.
+    
+    Draws every field from the same conditional distributions as
+    `generate_tech_adoption_profile`, but as NumPy arrays: categorical fields use one
+    inverse-CDF draw per row keyed on age band or adopter category, and adoption across
+    TECH_CATEGORIES is a boolean mask per category. Non-hub locations come from
+    `city_pool`, a list of independent Faker draws, which keeps each user's location
+    distributed exactly like a fresh Faker city.
+    
+    Args:
+        first_index (int): Index of the first user, used for user IDs.
+        num_users (int): Number of profiles.
+        rng (numpy.random.Generator): Random source.
+        city_pool (list[str]): "City, ST" strings from Faker.
+    
+    Returns:
+        pandas.DataFrame: One row per user, with the same columns as the per-user profile.
+    """
+    n = num_users
+    adopter_labels = np.array(ADOPTER_CATEGORIES, dtype=object)
+    budget_labels = np.array(BUDGET_CATEGORIES, dtype=object)
+    
+    def by_adopter(mapping):
+        return np.array([mapping[category] for category in ADOPTER_CATEGORIES])
+    
+    # Adopter category weighted by age band: under 30, over 55, everyone else
+    age = rng.integers(18, 76, n)
+    age_band = np.where(age < 30, 0, np.where(age > 55, 1, 2))
+    adopter = sample_conditional(rng, np.array([ADOPTER_WEIGHTS_UNDER_30, ADOPTER_WEIGHTS_OVER_55, ADOPTER_WEIGHTS]), age_band)
+    
+    # Tech interest level correlates with adopter category
+    interest_weights, interest_labels = option_table([TECH_INTEREST_BY_ADOPTER[c] for c in ADOPTER_CATEGORIES])
+    tech_interest = interest_labels[adopter, sample_conditional(rng, interest_weights, adopter)]
+    
+    # Income: bell curve over age, shifted by adopter category
+    income_factor = np.minimum(1.0, (age - 18) / 30)
+    income_factor = income_factor * (2 - income_factor)
+    income_factor = np.clip(income_factor + by_adopter(ADOPTER_BUDGET_BOOST)[adopter], 0.1, 1.0)
+    annual_income = np.round(35000 + (income_factor * 165000) + rng.random(n) * 100, 2)
+    
+    budget = sample_conditional(rng, by_adopter(BUDGET_WEIGHTS_BY_ADOPTER), adopter)
+    
+    # Preferred platforms: a random ordered subset of the age band's platforms, one
+    # random sort key per option with padding pushed to the end
+    platform_band = sum((age >= max_age).astype(int) for max_age, _ in PLATFORMS_BY_AGE if max_age is not None)
+    platform_weights, platform_labels = option_table([platforms for _, platforms in PLATFORMS_BY_AGE])
+    num_platforms = np.minimum(np.clip(6 - adopter, 1, 5), platform_weights.sum(axis=1).astype(int)[platform_band])
+    sort_keys = np.where(platform_weights[platform_band] > 0, rng.random((n, platform_weights.shape[1])), 2.0)
+    chosen = platform_labels[platform_band[:, None], np.argsort(sort_keys, axis=1)]
+    preferred_platforms = chosen[:, 0]
+    for j in range(1, chosen.shape[1]):
+        preferred_platforms = np.where(num_platforms > j, preferred_platforms + ", " + chosen[:, j], preferred_platforms)
+    
+    # Adoption timing and product preference for every category at once
+    adoption = {}
+    timing_low = by_adopter({c: ADOPTION_TIMING[c][0] for c in ADOPTER_CATEGORIES})[adopter]
+    timing_high = by_adopter({c: ADOPTION_TIMING[c][1] for c in ADOPTER_CATEGORIES})[adopter]
+    product_start = np.array([PRODUCT_RANGE_BY_BUDGET[b][0] for b in BUDGET_CATEGORIES])[budget]
+    product_count = np.array([PRODUCT_RANGE_BY_BUDGET[b][1] - PRODUCT_RANGE_BY_BUDGET[b][0] for b in BUDGET_CATEGORIES])[budget]
+    adopts = rng.random((n, len(TECH_CATEGORIES))) < by_adopter(ADOPTION_PROBABILITY)[adopter, None]
+    for j, (category, products) in enumerate(TECH_CATEGORIES.items()):
+        product = np.array(products, dtype=object)[product_start + (rng.random(n) * product_count).astype(int)]
+        adoption[category] = (
+            np.where(adopts[:, j], rng.integers(timing_low, timing_high + 1), -1),
+            np.where(adopts[:, j], product, "None")
+        )
+    
+    # Purchasing factors are the first two choices for the adopter category
+    factor_weights, factor_labels = option_table([PURCHASING_FACTORS_BY_ADOPTER[c] for c in ADOPTER_CATEGORIES])
+    
+    # Technical proficiency; users over 60 get the lowest option
+    proficiency_weights, proficiency_labels = option_table([PROFICIENCY_BY_ADOPTER[c] for c in ADOPTER_CATEGORIES])
+    proficiency = sample_conditional(rng, proficiency_weights, adopter)
+    lowest_proficiency = proficiency_weights.sum(axis=1).astype(int)[adopter] - 1
+    technical_proficiency = proficiency_labels[adopter, np.where(age > 60, lowest_proficiency, proficiency)]
+    
+    education = np.array(EDUCATION_LEVELS, dtype=object)[
+        sample_conditional(rng, np.array([EDUCATION_WEIGHTS]), np.zeros(n, dtype=int))
+    ]
+    
+    # Job sector and location: tech sectors and tech hubs are likelier for early adopters
+    job_sector = np.where(
+        rng.random(n) < by_adopter(TECH_SECTOR_PROBABILITY)[adopter],
+        np.array(TECH_SECTORS, dtype=object)[rng.integers(0, len(TECH_SECTORS), n)],
+        np.array(NON_TECH_SECTORS, dtype=object)[rng.integers(0, len(NON_TECH_SECTORS), n)]
+    )
+    location = np.where(
+        rng.random(n) < by_adopter(TECH_HUB_PROBABILITY)[adopter],
+        np.array(TECH_HUBS, dtype=object)[rng.integers(0, len(TECH_HUBS), n)],
+        np.array(city_pool, dtype=object)[rng.integers(0, len(city_pool), n)]
+    )
+    gender = np.array(GENDERS, dtype=object)[rng.integers(0, len(GENDERS), n)]
+    
+    # Marketing persona, in the same order of precedence as the per-user rules
+    enthusiast = (adopter <= 1) & np.isin(tech_interest, ["Very High", "High"])
+    mainstream = (adopter == 2) & np.isin(tech_interest, ["High", "Moderate"])
+    persona = np.select(
+        [enthusiast & (budget <= 1), enthusiast, mainstream & np.isin(job_sector, TECH_SECTORS), mainstream, adopter == 3],
+        ["Premium Tech Enthusiast", "Value-Conscious Tech Enthusiast", "Practical Professional", "Mainstream Adopter", "Tech Pragmatist"],
+        "Late Adopter"
+    )
+    
+    # Brand loyalty (0-10 scale) ranges for owners, non-users and everyone else
+    loyalty_low, loyalty_high = np.array([7, 0, 1]), np.array([10, 3, 6])
+    smartphone = adoption["Smartphones"][1]
+    smarthome = adoption["Smart Home"][1]
+    no_phone = smartphone == "None"
+    apple_tier = np.select([contains(smartphone, "iPhone"), no_phone], [0, 1], 2)
+    samsung_owner = contains(smartphone, "Samsung") | contains(smarthome, "Samsung")
+    samsung_tier = np.select([samsung_owner, no_phone | (smarthome == "None")], [0, 1], 2)
+    
+    user_ids = np.char.zfill(np.arange(first_index + 1, first_index + n + 1).astype(str), 4)
+    
+    profiles = {
+        "user_id": "TU" + user_ids.astype(object),
+        "age": age,
+        "gender": gender,
+        "location": location,
+        "education": education,
+        "job_sector": job_sector,
+        "annual_income": annual_income,
+        "adopter_category": adopter_labels[adopter],
+        "tech_interest": tech_interest,
+        "budget_category": budget_labels[budget],
+        "technical_proficiency": technical_proficiency,
+        "preferred_platforms": preferred_platforms,
+        "primary_purchasing_factor": factor_labels[adopter, 0],
+        "secondary_purchasing_factor": factor_labels[adopter, 1]
+    }
+    for category, prefix in CATEGORY_COLUMNS.items():
+        profiles[f"{prefix}_adoption_timing"], profiles[f"{prefix}_preferred_product"] = adoption[category]
+    profiles["persona"] = persona
+    profiles["apple_loyalty"] = rng.integers(loyalty_low[apple_tier], loyalty_high[apple_tier] + 1)
+    profiles["samsung_loyalty"] = rng.integers(loyalty_low[samsung_tier], loyalty_high[samsung_tier] + 1)
+    
+    return pd.DataFrame(profiles)
+
+def shard_seed(seed, shard_index):
+    """Derive an independent, deterministic seed for one shard."""
+    return int(np.random.SeedSequence([seed, shard_index]).generate_state(1)[0])
+
+def generate_shard(shard_index, num_users, shard_size=SHARD_SIZE, seed=SEED, vectorized=True):
+    """
+    Generate the users of one shard with generators seeded only by (seed, shard_index).
+    
+    Shard i covers users [i * shard_size, (i + 1) * shard_size), clipped to num_users.
+    `vectorized` samples whole columns with NumPy; otherwise each user goes through
+    `generate_tech_adoption_profile`, the slower reference implementation.
+    """
+    sub_seed = shard_seed(seed, shard_index)
+    shard_fake = Faker()
+    shard_fake.seed_instance(sub_seed)
+    first = shard_index * shard_size
+    last = min((shard_index + 1) * shard_size, num_users)
+    
+    if vectorized:
+        city_pool = [f"{shard_fake.city()}, {shard_fake.state_abbr()}" for _ in range(CITY_POOL_SIZE)]
+        df = generate_tech_adoption_profiles(first, last - first, np.random.default_rng(sub_seed), city_pool)
+    else:
+        rng = random.Random(sub_seed)
+        df = pd.DataFrame([
+            generate_tech_adoption_profile(generate_user_id(i), rng=rng, fake=shard_fake) for i in range(first, last)
+        ])
+    
+    # Create text descriptions
+    df["user_description"] = [create_user_description(user) for user in df.to_dict("records")]
     
     # Format income values as currency with cents for display
     df['formatted_income'] = df['annual_income'].apply(lambda x: f"${x:.2f}")
+    return df
+
+def generate_dataset(num_users=NUM_USERS, shard_size=SHARD_SIZE, seed=SEED, vectorized=True):
+    """Generate a complete dataset of tech adoption profiles in memory"""
+    num_shards = -(-num_users // shard_size)
+    shards = [generate_shard(k, num_users, shard_size, seed, vectorized) for k in range(num_shards)]
+    return pd.concat(shards, ignore_index=True)
+
+def distribution_columns(df):
+    """
+    Columns compared by `check_distributions`.
+    
+    High-cardinality fields are reduced to what the samplers control: whether the
+    location is a tech hub, and how many and which platforms were picked first. A few
+    joint columns check that the conditional structure survives, not just the marginals.
+    """
+    platforms = df["preferred_platforms"].str.split(", ")
+    columns = {
+        column: df[column].astype(str)
+        for column in df.columns
+        if column not in ("user_id", "location", "annual_income", "preferred_platforms", "user_description", "formatted_income")
+    }
+    columns["is_tech_hub"] = df["location"].isin(TECH_HUBS).astype(str)
+    columns["num_platforms"] = platforms.str.len().astype(str)
+    columns["first_platform"] = platforms.str[0]
+    age_band = pd.cut(df["age"], [17, 24, 29, 39, 54, 55, 60, 75]).astype(str)
+    columns["age_band x adopter_category"] = age_band + " | " + df["adopter_category"]
+    columns["adopter_category x budget_category"] = df["adopter_category"] + " | " + df["budget_category"]
+    columns["age_band x technical_proficiency"] = age_band + " | " + df["technical_proficiency"]
+    return columns
+
+def check_distributions(num_users=10000, seed=SEED, alpha=0.001):
+    """
+    Check that the vectorized sampler matches the per-user reference implementation.
+    
+    Generates independent samples with both samplers and runs a chi-square test of
+    homogeneity on every categorical or discrete column (categories with fewer than 5
+    observations are pooled) and a two-sample Kolmogorov-Smirnov test on income.
+    The significance level is Bonferroni-corrected for the number of tests.
     
-    # Save the dataset
-    df.to_csv(OUTPUT_FILE, index=False)
-    print(f"Dataset saved to {OUTPUT_FILE}")
-    print(f"Dataset shape: {df.shape}")
+    Returns:
+        bool: True when no column differs significantly.
+    """
+    try:
+        # Imported lazily so generating data does not need scipy
+        from scipy.stats import chi2_contingency, ks_2samp
+    except ImportError:
+        raise SystemExit("--check-distributions requires scipy: pip install scipy")
+    
+    print(f"Comparing samplers on {num_users} users each...")
+    reference = generate_shard(0, num_users, num_users, seed, vectorized=False)
+    vectorized = generate_shard(0, num_users, num_users, seed + 1, vectorized=True)
+    
+    p_values = {}
+    reference_columns = distribution_columns(reference)
+    vectorized_columns = distribution_columns(vectorized)
+    for column, reference_values in reference_columns.items():
+        counts = pd.DataFrame({
+            "reference": reference_values.value_counts(),
+            "vectorized": vectorized_columns[column].value_counts()
+        }).fillna(0)
+        rare = counts.sum(axis=1) < 5
+        if rare.any():
+            counts = pd.concat([counts[~rare], counts[rare].sum().to_frame("other").T])
+        if len(counts) > 1:
+            p_values[column] = chi2_contingency(counts.to_numpy().T)[1]
+    p_values["annual_income"] = ks_2samp(reference["annual_income"], vectorized["annual_income"]).pvalue
+    
+    threshold = alpha / len(p_values)
+    failures = [column for column, p in p_values.items() if p < threshold]
+    for column, p in sorted(p_values.items(), key=lambda item: item[1]):
+        print(f"{'FAIL' if p < threshold else 'ok':4}  p={p:.4f}  {column}")
+    print(f"{len(p_values) - len(failures)}/{len(p_values)} columns consistent (alpha={alpha}, Bonferroni-corrected)")
+    return not failures
+
+def _write_shard(args):
+    """Worker task: generate one shard, write it as CSV and return its path and category counts"""
+    shard_index, num_users, shard_size, seed, vectorized, shard_dir = args
+    df = generate_shard(shard_index, num_users, shard_size, seed, vectorized)
+    
+    # Only the first shard carries the header, so shards can be concatenated byte for byte
+    shard_path = os.path.join(shard_dir, f"shard_{shard_index:06d}.csv")
+    df.to_csv(shard_path, index=False, header=shard_index == 0)
+    
+    counts = {column: df[column].value_counts().to_dict() for column in STATISTICS_COLUMNS}
+    return shard_path, len(df), counts
+
+def write_dataset(num_users=NUM_USERS, output_file=OUTPUT_FILE, num_workers=None, shard_size=SHARD_SIZE, seed=SEED,
+                  vectorized=True):
+    """
+    Generate the dataset across worker processes and stream it to a CSV file.
+    
+    Workers write one shard file each; shards are appended to the output in order as
+    soon as they are ready, so memory stays bounded by the shard size and the file is
+    byte-identical for any number of workers.
+    
+    Returns:
+        dict: Value counts per column in STATISTICS_COLUMNS.
+    """
+    num_workers = num_workers or os.cpu_count() or 1
+    num_shards = -(-num_users // shard_size)
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    shard_dir = tempfile.mkdtemp(prefix="shards_", dir=output_dir)
+    tmp_file = f"{output_file}.tmp"
+    
+    totals = {column: {} for column in STATISTICS_COLUMNS}
+    tasks = [(k, num_users, shard_size, seed, vectorized, shard_dir) for k in range(num_shards)]
+    written = 0
+    try:
+        with multiprocessing.Pool(min(num_workers, max(1, num_shards))) as pool, open(tmp_file, "wb") as out:
+            # imap yields shards in order while later shards are still being generated
+            for shard_path, rows, counts in pool.imap(_write_shard, tasks):
+                with open(shard_path, "rb") as shard:
+                    shutil.copyfileobj(shard, out)
+                os.remove(shard_path)
+                
+                for column, column_counts in counts.items():
+                    for value, count in column_counts.items():
+                        totals[column][value] = totals[column].get(value, 0) + count
+                written += rows
+                print(f"Wrote {written}/{num_users} users")
+        os.replace(tmp_file, output_file)
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    
+    return totals
+
+def main():
+    """Generate and save the technology adoption dataset"""
+    parser = argparse.ArgumentParser(description="Generate the technology adoption dataset")
+    parser.add_argument("--num-users", type=int, default=NUM_USERS)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU)")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--scalar", action="store_true", help="Use the per-user reference sampler")
+    parser.add_argument("--check-distributions", type=int, metavar="USERS", default=None,
+                        help="Compare the vectorized and reference samplers on this many users and exit (requires scipy)")
+    args = parser.parse_args()
+    
+    if args.check_distributions:
+        raise SystemExit(0 if check_distributions(args.check_distributions, args.seed) else 1)
+    
+    print(f"Generating technology adoption dataset with {args.num_users} users...")
+    stats = write_dataset(args.num_users, args.output, args.workers, args.shard_size, args.seed, not args.scalar)
+    print(f"Dataset saved to {args.output}")
     
     # Print sample statistics
     print("\nSample Statistics:")
-    print(f"Adopter Categories: {df['adopter_category'].value_counts().to_dict()}")
-    print(f"Tech Interest Levels: {df['tech_interest'].value_counts().to_dict()}")
-    print(f"Budget Categories: {df['budget_category'].value_counts().to_dict()}")
-    print(f"Technical Proficiency: {df['technical_proficiency'].value_counts().to_dict()}")
-    print(f"Personas: {df['persona'].value_counts().to_dict()}")
-    
+    print(f"Adopter Categories: {stats['adopter_category']}")
+    print(f"Tech Interest Levels: {stats['tech_interest']}")
+    print(f"Budget Categories: {stats['budget_category']}")
+    print(f"Technical Proficiency: {stats['technical_proficiency']}")
+    print(f"Personas: {stats['persona']}")
+    
+    # Sample from the head of the file instead of loading the whole dataset
+    df = pd.read_csv(args.output, nrows=1000)
     print("\nSample of 5 users with income:")
     sample_columns = ['user_id', 'age', 'adopter_category', 'formatted_income', 'tech_interest', 'persona']
-    print(df[sample_columns].sample(5).to_string())
+    print(df[sample_columns].sample(min(5, len(df)), random_state=args.seed).to_string())
     
     print("\nSample user description:")
     print(df['user_description'].iloc[0])
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -4,15 +4,36 @@ import numpy as np
 from pathlib import Path
 from sentence_transformers import SentenceTransformer
 
+from parallel_embedding import ParallelEncoder, should_use_process_pool
+from quantization import SALT_SUFFIX, is_quantized, quantize_linear_layers
+from scalar_quantization import quantized_path, write_quantized
+from streaming_embedding import DEFAULT_CHUNK_ROWS, stream_embeddings
+from token_batching import DEFAULT_MAX_TOKENS, TokenBatchEncoder
+
 # Define constants
 DATA_FILE = "data/tech_adoption_dataset.csv"
 EMBEDDINGS_FILE = "data/tech_embeddings.npy"
+MANIFEST_FILE = "data/tech_embeddings_hashes.npy"
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+MODEL_DIR = "model/sentence-transformer"
+
+# Worker processes for CPU encoding: None uses every core for large inputs, 1 disables the pool
+EMBEDDING_WORKERS = None
+
+# Padded tokens per encoding batch: None tunes the budget on this machine for large inputs
+EMBEDDING_MAX_TOKENS = None
+
+# Opt in to int8 linear layers when running on CPU; check the accuracy drift with
+# `python quantization.py` first
+EMBEDDING_QUANTIZE = False
+
+# Storage dtype searched by the deployed model: "float32", or "float16" / "int8" to also
+# write a smaller quantized copy of the embeddings
+# (check the recall against float32 with `python scalar_quantization.py`)
+EMBEDDING_STORAGE = "float32"
 
 def load_or_download_model():
     """Load or download the sentence transformer model"""
-    MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
-    MODEL_DIR = "model/sentence-transformer"
-    
     # Create model directory if it doesn't exist
     model_dir = Path(MODEL_DIR)
     model_dir.mkdir(exist_ok=True, parents=True)
@@ -31,17 +52,62 @@ def load_or_download_model():
         model.save(MODEL_DIR)
         print(f"Model downloaded and saved to: {MODEL_DIR}")
     
+    # int8 kernels only run on CPU, so a GPU keeps the fp32 model
+    if EMBEDDING_QUANTIZE and model.device.type == "cpu":
+        model = quantize_linear_layers(model)
+        print("Using int8 quantized linear layers")
+    
     return model
 
-def generate_embeddings(model, texts, batch_size=32):
-    """Generate embeddings for the texts"""
-    print(f"Generating embeddings for {len(texts)} texts in batches of {batch_size}...")
-    embeddings = model.encode(texts, batch_size=batch_size, show_progress_bar=True)
+def make_pool(encoder, num_workers=EMBEDDING_WORKERS):
+    """
+    Worker pool that encodes like `encoder`, loading the model from MODEL_DIR.
+    
+    The workers start on the first large input and stay up until the pool is closed.
+    """
+    model = encoder.model
+    return ParallelEncoder(
+        MODEL_DIR,
+        model.get_sentence_embedding_dimension(),
+        num_workers=num_workers,
+        quantize=is_quantized(model)
+    )
+
+def generate_embeddings(encoder, texts, num_workers=EMBEDDING_WORKERS, pool=None):
+    """
+    Generate embeddings for the texts.
+    
+    `encoder` is a TokenBatchEncoder wrapping the loaded model: batches are sized by
+    padded token count rather than by number of texts. On CPU, large inputs are sharded
+    across worker processes that each load the model from MODEL_DIR; on GPU, or with
+    num_workers=1, the loaded model encodes everything. Either way the token budget is
+    tuned on the first large input (in this process, for the workers) and the throughput
+    is reported in tokens/sec. `pool`, from `make_pool`, keeps the worker processes up
+    across calls.
+    """
+    model = encoder.model
+    print(f"Generating embeddings for {len(texts)} texts...")
+    if should_use_process_pool(model, len(texts), num_workers) and os.path.exists(MODEL_DIR):
+        if pool is None:
+            with make_pool(encoder, num_workers) as pool:
+                embeddings = pool.encode(texts, encoder)
+        else:
+            embeddings = pool.encode(texts, encoder)
+    else:
+        # Tunes the token budget on the first large input, then reports tokens/sec
+        embeddings = encoder.encode(texts, show_progress_bar=True)
     print(f"Generated embeddings with shape: {embeddings.shape}")
     return embeddings
 
-def main():
-    """Generate embeddings for technology user descriptions"""
+def main(incremental=True, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    Generate embeddings for technology user descriptions.
+    
+    The dataset is streamed in chunks of `chunk_rows` users (read, encode, append), so
+    memory does not grow with the number of users, and an interrupted run resumes after
+    the last completed chunk. With `incremental`, users whose description hash matches
+    the previous run keep their stored vector and only new or changed users are embedded.
+    """
     # Ensure data directory exists
     os.makedirs("data", exist_ok=True)
     
@@ -51,27 +117,41 @@ def main():
         print("Please run the data generation script (00_generate_tech_adoption_data.py) first.")
         return
     
-    # Load the model
-    model = load_or_download_model()
-    
-    # Load data
-    print(f"Loading technology adoption data from {DATA_FILE}...")
-    df = pd.read_csv(DATA_FILE)
-    print(f"Loaded data for {len(df)} users")
-    
-    # Check if we have pre-formatted descriptions
-    if "user_description" not in df.columns:
+    # Check if we have pre-formatted descriptions (reads only the header)
+    if "user_description" not in pd.read_csv(DATA_FILE, nrows=0).columns:
         print("Error: Dataset doesn't contain pre-formatted user descriptions.")
         print("Please re-run the data generation script to create user descriptions.")
         return
     
-    # Get descriptions and generate embeddings
-    descriptions = df["user_description"].tolist()
-    embeddings = generate_embeddings(model, descriptions)
+    # Load the model
+    model = load_or_download_model()
+    
+    # One encoder for the whole run, so the token budget is tuned at most once
+    encoder = TokenBatchEncoder(model, EMBEDDING_MAX_TOKENS)
+    
+    # Stream the descriptions through the embedding pipeline, saving them with their hashes;
+    # on CPU, one worker pool encodes every chunk
+    print(f"Embedding technology adoption data from {DATA_FILE} in chunks of {chunk_rows} users...")
+    with make_pool(encoder) as pool:
+        stats = stream_embeddings(
+            DATA_FILE,
+            lambda chunk: chunk["user_description"].tolist(),
+            lambda texts: generate_embeddings(encoder, texts, pool=pool),
+            EMBEDDINGS_FILE,
+            MANIFEST_FILE,
+            salt=MODEL_NAME + (SALT_SUFFIX if is_quantized(model) else ""),
+            chunk_rows=chunk_rows,
+            reuse_previous=incremental,
+            read_csv_kwargs={"usecols": ["user_description"]}
+        )
+    print(f"Embedded {stats['embedded']} users, reused {stats['reused']}, "
+          f"recovered {stats['resumed']} from a checkpoint")
+    print(f"Saved {stats['rows']} embeddings to {EMBEDDINGS_FILE}")
     
-    # Save embeddings
-    np.save(EMBEDDINGS_FILE, embeddings)
-    print(f"Saved embeddings to {EMBEDDINGS_FILE}")
+    # The float32 file stays the source for incremental runs; search uses the stored dtype
+    search_file = quantized_path(EMBEDDINGS_FILE, EMBEDDING_STORAGE)
+    if search_file != EMBEDDINGS_FILE:
+        write_quantized(np.load(EMBEDDINGS_FILE, mmap_mode="r"), search_file, EMBEDDING_STORAGE)
     print("Embedding process completed successfully!")
 
 if __name__ == "__main__":
@@ -0,0 +1,122 @@
+"""
+Incremental re-embedding driven by content hashes.
+
+Alongside each embeddings file we keep a manifest with one hash per row of the exact
+text that was embedded (salted with the model name). On the next run, rows whose hash
+is already in the manifest reuse their stored vector, only new or changed texts go
+through the model, and rows that disappeared from the dataset are dropped. Outputs are
+written to a temporary file and renamed into place, so a crash never leaves a half
+written embeddings file or a manifest that does not match it.
+"""
+import hashlib
+import os
+
+import numpy as np
+
+
+def text_hashes(texts, salt=""):
+    """
+    Hash every text.
+
+    Args:
+        texts (list[str]): Texts exactly as they are passed to the model.
+        salt (str): Mixed into every hash; use the model name so a model change re-embeds everything.
+
+    Returns:
+        numpy.ndarray: Hex digests, one per text.
+    """
+    prefix = f"{salt}\0".encode("utf-8")
+    return np.array(
+        [hashlib.blake2b(prefix + str(text).encode("utf-8"), digest_size=16).hexdigest() for text in texts],
+        dtype="<U32",
+    )
+
+
+def load_manifest(path):
+    """Return the hashes saved at `path`, or None if there is no manifest yet."""
+    if not os.path.exists(path):
+        return None
+    return np.load(path)
+
+
+def atomic_save_npy(path, array):
+    """Save an array with `np.save`, replacing `path` only once the write has finished."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def incremental_embed(texts, embed_fn, previous_embeddings=None, previous_hashes=None, salt=""):
+    """
+    Embed only the texts that are not covered by a previous run.
+
+    Args:
+        texts (list[str]): Current texts, in dataset order.
+        embed_fn (callable): Maps a list of texts to an array of shape [len(texts), dim].
+        previous_embeddings (numpy.ndarray, optional): Embeddings from the previous run.
+        previous_hashes (numpy.ndarray, optional): Manifest from the previous run.
+        salt (str): Hash salt, normally the model name.
+
+    Returns:
+        tuple: (embeddings in dataset order, hashes for the new manifest, stats dict with
+        counts of reused, embedded and removed rows).
+    """
+    hashes = text_hashes(texts, salt)
+
+    # Only trust the previous run when its manifest lines up with its embeddings
+    if (
+        previous_embeddings is None
+        or previous_hashes is None
+        or len(previous_embeddings) != len(previous_hashes)
+    ):
+        previous_embeddings, previous_hashes = None, np.array([], dtype="<U32")
+
+    position = {h: i for i, h in enumerate(previous_hashes)}
+    source = np.fromiter((position.get(h, -1) for h in hashes), dtype=np.int64, count=len(hashes))
+    reused = source >= 0
+    new_rows = np.flatnonzero(~reused)
+
+    computed = None
+    if len(new_rows):
+        computed = np.asarray(embed_fn([texts[i] for i in new_rows]), dtype=np.float32)
+
+    if computed is not None:
+        dim = computed.shape[1]
+    elif previous_embeddings is not None:
+        dim = previous_embeddings.shape[1]
+    else:
+        dim = 0
+
+    embeddings = np.empty((len(texts), dim), dtype=np.float32)
+    if reused.any():
+        embeddings[reused] = previous_embeddings[source[reused]]
+    if computed is not None:
+        embeddings[new_rows] = computed
+
+    stats = {
+        "total": len(texts),
+        "reused": int(reused.sum()),
+        "embedded": len(new_rows),
+        "removed": int(np.count_nonzero(~np.isin(previous_hashes, hashes))),
+    }
+    return embeddings, hashes, stats
+
+
+def write_outputs(manifest_path, hashes, write_embeddings):
+    """
+    Replace the embeddings and their manifest.
+
+    The old manifest is removed first and the new one is written last, so a crash in
+    between leaves embeddings without a manifest. The next run then re-embeds everything
+    instead of pairing new embeddings with stale hashes.
+
+    Args:
+        manifest_path (str): Path of the hash manifest.
+        hashes (numpy.ndarray): Hashes returned by `incremental_embed`.
+        write_embeddings (callable): Writes the embeddings file atomically.
+    """
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    write_embeddings()
+    atomic_save_npy(manifest_path, hashes)
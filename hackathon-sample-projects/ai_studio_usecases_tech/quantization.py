@@ -0,0 +1,125 @@
+"""
+Opt-in int8 inference for the embedding model on CPU.
+
+The linear layers, which hold almost all of all-MiniLM-L6-v2's weights and compute, are
+quantized dynamically: weights are stored as int8 and activations are quantized on the
+fly, so no calibration data is needed. Quantizing takes a fraction of a second, so it
+is simply redone every time the model is loaded.
+
+int8 vectors are close to, but not the same as, fp32 ones. `recall_drift` measures how
+much nearest-neighbour results move, and running this file compares both modes on the
+project's dataset:
+
+    python quantization.py --k 10 --limit 5000
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+# Mixed into content-hash salts, so int8 and fp32 vectors are never reused for each other
+SALT_SUFFIX = "-int8"
+
+
+def is_quantized(model):
+    """True if `model` has dynamic int8 linear layers."""
+    return any(isinstance(module, torch.ao.nn.quantized.dynamic.Linear) for module in model.modules())
+
+
+def quantize_linear_layers(model):
+    """Replace every torch.nn.Linear of an fp32 CPU model with a dynamic int8 version, in place."""
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def load_sentence_transformer(model_path, quantize=False):
+    """
+    Load a SentenceTransformer, optionally in int8 on CPU.
+
+    Args:
+        model_path (str): Local model directory or Hugging Face model name.
+        quantize (bool): Use dynamic int8 linear layers. Forces the model onto the CPU,
+            where the int8 kernels run.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    if not quantize:
+        return SentenceTransformer(model_path)
+    model = SentenceTransformer(model_path, device="cpu")
+    return quantize_linear_layers(model)
+
+
+def _normalize(embeddings):
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+
+def recall_drift(reference, candidate, k=10, num_queries=1000, seed=0):
+    """
+    Compare nearest neighbours found with two embeddings of the same texts.
+
+    A sample of rows is used as queries against all rows (excluding the query itself),
+    once with the reference (fp32) and once with the candidate (int8) embeddings.
+
+    Args:
+        reference (numpy.ndarray): fp32 embeddings of shape [rows, dim].
+        candidate (numpy.ndarray): Embeddings of the same texts to evaluate.
+        k (int): Neighbours per query.
+        num_queries (int): Rows used as queries.
+        seed (int): Seed for choosing the query rows.
+
+    Returns:
+        dict: recall@k of the candidate against the reference neighbours, the share of
+        queries with the same top-1, and the mean and minimum cosine similarity between
+        each row's two vectors.
+    """
+    reference, candidate = _normalize(reference), _normalize(candidate)
+    k = min(k, len(reference) - 1)
+    queries = np.random.default_rng(seed).choice(len(reference), min(num_queries, len(reference)), replace=False)
+
+    def neighbours(embeddings):
+        scores = embeddings[queries] @ embeddings.T
+        scores[np.arange(len(queries)), queries] = -np.inf
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        return np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+
+    expected, found = neighbours(reference), neighbours(candidate)
+    overlap = [len(np.intersect1d(e, f)) for e, f in zip(expected, found)]
+    cosine = np.sum(reference * candidate, axis=1)
+    return {
+        f"recall@{k}": float(np.mean(overlap) / k),
+        "top1_agreement": float(np.mean(expected[:, 0] == found[:, 0])),
+        "mean_cosine": float(cosine.mean()),
+        "min_cosine": float(cosine.min()),
+    }
+
+
+def _timed_encode(model, texts, batch_size):
+    start = time.perf_counter()
+    embeddings = model.encode(texts, batch_size=batch_size, show_progress_bar=False, convert_to_numpy=True)
+    return embeddings, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="Compare int8 and fp32 embeddings on the project's dataset")
+    parser.add_argument("--data", default="data/tech_adoption_dataset.csv")
+    parser.add_argument("--text-column", default="user_description")
+    parser.add_argument("--model-dir", default="model/sentence-transformer")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--limit", type=int, default=5000, help="Rows of the dataset to embed")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    texts = pd.read_csv(args.data, usecols=[args.text_column], nrows=args.limit)[args.text_column].astype(str).tolist()
+    print(f"Embedding {len(texts)} texts from {args.data} in fp32 and int8")
+
+    fp32, fp32_seconds = _timed_encode(load_sentence_transformer(args.model_dir).to("cpu"), texts, args.batch_size)
+    int8, int8_seconds = _timed_encode(load_sentence_transformer(args.model_dir, quantize=True), texts, args.batch_size)
+
+    print(f"fp32: {len(texts) / fp32_seconds:.1f} texts/sec, int8: {len(texts) / int8_seconds:.1f} texts/sec "
+          f"({fp32_seconds / int8_seconds:.2f}x)")
+    for name, value in recall_drift(fp32, int8, args.k, args.queries).items():
+        print(f"{name}: {value:.4f}")
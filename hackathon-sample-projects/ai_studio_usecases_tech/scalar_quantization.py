@@ -0,0 +1,278 @@
+"""
+Scalar-quantized storage for the embedding matrix.
+
+Besides the float32 `.npy` written by the embedding pipeline, embeddings can be stored
+as:
+
+- float16, in a `.float16.npy` file next to it (half the size, memory-mapped on load);
+- int8, in a `.int8.npz` file holding one byte per value plus a float32 scale and offset
+  per dimension (a quarter of the size). Each dimension's [min, max] range is split into
+  256 steps, so `value ~= code * scale + offset`.
+
+`QuantizedEmbeddings` scores queries against the stored codes block by block, so only
+one block of rows is ever widened to float32. For int8, the per-dimension scale is
+folded into the query instead of being applied to every row:
+
+    rows @ query = codes @ (scale * query) + offset @ query
+
+Running this file measures how much ranking quality each storage gives up against
+float32:
+
+    python scalar_quantization.py --embeddings data/tech_embeddings.npy --k 10
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+STORAGE_DTYPES = ("float32", "float16", "int8")
+
+# Rows widened to float32 at a time when quantizing or scoring; small enough for the
+# widened block to stay in cache between the conversion and the matrix product
+DEFAULT_BLOCK_ROWS = 1024
+
+INT8_LEVELS = 255
+
+
+def quantized_path(embeddings_file, storage):
+    """File the embeddings in `embeddings_file` are stored in with the given storage dtype."""
+    if storage not in STORAGE_DTYPES:
+        raise ValueError(f"Unknown embedding storage {storage!r}, expected one of {STORAGE_DTYPES}")
+    if storage == "float32":
+        return embeddings_file
+    stem = os.path.splitext(embeddings_file)[0]
+    return f"{stem}.{storage}.npz" if storage == "int8" else f"{stem}.{storage}.npy"
+
+
+def _blocks(num_rows, block_rows):
+    for start in range(0, num_rows, block_rows):
+        yield start, min(start + block_rows, num_rows)
+
+
+class QuantizedEmbeddings:
+    """Embedding matrix stored as float32, float16 or int8 codes, dequantized on access."""
+
+    def __init__(self, codes, scale=None, offset=None, block_rows=DEFAULT_BLOCK_ROWS):
+        """
+        Args:
+            codes (numpy.ndarray): Stored values of shape [rows, dim]; may be a memory map.
+            scale (numpy.ndarray, optional): Per-dimension scale of uint8 codes.
+            offset (numpy.ndarray, optional): Per-dimension offset of uint8 codes.
+            block_rows (int): Rows dequantized at a time when scoring.
+        """
+        if codes.ndim != 2:
+            raise ValueError(f"Embeddings must be 2D, got shape {codes.shape}")
+        if (scale is None) != (codes.dtype != np.uint8):
+            raise ValueError("uint8 codes need a scale and offset, float embeddings must not have one")
+        self.codes = codes
+        self.scale = None if scale is None else np.asarray(scale, dtype=np.float32)
+        self.offset = None if offset is None else np.asarray(offset, dtype=np.float32)
+        self.block_rows = block_rows
+        self._norms = None
+
+    @classmethod
+    def load(cls, path, block_rows=DEFAULT_BLOCK_ROWS):
+        """Load a `.npy` (float32 or float16, memory-mapped) or `.int8.npz` embeddings file."""
+        if path.endswith(".npz"):
+            with np.load(path) as data:
+                return cls(data["codes"], data["scale"], data["offset"], block_rows)
+        return cls(np.load(path, mmap_mode="r"), block_rows=block_rows)
+
+    @property
+    def storage(self):
+        return "int8" if self.scale is not None else self.codes.dtype.name
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self):
+        extra = 0 if self.scale is None else self.scale.nbytes + self.offset.nbytes
+        return self.codes.nbytes + extra
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        """Dequantized float32 rows for an integer, slice or array of row numbers."""
+        block = np.asarray(self.codes[index], dtype=np.float32)
+        if self.scale is not None:
+            block *= self.scale
+            block += self.offset
+        return block
+
+    @property
+    def norms(self):
+        """L2 norm of every dequantized row, computed once block by block."""
+        if self._norms is None:
+            norms = np.empty(len(self), dtype=np.float32)
+            for start, stop in _blocks(len(self), self.block_rows):
+                norms[start:stop] = np.linalg.norm(self[start:stop], axis=1)
+            self._norms = norms
+        return self._norms
+
+    def cosine(self, query, rows=None):
+        """
+        Cosine similarity of a query with every stored row, or with `rows` only.
+
+        Args:
+            query (numpy.ndarray): Query vector of shape [dim] or [1, dim].
+            rows (numpy.ndarray, optional): Row numbers to score. Defaults to all rows.
+
+        Returns:
+            numpy.ndarray: float32 similarities, one per scored row.
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        weights, bias = query, 0.0
+        if self.scale is not None:
+            weights, bias = query * self.scale, float(self.offset @ query)
+
+        num_rows = len(self) if rows is None else len(rows)
+        scores = np.empty(num_rows, dtype=np.float32)
+        for start, stop in _blocks(num_rows, self.block_rows):
+            index = slice(start, stop) if rows is None else np.sort(rows[start:stop])
+            block_scores = np.asarray(self.codes[index], dtype=np.float32) @ weights + bias
+            if rows is None:
+                scores[start:stop] = block_scores
+            else:
+                scores[start:stop] = block_scores[np.argsort(np.argsort(rows[start:stop]))]
+
+        norms = self.norms if rows is None else self.norms[rows]
+        return scores / np.where(norms == 0, 1, norms)
+
+
+def load_embeddings(path, block_rows=DEFAULT_BLOCK_ROWS):
+    """Open an embeddings file written by the pipeline or by `write_quantized`."""
+    return QuantizedEmbeddings.load(path, block_rows)
+
+
+def quantize(embeddings, storage, block_rows=DEFAULT_BLOCK_ROWS):
+    """
+    Convert a float embedding matrix to the given storage dtype, block by block.
+
+    Args:
+        embeddings (numpy.ndarray): Matrix of shape [rows, dim]; may be a memory map.
+        storage (str): "float32", "float16" or "int8".
+        block_rows (int): Rows converted at a time.
+
+    Returns:
+        QuantizedEmbeddings: The quantized matrix, held in memory.
+    """
+    if storage not in STORAGE_DTYPES:
+        raise ValueError(f"Unknown embedding storage {storage!r}, expected one of {STORAGE_DTYPES}")
+    rows, dim = embeddings.shape
+    if storage != "int8":
+        codes = np.empty((rows, dim), dtype=storage)
+        for start, stop in _blocks(rows, block_rows):
+            codes[start:stop] = embeddings[start:stop]
+        return QuantizedEmbeddings(codes, block_rows=block_rows)
+
+    # First pass: value range of every dimension
+    low = np.full(dim, np.inf, dtype=np.float32)
+    high = np.full(dim, -np.inf, dtype=np.float32)
+    for start, stop in _blocks(rows, block_rows):
+        block = np.asarray(embeddings[start:stop], dtype=np.float32)
+        low = np.minimum(low, block.min(axis=0))
+        high = np.maximum(high, block.max(axis=0))
+    if rows == 0:
+        low, high = np.zeros(dim, dtype=np.float32), np.zeros(dim, dtype=np.float32)
+    scale = (high - low) / INT8_LEVELS
+    scale[scale == 0] = 1.0
+
+    # Second pass: round every value to the nearest step of its dimension
+    codes = np.empty((rows, dim), dtype=np.uint8)
+    for start, stop in _blocks(rows, block_rows):
+        block = (np.asarray(embeddings[start:stop], dtype=np.float32) - low) / scale
+        codes[start:stop] = np.clip(np.rint(block), 0, INT8_LEVELS)
+    return QuantizedEmbeddings(codes, scale, low, block_rows)
+
+
+def write_quantized(embeddings, path, storage, block_rows=DEFAULT_BLOCK_ROWS):
+    """
+    Quantize embeddings and save them to `path`, replacing it only once the write has finished.
+
+    Args:
+        embeddings (numpy.ndarray): float32 matrix of shape [rows, dim]; may be a memory map.
+        path (str): Destination, normally `quantized_path(embeddings_file, storage)`.
+        storage (str): "float16" or "int8".
+        block_rows (int): Rows converted at a time.
+
+    Returns:
+        QuantizedEmbeddings: The quantized matrix.
+    """
+    quantized = quantize(embeddings, storage, block_rows)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        if quantized.scale is not None:
+            np.savez(f, codes=quantized.codes, scale=quantized.scale, offset=quantized.offset)
+        else:
+            np.save(f, quantized.codes)
+    os.replace(tmp_path, path)
+    print(f"Saved {storage} embeddings to {path} ({quantized.nbytes / 2**20:.1f} MB)")
+    return quantized
+
+
+def _top_k(scores, k):
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def recall_at_k(reference, candidate, k=10, num_queries=1000, seed=0):
+    """
+    Measure how well search over quantized embeddings reproduces float32 results.
+
+    A sample of stored rows, taken in float32, is used as queries. Each query is scored
+    against all other rows once with the float32 matrix and once with the quantized one.
+
+    Args:
+        reference (QuantizedEmbeddings): float32 embeddings.
+        candidate (QuantizedEmbeddings): The same embeddings in another storage dtype.
+        k (int): Neighbours per query.
+        num_queries (int): Rows used as queries.
+        seed (int): Seed for choosing the query rows.
+
+    Returns:
+        dict: recall@k against the float32 neighbours, the share of queries with the same
+        top-1, and the mean search time per query with the candidate in milliseconds.
+    """
+    k = min(k, len(reference) - 1)
+    queries = np.random.default_rng(seed).choice(len(reference), min(num_queries, len(reference)), replace=False)
+    overlap, same_top1, seconds = [], 0, 0.0
+    for row in queries:
+        query = reference[int(row)]
+        expected_scores = reference.cosine(query)
+        expected_scores[row] = -np.inf
+        expected = _top_k(expected_scores, k)
+
+        start = time.perf_counter()
+        scores = candidate.cosine(query)
+        scores[row] = -np.inf
+        found = _top_k(scores, k)
+        seconds += time.perf_counter() - start
+
+        overlap.append(len(np.intersect1d(expected, found)))
+        same_top1 += int(expected[0] == found[0])
+    return {
+        f"recall@{k}": float(np.mean(overlap) / k),
+        "top1_agreement": same_top1 / len(queries),
+        "ms_per_query": 1000 * seconds / len(queries),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare float16 and int8 embedding storage against float32")
+    parser.add_argument("--embeddings", default="data/tech_embeddings.npy")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    reference = load_embeddings(args.embeddings)
+    print(f"Loaded {reference.shape[0]} x {reference.shape[1]} embeddings from {args.embeddings}")
+    for storage in STORAGE_DTYPES:
+        candidate = reference if storage == "float32" else quantize(reference.codes, storage)
+        results = recall_at_k(reference, candidate, args.k, args.queries)
+        print(f"{storage:>8}: {candidate.nbytes / 2**20:8.1f} MB, "
+              + ", ".join(f"{name} {value:.4f}" for name, value in results.items()))
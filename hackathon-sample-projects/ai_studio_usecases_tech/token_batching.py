@@ -0,0 +1,177 @@
+"""
+Token-count-aware batching for sentence-transformer encoding.
+
+A fixed `batch_size` ignores text length: a batch of long descriptions is padded to
+the longest one and may not fit the caches, while a batch of short titles leaves the
+hardware idle. Here texts are tokenized once, sorted by length and packed into batches
+whose padded size (texts x longest text) stays under a token budget, so every batch
+does about the same amount of work.
+
+The budget that runs fastest depends on the machine, so `TokenBatchEncoder` can pick
+it by timing a sample of the texts with a few candidate budgets before the first large
+encode. Throughput is reported in real (unpadded) tokens per second.
+"""
+import time
+
+import numpy as np
+from tqdm import tqdm
+
+# Budget used when tuning is off or the input is too small to be worth tuning
+DEFAULT_MAX_TOKENS = 8192
+MAX_BATCH_SIZE = 512
+
+# Candidate budgets, smallest first, and the tokens timed for each of them
+TUNING_BUDGETS = (2048, 4096, 8192, 16384, 32768)
+TUNING_SAMPLE_TOKENS = 32768
+
+# Inputs with fewer tokens than this use DEFAULT_MAX_TOKENS instead of tuning
+MIN_TUNING_TOKENS = 20 * TUNING_SAMPLE_TOKENS
+
+
+def token_lengths(model, texts):
+    """Number of tokens the model sees for each text, after truncation."""
+    encoded = model.tokenizer(list(texts), truncation=True, max_length=model.max_seq_length)
+    return np.fromiter((len(ids) for ids in encoded["input_ids"]), dtype=np.int64, count=len(texts))
+
+
+def make_batches(lengths, max_tokens, max_batch_size=MAX_BATCH_SIZE):
+    """
+    Group text indices into length-sorted batches under a padded-token budget.
+
+    Args:
+        lengths (numpy.ndarray): Token count of every text.
+        max_tokens (int): Upper bound on texts x longest text per batch.
+        max_batch_size (int): Upper bound on texts per batch.
+
+    Returns:
+        list[numpy.ndarray]: Text indices of each batch, shortest texts first.
+    """
+    order = np.argsort(lengths, kind="stable")
+    batches = []
+    start = 0
+    while start < len(order):
+        # Lengths are ascending, so the last text of a batch sets its padded width
+        stop = start + 1
+        while (
+            stop < len(order)
+            and stop - start < max_batch_size
+            and (stop - start + 1) * lengths[order[stop]] <= max_tokens
+        ):
+            stop += 1
+        batches.append(order[start:stop])
+        start = stop
+    return batches
+
+
+class TokenBatchEncoder:
+    """Encode texts with a SentenceTransformer in batches sized by token count."""
+
+    def __init__(self, model, max_tokens=None, max_batch_size=MAX_BATCH_SIZE):
+        """
+        Args:
+            model (SentenceTransformer): The loaded model.
+            max_tokens (int, optional): Padded-token budget per batch. None tunes it on the
+                first input of at least MIN_TUNING_TOKENS tokens.
+            max_batch_size (int): Upper bound on texts per batch.
+        """
+        self.model = model
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.last_stats = None
+
+    def _encode_batches(self, texts, batches, output, show_progress_bar=False):
+        for batch in tqdm(batches, desc="Encoding", disable=not show_progress_bar):
+            output[batch] = self.model.encode(
+                [texts[i] for i in batch],
+                batch_size=len(batch),
+                show_progress_bar=False,
+                convert_to_numpy=True
+            )
+
+    def tune(self, texts, lengths=None, budgets=TUNING_BUDGETS, seed=0):
+        """
+        Pick the fastest token budget for this machine by timing a sample of `texts`.
+
+        Candidates are tried from smallest to largest, and tuning stops once a larger
+        budget is more than 10% slower than the best one so far.
+
+        Returns:
+            int: The chosen budget, also stored in `max_tokens`.
+        """
+        texts = list(texts)
+        lengths = token_lengths(self.model, texts) if lengths is None else lengths
+
+        # A random sample keeps the mix of short and long texts of the full input
+        order = np.random.default_rng(seed).permutation(len(texts))
+        sample = order[:np.searchsorted(np.cumsum(lengths[order]), TUNING_SAMPLE_TOKENS) + 1]
+        sample_texts = [texts[i] for i in sample]
+        sample_lengths = lengths[sample]
+        output = np.empty((len(sample), self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        # Warm up once so the first candidate does not pay for lazy initialization
+        self._encode_batches(sample_texts, make_batches(sample_lengths, budgets[0], self.max_batch_size)[:1], output)
+
+        best_budget, best_rate = budgets[0], 0.0
+        for budget in budgets:
+            start = time.perf_counter()
+            self._encode_batches(sample_texts, make_batches(sample_lengths, budget, self.max_batch_size), output)
+            rate = sample_lengths.sum() / max(time.perf_counter() - start, 1e-9)
+            print(f"Token budget {budget}: {rate:.0f} tokens/sec")
+            if rate > best_rate:
+                best_budget, best_rate = budget, rate
+            elif rate < 0.9 * best_rate:
+                break
+
+        print(f"Using a token budget of {best_budget} per batch")
+        self.max_tokens = best_budget
+        return best_budget
+
+    def budget_for(self, texts, lengths=None):
+        """
+        Token budget to encode `texts` with, tuning it first if it is not set yet and
+        the input has at least MIN_TUNING_TOKENS tokens.
+
+        Returns:
+            int: `max_tokens`, or DEFAULT_MAX_TOKENS while it is still unset.
+        """
+        if self.max_tokens is None:
+            lengths = token_lengths(self.model, texts) if lengths is None else lengths
+            if lengths.sum() >= MIN_TUNING_TOKENS:
+                self.tune(texts, lengths)
+        return self.max_tokens or DEFAULT_MAX_TOKENS
+
+    def encode(self, texts, show_progress_bar=True, verbose=True):
+        """
+        Encode texts, tuning the token budget first if it is not set yet.
+
+        Throughput of the call is kept in `last_stats` and printed if `verbose`.
+
+        Returns:
+            numpy.ndarray: float32 embeddings of shape [len(texts), dim], in input order.
+        """
+        texts = list(texts)
+        output = np.empty((len(texts), self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        if not texts:
+            return output
+
+        lengths = token_lengths(self.model, texts)
+        batches = make_batches(lengths, self.budget_for(texts, lengths), self.max_batch_size)
+
+        start = time.perf_counter()
+        self._encode_batches(texts, batches, output, show_progress_bar)
+        seconds = time.perf_counter() - start
+
+        padded = sum(len(batch) * lengths[batch[-1]] for batch in batches)
+        self.last_stats = {
+            "texts": len(texts),
+            "batches": len(batches),
+            "tokens": int(lengths.sum()),
+            "padded_tokens": int(padded),
+            "seconds": seconds,
+            "tokens_per_sec": float(lengths.sum() / max(seconds, 1e-9)),
+        }
+        if verbose:
+            print(f"Encoded {len(texts)} texts in {len(batches)} batches: "
+                  f"{self.last_stats['tokens_per_sec']:.0f} tokens/sec, "
+                  f"{1 - self.last_stats['tokens'] / max(1, padded):.1%} padding")
+        return output
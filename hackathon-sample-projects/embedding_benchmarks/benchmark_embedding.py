@@ -0,0 +1,483 @@
+"""
+Benchmark the embedding pipelines of the hackathon projects.
+
+For every project, corpus size and embedding strategy, the project's `00_generate_*`
+script writes a synthetic corpus (cached in the work directory between runs), then the
+project's `01_embed_*` script embeds it in a fresh subprocess, in a scratch copy of the
+project with its constants set for the strategy. Each case reports:
+
+- texts/sec and tokens/sec (real, unpadded tokens) over the embedding call;
+- peak RSS of the embedding process and of its largest child process (e.g. a pool worker);
+- model load time, embedding time and end-to-end wall time of the subprocess.
+
+Results are written as JSON. When a baseline file exists, every case is compared with
+the same case in it, regressions beyond the tolerances are listed and the exit status
+is 1, so the script can gate a CI job:
+
+    python benchmark_embedding.py --sizes 1000 10000 --save-baseline   # once, on the CI machine
+    python benchmark_embedding.py --sizes 1000 10000                   # on every change
+"""
+import argparse
+import importlib.util
+import json
+import math
+import os
+import platform
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+PROJECTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_WORK_DIR = os.path.join(tempfile.gettempdir(), "embedding_benchmarks")
+DEFAULT_OUTPUT = "results.json"
+DEFAULT_BASELINE = "baseline.json"
+
+# Allowed slowdown of throughput and wall time, and growth of peak RSS, against the baseline
+DEFAULT_TOLERANCE = 0.10
+DEFAULT_RSS_TOLERANCE = 0.20
+
+# The per-row Netflix baseline is skipped above this many texts
+MAX_PER_ROW_TEXTS = 10_000
+
+NETFLIX_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Marks the line a case subprocess reports its measurements on
+RESULT_PREFIX = "BENCHMARK_RESULT "
+
+# Constants set in the copied 01_embed_* script of the banking and tech projects
+SENTENCE_TRANSFORMER_STRATEGIES = {
+    "fixed-budget": {"EMBEDDING_WORKERS": "1", "EMBEDDING_MAX_TOKENS": "DEFAULT_MAX_TOKENS"},
+    "tuned-budget": {"EMBEDDING_WORKERS": "1", "EMBEDDING_MAX_TOKENS": "None"},
+    "process-pool": {"EMBEDDING_WORKERS": "None", "EMBEDDING_MAX_TOKENS": "DEFAULT_MAX_TOKENS"},
+    "int8": {"EMBEDDING_WORKERS": "1", "EMBEDDING_MAX_TOKENS": "DEFAULT_MAX_TOKENS", "EMBEDDING_QUANTIZE": "True"},
+}
+
+# Arguments of generate_netflix_embeddings; "per-row" embeds one text per forward pass
+NETFLIX_STRATEGIES = {
+    "per-row": None,
+    "bucketed": {"max_tokens": 16384},
+    "tuned-budget": {"max_tokens": None},
+    "int8": {"max_tokens": 16384, "quantize": True},
+}
+
+PROJECTS = {
+    "banking": {
+        "dir": "ai_studio_usecases_banking",
+        "generator": "00_generate_data.py",
+        "generator_args": ["--num-customers", "{size}", "--output", "{output}"],
+        "script": "01_embed_data.py",
+        "dataset": "banking_dataset.csv",
+        "strategies": SENTENCE_TRANSFORMER_STRATEGIES,
+    },
+    "tech": {
+        "dir": "ai_studio_usecases_tech",
+        "generator": "00_generate_tech_adoption_data.py",
+        "generator_args": ["--num-users", "{size}", "--output", "{output}"],
+        "script": "01_embed_tech_data.py",
+        "dataset": "tech_adoption_dataset.csv",
+        "strategies": SENTENCE_TRANSFORMER_STRATEGIES,
+    },
+    "netflix": {
+        "dir": "ui_example",
+        "generator": "00_generate_netflix_data.py",
+        "generator_args": [],
+        "script": "01_embed_data.py",
+        "dataset": "netflix_reviews.csv",
+        "strategies": NETFLIX_STRATEGIES,
+    },
+}
+
+
+def _link_or_copy(source, destination):
+    try:
+        os.symlink(os.path.abspath(source), destination)
+    except OSError:
+        if os.path.isdir(source):
+            shutil.copytree(source, destination)
+        else:
+            shutil.copy2(source, destination)
+
+
+def generate_corpus(project_name, size, work_dir):
+    """
+    Write a synthetic corpus of `size` rows with the project's generator script.
+
+    Corpora are cached under `work_dir` and reused by later runs. The Netflix generator
+    writes a fixed catalog, which is repeated up to `size` rows.
+
+    Returns:
+        str: Path of the dataset CSV.
+    """
+    project = PROJECTS[project_name]
+    corpus_dir = os.path.join(work_dir, project_name, str(size))
+    path = os.path.join(corpus_dir, project["dataset"])
+    if os.path.exists(path):
+        return path
+    os.makedirs(corpus_dir, exist_ok=True)
+
+    print(f"Generating {size} rows for {project_name} in {corpus_dir}")
+    generator = os.path.join(PROJECTS_DIR, project["dir"], project["generator"])
+    args = [arg.format(size=size, output=path) for arg in project["generator_args"]]
+    subprocess.run([sys.executable, generator, *args], cwd=corpus_dir, check=True, stdout=subprocess.DEVNULL)
+
+    if project_name == "netflix":
+        import pandas as pd
+
+        catalog = pd.read_csv(os.path.join(corpus_dir, "data", project["dataset"]))
+        corpus = pd.concat([catalog] * math.ceil(size / len(catalog)), ignore_index=True).head(size)
+        corpus.to_csv(f"{path}.tmp", index=False)
+        os.replace(f"{path}.tmp", path)
+    return path
+
+
+def _set_constants(script_path, constants):
+    """Rewrite `NAME = value` lines of a copied script."""
+    with open(script_path) as f:
+        source = f.read()
+    for name, value in constants.items():
+        source, count = re.subn(rf"^{name} = .*$", f"{name} = {value}", source, flags=re.MULTILINE)
+        if count != 1:
+            raise ValueError(f"Expected one {name} constant in {script_path}, found {count}")
+    with open(script_path, "w") as f:
+        f.write(source)
+
+
+def prepare_case(project_name, strategy, corpus_path, case_dir, model_dir=None):
+    """
+    Create a scratch copy of the project with the corpus and the strategy's settings.
+
+    `model_dir` replaces the project's model/sentence-transformer directory, for the
+    projects that load their model from there.
+    """
+    project = PROJECTS[project_name]
+    project_dir = os.path.join(PROJECTS_DIR, project["dir"])
+    shutil.rmtree(case_dir, ignore_errors=True)
+    os.makedirs(os.path.join(case_dir, "data"))
+
+    for name in os.listdir(project_dir):
+        if name.endswith(".py"):
+            shutil.copy2(os.path.join(project_dir, name), case_dir)
+    _link_or_copy(corpus_path, os.path.join(case_dir, "data", project["dataset"]))
+
+    # Only the corpus and the model are shared; embeddings, manifests and checkpoints start empty in every case
+    model_dir = model_dir or os.path.join(project_dir, "model", "sentence-transformer")
+    if os.path.isdir(model_dir):
+        os.makedirs(os.path.join(case_dir, "model"))
+        _link_or_copy(model_dir, os.path.join(case_dir, "model", "sentence-transformer"))
+
+    if project["strategies"] is SENTENCE_TRANSFORMER_STRATEGIES:
+        _set_constants(os.path.join(case_dir, project["script"]), SENTENCE_TRANSFORMER_STRATEGIES[strategy])
+
+
+def _load_script(path):
+    spec = importlib.util.spec_from_file_location("embed_script", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _count_tokens(tokenizer, texts, max_length, batch_size=4096):
+    """Real (unpadded) tokens the model sees for `texts`, after truncation."""
+    total = 0
+    for start in range(0, len(texts), batch_size):
+        encoded = tokenizer(texts[start:start + batch_size], truncation=True, max_length=max_length)
+        total += sum(len(ids) for ids in encoded["input_ids"])
+    return total
+
+
+def _peak_rss_mb():
+    """Peak RSS of this process and of its largest finished child, in MB."""
+    unit = 1 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit
+    return own / 2**20, children / 2**20
+
+
+def _run_banking(module, strategy):
+    import pandas as pd
+
+    start = time.perf_counter()
+    model = module.load_model()
+    load_seconds = time.perf_counter() - start
+
+    # Time the embedding only: no all-pairs neighbours table and no demo search
+    module.find_similar_customers = lambda *args, **kwargs: None
+    start = time.perf_counter()
+    module.embed_banking_data(model, incremental=False, write_neighbors=False)
+    embed_seconds = time.perf_counter() - start
+    peak_rss = _peak_rss_mb()
+
+    texts = module.build_descriptions(pd.read_csv("data/banking_dataset.csv", usecols=module.DESCRIPTION_COLUMNS))
+    tokens = _count_tokens(model.tokenizer, texts, model.max_seq_length)
+    return len(texts), tokens, load_seconds, embed_seconds, peak_rss
+
+
+def _run_tech(module, strategy):
+    import pandas as pd
+
+    start = time.perf_counter()
+    model = module.load_or_download_model()
+    load_seconds = time.perf_counter() - start
+
+    # main() loads the model itself; hand it the one loaded above
+    module.load_or_download_model = lambda: model
+    start = time.perf_counter()
+    module.main(incremental=False)
+    embed_seconds = time.perf_counter() - start
+    peak_rss = _peak_rss_mb()
+
+    texts = pd.read_csv(module.DATA_FILE, usecols=["user_description"])["user_description"].tolist()
+    tokens = _count_tokens(model.tokenizer, texts, model.max_seq_length)
+    return len(texts), tokens, load_seconds, embed_seconds, peak_rss
+
+
+def _run_netflix(module, strategy):
+    import pandas as pd
+    from transformers import AutoTokenizer
+
+    settings = NETFLIX_STRATEGIES[strategy]
+    start = time.perf_counter()
+    tokenizer = AutoTokenizer.from_pretrained(NETFLIX_MODEL_NAME)
+    model = module.load_model(NETFLIX_MODEL_NAME, quantize=bool(settings and settings.get("quantize")))
+    load_seconds = time.perf_counter() - start
+
+    texts = pd.read_csv("data/netflix_reviews.csv")["description"].tolist()
+    start = time.perf_counter()
+    if settings is None:
+        for text in texts:
+            module.get_embedding(text, tokenizer, model)
+    else:
+        # generate_netflix_embeddings loads the model itself; hand it the one loaded above
+        module.load_model = lambda *args, **kwargs: model
+        module.generate_netflix_embeddings(
+            "data/netflix_reviews.csv", "data/embeddings.bin", incremental=False, **settings
+        )
+    embed_seconds = time.perf_counter() - start
+    peak_rss = _peak_rss_mb()
+
+    tokens = _count_tokens(tokenizer, [str(text) for text in texts], 512)
+    return len(texts), tokens, load_seconds, embed_seconds, peak_rss
+
+
+CASE_RUNNERS = {"banking": _run_banking, "tech": _run_tech, "netflix": _run_netflix}
+
+
+def run_case(project_name, strategy, case_dir):
+    """Embed one case in this process and print its measurements on a RESULT_PREFIX line."""
+    os.chdir(case_dir)
+    sys.path.insert(0, case_dir)
+    module = _load_script(os.path.join(case_dir, PROJECTS[project_name]["script"]))
+    rows, tokens, load_seconds, embed_seconds, (peak_rss, children_peak_rss) = (
+        CASE_RUNNERS[project_name](module, strategy)
+    )
+
+    import torch
+
+    result = {
+        "rows": rows,
+        "tokens": tokens,
+        "load_seconds": load_seconds,
+        "embed_seconds": embed_seconds,
+        "texts_per_sec": rows / max(embed_seconds, 1e-9),
+        "tokens_per_sec": tokens / max(embed_seconds, 1e-9),
+        "peak_rss_mb": peak_rss,
+        "children_peak_rss_mb": children_peak_rss,
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+    }
+    print(RESULT_PREFIX + json.dumps(result), flush=True)
+
+
+def benchmark_case(project_name, size, strategy, corpus_path, work_dir, model_dir=None, keep_outputs=False):
+    """Run one case in a subprocess and return its result record."""
+    case_dir = os.path.join(work_dir, project_name, str(size), strategy)
+    prepare_case(project_name, strategy, corpus_path, case_dir, model_dir)
+    record = {"project": project_name, "size": size, "strategy": strategy}
+
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--run-case", project_name, strategy, case_dir],
+        capture_output=True, text=True
+    )
+    record["wall_seconds"] = time.perf_counter() - start
+
+    lines = [line for line in process.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+    if process.returncode != 0 or not lines:
+        record["error"] = "\n".join((process.stderr or process.stdout).strip().splitlines()[-20:])
+    else:
+        record.update(json.loads(lines[-1][len(RESULT_PREFIX):]))
+
+    if not keep_outputs:
+        shutil.rmtree(case_dir, ignore_errors=True)
+    return record
+
+
+def environment():
+    """Machine and code version the results were measured on."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=PROJECTS_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def find_regressions(results, baseline, tolerance=DEFAULT_TOLERANCE, rss_tolerance=DEFAULT_RSS_TOLERANCE):
+    """
+    Compare results with a baseline run, case by case.
+
+    Args:
+        results (list[dict]): Records of the current run.
+        baseline (dict): A previous output of this script.
+        tolerance (float): Allowed relative drop of texts/sec and rise of wall time.
+        rss_tolerance (float): Allowed relative rise of peak RSS.
+
+    Returns:
+        list[dict]: One entry per regressed metric, with its baseline and current values.
+    """
+    previous = {
+        (record["project"], record["size"], record["strategy"]): record
+        for record in baseline.get("results", []) if "error" not in record
+    }
+    checks = [
+        ("texts_per_sec", lambda old, new: new < old * (1 - tolerance)),
+        ("wall_seconds", lambda old, new: new > old * (1 + tolerance)),
+        ("peak_rss_mb", lambda old, new: new > old * (1 + rss_tolerance)),
+    ]
+    regressions = []
+    for record in results:
+        old = previous.get((record["project"], record["size"], record["strategy"]))
+        if old is None:
+            continue
+        if "error" in record:
+            regressions.append({**_case(record), "metric": "error", "baseline": None, "current": record["error"]})
+            continue
+        for metric, regressed in checks:
+            if regressed(old[metric], record[metric]):
+                regressions.append({
+                    **_case(record),
+                    "metric": metric,
+                    "baseline": old[metric],
+                    "current": record[metric],
+                    "change": record[metric] / old[metric] - 1,
+                })
+    return regressions
+
+
+def _case(record):
+    return {"project": record["project"], "size": record["size"], "strategy": record["strategy"]}
+
+
+def print_summary(results):
+    """Print one line per case and the fastest strategy for each project and size."""
+    print(f"\n{'project':<8} {'size':>8} {'strategy':<14} {'texts/s':>9} {'tokens/s':>10} "
+          f"{'RSS MB':>8} {'children MB':>11} {'wall s':>8}")
+    for record in results:
+        if "error" in record:
+            print(f"{record['project']:<8} {record['size']:>8} {record['strategy']:<14} failed")
+            continue
+        print(f"{record['project']:<8} {record['size']:>8} {record['strategy']:<14} "
+              f"{record['texts_per_sec']:>9.1f} {record['tokens_per_sec']:>10.0f} {record['peak_rss_mb']:>8.0f} "
+              f"{record['children_peak_rss_mb']:>11.0f} {record['wall_seconds']:>8.1f}")
+
+    best = {}
+    for record in results:
+        key = (record["project"], record["size"])
+        if "error" not in record and (key not in best or record["texts_per_sec"] > best[key]["texts_per_sec"]):
+            best[key] = record
+    print()
+    for (project_name, size), record in best.items():
+        print(f"Fastest for {project_name} at {size} rows: {record['strategy']} ({record['texts_per_sec']:.1f} texts/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the embedding pipelines of the hackathon projects")
+    parser.add_argument("--projects", nargs="+", choices=list(PROJECTS), default=list(PROJECTS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(DEFAULT_SIZES))
+    parser.add_argument("--strategies", nargs="+", default=None,
+                        help="Strategies to run (default: all strategies of each project)")
+    parser.add_argument("--work-dir", default=DEFAULT_WORK_DIR, help="Generated corpora and scratch projects")
+    parser.add_argument("--model-dir", default=None,
+                        help="Sentence-transformer directory for banking and tech (default: the project's own)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Also write the results to --baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--rss-tolerance", type=float, default=DEFAULT_RSS_TOLERANCE)
+    parser.add_argument("--keep-outputs", action="store_true", help="Keep each case's scratch project")
+    parser.add_argument("--run-case", nargs=3, metavar=("PROJECT", "STRATEGY", "CASE_DIR"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        run_case(*args.run_case)
+        return
+
+    results = []
+    for project_name in args.projects:
+        strategies = PROJECTS[project_name]["strategies"]
+        names = [name for name in (args.strategies or strategies) if name in strategies]
+        for size in args.sizes:
+            corpus_path = generate_corpus(project_name, size, args.work_dir)
+            for strategy in names:
+                if strategy == "per-row" and size > MAX_PER_ROW_TEXTS:
+                    print(f"Skipping {project_name}/{strategy} at {size} rows (over {MAX_PER_ROW_TEXTS})")
+                    continue
+                print(f"Running {project_name}/{strategy} on {size} rows...")
+                record = benchmark_case(
+                    project_name, size, strategy, corpus_path, args.work_dir, args.model_dir, args.keep_outputs
+                )
+                if "error" in record:
+                    print(f"  failed:\n{record['error']}")
+                else:
+                    print(f"  {record['texts_per_sec']:.1f} texts/s, {record['tokens_per_sec']:.0f} tokens/s, "
+                          f"peak RSS {record['peak_rss_mb']:.0f} MB, wall {record['wall_seconds']:.1f}s")
+                results.append(record)
+
+    output = {"environment": environment(), "results": results}
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"Results saved to {args.output}")
+    print_summary(results)
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for key in ("cpu_count", "machine", "python"):
+            if baseline["environment"].get(key) != output["environment"][key]:
+                print(f"Warning: baseline was measured with {key}={baseline['environment'].get(key)}, "
+                      f"this run has {output['environment'][key]}")
+        regressions = find_regressions(results, baseline, args.tolerance, args.rss_tolerance)
+        print(f"\nCompared with {args.baseline}: {len(regressions)} regression(s)")
+        for regression in regressions:
+            if regression["metric"] == "error":
+                print(f"  {regression['project']}/{regression['strategy']} at {regression['size']} rows now fails")
+            else:
+                print(f"  {regression['project']}/{regression['strategy']} at {regression['size']} rows: "
+                      f"{regression['metric']} {regression['baseline']:.1f} -> {regression['current']:.1f} "
+                      f"({regression['change']:+.1%})")
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,12 @@ import os
 import torch
 import pandas as pd
 import numpy as np
-from transformers import AutoTokenizer, AutoModel
-from tqdm import tqdm
+from transformers import AutoTokenizer
+
+from embedding_engine import BatchedEmbeddingEngine
+from embedding_store import open_embedding_store, write_embedding_store
+from incremental_embedding import incremental_embed, load_manifest, write_outputs
+from quantization import SALT_SUFFIX, load_model
 
 def get_embedding(text, tokenizer, model):
     """
@@ -40,16 +44,28 @@ def get_embedding(text, tokenizer, model):
     # Convert to numpy array
     return embedding[0].cpu().numpy()
 
-def generate_netflix_embeddings(input_csv, output_csv):
+def manifest_path_for(output_path):
+    """Return the path of the content-hash manifest kept next to an embedding store."""
+    return os.path.splitext(output_path)[0] + "_hashes.npy"
+
+def generate_netflix_embeddings(input_csv, output_path, max_tokens=None, dtype=np.float32, incremental=True,
+                                quantize=False):
     """
-    Generate embeddings for Netflix reviews and save to CSV.
+    Generate embeddings for Netflix reviews and save them to a binary embedding store.
     
     Args:
         input_csv (str): Path to the Netflix reviews CSV.
-        output_csv (str): Path to save the embeddings.
+        output_path (str): Path to save the embedding store.
+        max_tokens (int, optional): Padded token budget for each length bucket. None tunes
+            it on this machine when there are enough texts.
+        dtype: Storage dtype for the embedding matrix, float32 or float16.
+        incremental (bool): Reuse vectors from the previous run for texts whose content
+            hash is unchanged, and only embed new or changed records.
+        quantize (bool): Run the model with int8 linear layers on CPU. Vectors differ
+            slightly from fp32 ones, so they are not reused across the two modes.
     """
     # Make sure the data directory exists
-    os.makedirs(os.path.dirname(output_csv), exist_ok=True)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
     
     # Load the Netflix reviews dataset
     print(f"Loading data from {input_csv}")
@@ -63,7 +79,8 @@ def generate_netflix_embeddings(input_csv, output_csv):
     print("Loading Hugging Face model...")
     model_name = 'sentence-transformers/all-MiniLM-L6-v2'
     tokenizer = AutoTokenizer.from_pretrained(model_name)
-    model = AutoModel.from_pretrained(model_name)
+    model = load_model(model_name, quantize=quantize)
+    salt = model_name + SALT_SUFFIX if quantize else model_name
     
     # Determine what text to embed - look for description column or concatenate relevant fields
     if 'description' in df.columns:
@@ -85,35 +102,39 @@ def generate_netflix_embeddings(input_csv, output_csv):
         )
         text_column = 'combined_text'
     
-    # Sample record for dimension testing
-    sample_text = df[text_column].iloc[0]
-    sample_embedding = get_embedding(sample_text, tokenizer, model)
-    embedding_dim = len(sample_embedding)
-    print(f"Embedding dimension: {embedding_dim}")
-    
-    # Initialize an empty array to store all embeddings
-    all_embeddings = np.zeros((len(df), embedding_dim), dtype=np.float32)
+    # Embed records in length-sorted buckets instead of one forward pass per row
+    engine = BatchedEmbeddingEngine(tokenizer, model, max_tokens=max_tokens)
+    texts = engine.clean_texts(df[text_column].tolist())
     
-    # Process each record to create embeddings
-    print("Generating embeddings for all records...")
-    for i, text in enumerate(tqdm(df[text_column])):
-        embedding = get_embedding(text, tokenizer, model)
-        all_embeddings[i] = embedding
+    # Load the previous run so unchanged records can keep their vectors
+    manifest_path = manifest_path_for(output_path)
+    previous_embeddings, previous_hashes = None, None
+    if incremental and os.path.exists(output_path):
+        previous_embeddings = open_embedding_store(output_path).embeddings
+        previous_hashes = load_manifest(manifest_path)
     
-    # Create a DataFrame with just the embeddings
-    embeddings_df = pd.DataFrame(all_embeddings)
-    
-    # Save the embeddings to CSV
-    print(f"Saving embeddings to {output_csv}")
-    embeddings_df.to_csv(output_csv, index=False)
+    print("Generating embeddings for new or changed records...")
+    all_embeddings, hashes, stats = incremental_embed(
+        texts, engine.embed, previous_embeddings, previous_hashes, salt=salt
+    )
+    print(f"Embedded {stats['embedded']} records, reused {stats['reused']}, removed {stats['removed']}")
+    print(f"Embedding dimension: {all_embeddings.shape[1]}")
+    
+    # Save the embeddings as a memory-mappable store with one id per row, then the manifest
+    print(f"Saving embeddings to {output_path}")
+    write_outputs(
+        manifest_path,
+        hashes,
+        lambda: write_embedding_store(output_path, all_embeddings, ids=np.arange(len(df)), dtype=dtype)
+    )
     
     print(f"Successfully saved embeddings for {len(df)} Netflix records")
-    print(f"Embedding shape: {embeddings_df.shape}")
+    print(f"Embedding shape: {all_embeddings.shape}")
 
 if __name__ == "__main__":
     # File paths
     input_csv = "data/netflix_reviews.csv"
-    output_csv = "data/embedded.csv"
+    output_path = "data/embeddings.bin"
     
     # Generate and save embeddings
-    generate_netflix_embeddings(input_csv, output_csv)
+    generate_netflix_embeddings(input_csv, output_path)
@@ -1,6 +1,7 @@
 # 03_deployment.py
 import os
 import json
+import tempfile
 import torch
 import numpy as np
 import pandas as pd
@@ -9,15 +10,30 @@ import mlflow
 import mlflow.pyfunc
 
 from mlflow import MlflowClient
+from mlflow.exceptions import MlflowException
+from mlflow.protos.databricks_pb2 import INVALID_PARAMETER_VALUE
 from mlflow.models.signature import ModelSignature
 from mlflow.types.schema import Schema, ColSpec, TensorSpec, ParamSchema, ParamSpec
-from sklearn.metrics.pairwise import cosine_similarity
 
 from transformers import AutoTokenizer, AutoModel
 
+from ann_index import ExactIndex, build_index, load_index, read_index_kind
+from embedding_engine import mean_pooling
+from embedding_store import open_embedding_store
+from query_cache import QueryCache
+from similarity import l2_normalize
+
 # Model settings
 MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
 
+# Maximum number of queries embedded in one forward pass
+QUERY_BATCH_SIZE = 256
+
+# Query cache settings; popular queries skip the transformer forward pass
+QUERY_CACHE_SIZE = 10000
+QUERY_CACHE_TTL_SECONDS = 3600
+CACHE_RESULTS = True
+
 def load_model():
     """Load the HuggingFace model for embedding"""
     print(f"Loading HuggingFace model: {MODEL_NAME}")
@@ -38,19 +54,28 @@ class NetflixSimilarityModel(mlflow.pyfunc.PythonModel):
         """
         Load precomputed embeddings, Netflix reviews data, and HuggingFace model.
         """
-        # Load precomputed embeddings
-        self.embeddings_df = pd.read_csv(context.artifacts['embeddings_path'])
+        # Memory-map precomputed embeddings from the binary store
+        self.store = open_embedding_store(context.artifacts['embeddings_path'])
+        
+        # Load the nearest-neighbor index built at logging time, or fall back to exact search
+        index_path = context.artifacts.get('ann_index_path')
+        if index_path and read_index_kind(index_path) == "pq":
+            # Compressed codes stay in memory; full vectors are read from the memory map
+            # only to re-rank each query's shortlist
+            self.index = load_index(index_path, self.store.embeddings)
+        else:
+            # Normalize once so each request scores with a single matrix-vector product
+            self.embeddings = l2_normalize(self.store.embeddings)
+            self.index = load_index(index_path, self.embeddings) if index_path else ExactIndex(self.embeddings)
+        print(f"Using '{self.index.kind}' nearest-neighbor index")
         
         # Load Netflix reviews corpus
         self.netflix_df = pd.read_csv(context.artifacts['netflix_reviews_path'])
         
         # Print diagnostics about the loaded data
-        print(f"Loaded embeddings shape: {self.embeddings_df.shape}")
+        print(f"Loaded embeddings shape: {self.store.shape} ({self.store.dtype})")
         print(f"Loaded Netflix reviews shape: {self.netflix_df.shape}")
         
-        # Convert embeddings to numpy array for faster similarity computation
-        self.embeddings = self.embeddings_df.values
-        
         # Load HuggingFace model
         self.model_name = MODEL_NAME
         self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
@@ -61,86 +86,158 @@ class NetflixSimilarityModel(mlflow.pyfunc.PythonModel):
         # Load pre-trained model
         self.model = AutoModel.from_pretrained(self.model_name).to(self.device)
         print(f"HuggingFace model '{self.model_name}' loaded successfully")
+        
+        # Cache query vectors, and optionally final top-k results, by normalized query text
+        self.embedding_cache = QueryCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL_SECONDS)
+        self.result_cache = QueryCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL_SECONDS) if CACHE_RESULTS else None
     
     def generate_query_embedding(self, query):
-        """Generate embedding for the input query text using HuggingFace model"""
+        """
+        Generate embeddings for one query or a list of queries using HuggingFace model.
+        
+        Queries are tokenized together and padded to the longest one; mean pooling
+        ignores the padding, so each vector matches embedding the query on its own.
+        """
         self.model.eval()  # Set model to evaluation mode
+        queries = [query] if isinstance(query, str) else list(query)
         
-        # Tokenize the input query and move tensors to the selected device
-        encoded_input = self.tokenizer(
-            query, 
-            padding=True, 
-            truncation=True, 
-            return_tensors="pt", 
-            max_length=512
-        )
-        encoded_input = {key: val.to(self.device) for key, val in encoded_input.items()}
+        embeddings = []
+        for start in range(0, len(queries), QUERY_BATCH_SIZE):
+            # Tokenize the batch of queries and move tensors to the selected device
+            encoded_input = self.tokenizer(
+                queries[start:start + QUERY_BATCH_SIZE], 
+                padding=True, 
+                truncation=True, 
+                return_tensors="pt", 
+                max_length=512
+            )
+            encoded_input = {key: val.to(self.device) for key, val in encoded_input.items()}
+            
+            # Get the model's output embedding
+            with torch.no_grad():
+                output = self.model(**encoded_input)
+            
+            # Use attention-mask-aware mean pooling to get sentence embeddings
+            embedding = mean_pooling(output.last_hidden_state, encoded_input["attention_mask"])
+            embeddings.append(embedding.cpu().numpy())
+        
+        # Return the embeddings as a NumPy array of shape [num_queries, dim]
+        return np.concatenate(embeddings)
+    
+    def get_query_embeddings(self, queries):
+        """Return embeddings for the queries, computing only those missing from the cache."""
+        keys = [self.embedding_cache.make_key(self.model_name, query) for query in queries]
+        embeddings = [self.embedding_cache.get(key) for key in keys]
+        
+        # Embed every cache miss together in one batch
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            computed = self.generate_query_embedding([queries[i] for i in missing])
+            for i, embedding in zip(missing, computed):
+                self.embedding_cache.put(keys[i], embedding)
+                embeddings[i] = embedding
         
-        # Get the model's output embedding
-        with torch.no_grad():
-            output = self.model(**encoded_input)
+        return np.stack(embeddings)
+    
+    def cache_stats(self):
+        """Return hit/miss counters for the query caches."""
+        stats = {"embeddings": self.embedding_cache.stats()}
+        if self.result_cache is not None:
+            stats["results"] = self.result_cache.stats()
+        return stats
+    
+    def format_prediction(self, idx, similarity):
+        """Format one Netflix title as a recommendation for the HTML interface."""
+        show = self.netflix_df.iloc[idx]
         
-        # Use mean pooling to get sentence embedding
-        embedding = output.last_hidden_state.mean(dim=1)
+        # Format Netflix content as a recommendation
+        content = f"{show.get('title', 'Unknown')}"
+        
+        # Add genre if available
+        if 'listed_in' in show and not pd.isna(show['listed_in']):
+            content += f" - {show['listed_in']}"
+            
+        # Add description if available
+        if 'description' in show and not pd.isna(show['description']):
+            content += f": {show['description']}"
         
-        # Return the embedding as a NumPy array
-        return embedding.cpu().numpy()
+        # Format result to match HTML expectations
+        return {
+            'Content': content,  
+            'Similarity': float(similarity)
+        }
     
     def predict(self, context, model_input, params):
         """
         Find similar Netflix content based on semantic similarity to the query text.
         Format results to be compatible with the HTML interface.
+        
+        By default the input holds one query and the result is {"predictions": [...]},
+        as the HTML interface expects. With the `batch` parameter set, any number of
+        queries are embedded and scored together and the result always holds one entry
+        per query: {"predictions": [{"Query": ..., "Results": [...]}, ...]}.
         """
-        # Extract the query string from model input
-        query = model_input["query"][0]
-        print(f"Processing query: '{query}'")
+        # Extract every query string from model input; MLflow may deliver a dict
+        # payload as a single row whose cell holds the whole list of queries
+        queries = []
+        for value in model_input["query"]:
+            if isinstance(value, (list, tuple, np.ndarray)):
+                queries.extend(str(query) for query in value)
+            else:
+                queries.append(str(value))
         
-        # Extract parameters
+        # Extract parameters; nprobe trades recall for latency on the IVF index, and
+        # 0 (the schema default) keeps the nprobe the index was built with
         top_n = params.get("top_n", 5) if params else 5
+        nprobe = (params.get("nprobe") if params else None) or None
+        batch = bool(params.get("batch", False)) if params else False
+        
+        # The scoring server answers an invalid parameter error with HTTP 400
+        if not batch and len(queries) != 1:
+            raise MlflowException(
+                f"Expected one query, got {len(queries)}; set the 'batch' parameter to send several",
+                error_code=INVALID_PARAMETER_VALUE,
+            )
+        print(f"Processing {len(queries)} queries" if batch else f"Processing query: '{queries[0]}'")
         
         # Make sure top_n isn't larger than our dataset
         top_n = min(top_n, len(self.netflix_df))
         
-        # Generate embedding for the query text
-        query_embedding = self.generate_query_embedding(query)
+        # Reuse cached top-k results for queries seen recently with the same parameters
+        result_keys = [self.embedding_cache.make_key(self.model_name, query, top_n, nprobe) for query in queries]
+        cached = [self.result_cache.get(key) if self.result_cache is not None else None for key in result_keys]
+        pending = [i for i, predictions in enumerate(cached) if predictions is None]
         
-        # Compute cosine similarity between query and all embeddings
-        similarities = cosine_similarity(query_embedding, self.embeddings)[0]
+        if pending:
+            # Generate embeddings for the remaining queries in one batch
+            query_embeddings = l2_normalize(self.get_query_embeddings([queries[i] for i in pending]))
+            
+            # Find the top N for every query through the nearest-neighbor index
+            matches = self.index.search(query_embeddings, top_n, nprobe=nprobe)
+            
+            for i, (row_indices, row_similarities) in zip(pending, matches):
+                cached[i] = [self.format_prediction(idx, sim) for idx, sim in zip(row_indices, row_similarities)]
+                if self.result_cache is not None:
+                    self.result_cache.put(result_keys[i], cached[i])
         
-        # Get indices of top N most similar results
-        top_indices = np.argsort(similarities)[::-1][:top_n]
+        print(f"Query cache stats: {self.cache_stats()}")
         
         # Format results for the HTML interface
-        predictions = []
-        for idx in top_indices:
-            show = self.netflix_df.iloc[idx]
-            
-            # Format Netflix content as a recommendation
-            content = f"{show.get('title', 'Unknown')}"
-            
-            # Add genre if available
-            if 'listed_in' in show and not pd.isna(show['listed_in']):
-                content += f" - {show['listed_in']}"
-                
-            # Add description if available
-            if 'description' in show and not pd.isna(show['description']):
-                content += f": {show['description']}"
-            
-            # Format result to match HTML expectations
-            result = {
-                'Content': content,  
-                'Similarity': float(similarities[idx])
-            }
-            
-            predictions.append(result)
+        results = [{'Query': query, 'Results': predictions} for query, predictions in zip(queries, cached)]
         
         # Return predictions as expected by HTML interface
-        return {"predictions": predictions}
+        if batch:
+            return {"predictions": results}
+        return {"predictions": results[0]['Results']}
     
     @classmethod
-    def log_model(cls, model_name, embeddings_path, netflix_reviews_path, demo_dir=None):
+    def log_model(cls, model_name, embeddings_path, netflix_reviews_path, demo_dir=None,
+                  index_type="ivf", index_params=None):
         """
         Logs the model to MLflow with appropriate artifacts and schema.
+        
+        A nearest-neighbor index of `index_type` ("ivf", "pq" or "exact") is built over the
+        embeddings and shipped as an artifact; `index_params` are passed to its builder.
         """
         # Check if the files exist
         for path in [embeddings_path, netflix_reviews_path]:
@@ -165,7 +262,9 @@ class NetflixSimilarityModel(mlflow.pyfunc.PythonModel):
         # Parameters schema - include show_score to match HTML interface
         params_schema = ParamSchema([
             ParamSpec("top_n", "integer", 5),
-            ParamSpec("show_score", "boolean", True)
+            ParamSpec("show_score", "boolean", True),
+            ParamSpec("nprobe", "integer", 0),
+            ParamSpec("batch", "boolean", False)
         ])
         
         # Define model signature
@@ -173,7 +272,6 @@ class NetflixSimilarityModel(mlflow.pyfunc.PythonModel):
         
         # Define necessary package requirements
         requirements = [
-            "scikit-learn",
             "pandas",
             "numpy",
             "tabulate",
@@ -187,6 +285,13 @@ class NetflixSimilarityModel(mlflow.pyfunc.PythonModel):
             "netflix_reviews_path": netflix_reviews_path
         }
         
+        # Build the nearest-neighbor index now so serving only has to load it
+        print(f"Building '{index_type}' index over {embeddings_path}")
+        index = build_index(index_type, l2_normalize(open_embedding_store(embeddings_path).embeddings), **(index_params or {}))
+        index_path = os.path.join(tempfile.mkdtemp(), "ann_index.npz")
+        index.save(index_path)
+        artifacts["ann_index_path"] = index_path
+        
         # Add demo directory to artifacts if provided and exists
         if demo_dir and os.path.exists(demo_dir):
             artifacts["demo"] = demo_dir
@@ -203,6 +308,10 @@ class NetflixSimilarityModel(mlflow.pyfunc.PythonModel):
             artifacts=artifacts,
             signature=signature,
             pip_requirements=requirements,
+            code_paths=[
+                "ann_index.py", "embedding_engine.py", "embedding_store.py",
+                "pq_codec.py", "query_cache.py", "similarity.py"
+            ],
             metadata=metadata
         )
 
@@ -230,7 +339,7 @@ def log_model_to_mlflow():
         # Log the Netflix similarity model to MLflow
         NetflixSimilarityModel.log_model(
             model_name="Netflix_HuggingFace_Similarity",
-            embeddings_path="data/embedded.csv",
+            embeddings_path="data/embeddings.bin",
             netflix_reviews_path="data/netflix_reviews.csv",
             demo_dir=demo_dir if os.path.exists(demo_dir) else None
         )
@@ -0,0 +1,223 @@
+"""
+Nearest-neighbor indexes over L2-normalized embeddings.
+
+Every index exposes `search(queries, k, nprobe=None)` and returns, for each query,
+the row indices and cosine similarities of its best matches, best first.
+
+    exact   scores every row (brute force)
+    ivf     inverted file: spherical k-means splits the corpus into lists and each
+            query only scores the `nprobe` lists whose centroids are closest
+    pq      product-quantized codes scored with per-query lookup tables, with the
+            shortlist re-ranked on exact vectors (see `pq_codec`)
+
+Indexes are saved with `np.savez` so they can ship as MLflow artifacts; the vectors
+themselves are not duplicated and are passed in again when the index is loaded.
+"""
+import numpy as np
+
+from pq_codec import PQIndex
+from similarity import l2_normalize, top_k
+
+
+class ExactIndex:
+    """Brute-force search over every row."""
+
+    kind = "exact"
+
+    def __init__(self, embeddings):
+        """
+        Args:
+            embeddings (numpy.ndarray): L2-normalized matrix of shape [rows, dim].
+        """
+        self.embeddings = embeddings
+
+    @classmethod
+    def build(cls, embeddings):
+        return cls(embeddings)
+
+    def save(self, path):
+        np.savez(path, kind=self.kind)
+
+    @classmethod
+    def load(cls, data, embeddings):
+        return cls(embeddings)
+
+    def search(self, queries, k, nprobe=None):
+        """
+        Args:
+            queries (numpy.ndarray): L2-normalized queries of shape [num_queries, dim].
+            k (int): Number of results per query.
+            nprobe: Ignored; accepted so every index shares one search signature.
+
+        Returns:
+            list[tuple[numpy.ndarray, numpy.ndarray]]: (indices, similarities) per query.
+        """
+        similarities = queries @ self.embeddings.T
+        indices = top_k(similarities, k)
+        return [(row, scores[row]) for row, scores in zip(indices, similarities)]
+
+
+class IVFIndex:
+    """Inverted-file index with a spherical k-means coarse quantizer."""
+
+    kind = "ivf"
+
+    def __init__(self, embeddings, centroids, list_offsets, list_ids, nprobe=8):
+        """
+        Args:
+            embeddings (numpy.ndarray): L2-normalized matrix of shape [rows, dim].
+            centroids (numpy.ndarray): Unit-length list centroids of shape [n_lists, dim].
+            list_offsets (numpy.ndarray): Start of each list in `list_ids`, length n_lists + 1.
+            list_ids (numpy.ndarray): Row indices grouped by list.
+            nprobe (int): Default number of lists scanned per query.
+        """
+        self.embeddings = embeddings
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        self.nprobe = nprobe
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @staticmethod
+    def assign(vectors, centroids, chunk_size=65536):
+        """Return the index of the closest centroid for each vector, in bounded memory."""
+        labels = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), chunk_size):
+            chunk = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+            labels[start:start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+        return labels
+
+    @classmethod
+    def build(cls, embeddings, n_lists=None, n_iter=20, sample_size=None, nprobe=8, seed=0):
+        """
+        Train the coarse quantizer and group every row into its closest list.
+
+        Args:
+            embeddings (numpy.ndarray): L2-normalized matrix of shape [rows, dim].
+            n_lists (int, optional): Number of lists. Defaults to about 4 * sqrt(rows).
+            n_iter (int): k-means iterations.
+            sample_size (int, optional): Rows used to train k-means. Defaults to 256 per list.
+            nprobe (int): Default number of lists scanned per query.
+            seed (int): Seed for centroid initialization and sampling.
+
+        Returns:
+            IVFIndex: The trained index.
+        """
+        rows = len(embeddings)
+        if rows == 0:
+            raise ValueError("Cannot build an IVF index over an empty corpus")
+        if n_lists is None:
+            n_lists = int(4 * np.sqrt(rows))
+        n_lists = max(1, min(n_lists, rows))
+        sample_size = min(rows, sample_size or 256 * n_lists)
+
+        rng = np.random.default_rng(seed)
+        sample = np.asarray(embeddings[np.sort(rng.choice(rows, sample_size, replace=False))], dtype=np.float32)
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+
+        for _ in range(n_iter):
+            labels = cls.assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=n_lists)
+            # Re-seed empty lists from random sample rows so no centroid is wasted
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(sample_size, int(empty.sum()), replace=False)]
+            centroids = l2_normalize(sums)
+
+        labels = cls.assign(embeddings, centroids)
+        list_ids = np.argsort(labels, kind="stable")
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        list_offsets[1:] = np.cumsum(np.bincount(labels, minlength=n_lists))
+        return cls(embeddings, centroids, list_offsets, list_ids, nprobe=nprobe)
+
+    def save(self, path):
+        np.savez(
+            path,
+            kind=self.kind,
+            centroids=self.centroids,
+            list_offsets=self.list_offsets,
+            list_ids=self.list_ids,
+            nprobe=self.nprobe,
+        )
+
+    @classmethod
+    def load(cls, data, embeddings):
+        return cls(
+            embeddings,
+            data["centroids"],
+            data["list_offsets"],
+            data["list_ids"],
+            nprobe=int(data["nprobe"]),
+        )
+
+    def search(self, queries, k, nprobe=None):
+        """
+        Args:
+            queries (numpy.ndarray): L2-normalized queries of shape [num_queries, dim].
+            k (int): Number of results per query.
+            nprobe (int, optional): Lists scanned per query. Higher means better recall
+                and higher latency; `n_lists` gives exact results.
+
+        Returns:
+            list[tuple[numpy.ndarray, numpy.ndarray]]: (indices, similarities) per query.
+            A query gets fewer than k results when the probed lists hold fewer rows.
+        """
+        nprobe = max(1, min(nprobe or self.nprobe, self.n_lists))
+        probes = top_k(queries @ self.centroids.T, nprobe)
+
+        results = []
+        for query, lists in zip(queries, probes):
+            candidates = np.concatenate([
+                self.list_ids[self.list_offsets[lst]:self.list_offsets[lst + 1]] for lst in lists
+            ])
+            scores = np.asarray(self.embeddings[candidates]) @ query
+            best = top_k(scores, k)
+            results.append((candidates[best], scores[best]))
+        return results
+
+
+INDEX_TYPES = {
+    ExactIndex.kind: ExactIndex,
+    IVFIndex.kind: IVFIndex,
+    PQIndex.kind: PQIndex,
+}
+
+
+def build_index(kind, embeddings, **kwargs):
+    """
+    Build an index of the given kind.
+
+    Args:
+        kind (str): One of `INDEX_TYPES`.
+        embeddings (numpy.ndarray): L2-normalized matrix of shape [rows, dim].
+        **kwargs: Build options for the chosen index type.
+    """
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{kind}'. Choose from {sorted(INDEX_TYPES)}")
+    return INDEX_TYPES[kind].build(embeddings, **kwargs)
+
+
+def read_index_kind(path):
+    """Return the index type stored in a saved index file without loading its arrays."""
+    with np.load(path) as data:
+        return str(data["kind"])
+
+
+def load_index(path, embeddings):
+    """
+    Load an index saved with `save`.
+
+    Args:
+        path (str): Path to the `.npz` index file.
+        embeddings (numpy.ndarray): The same L2-normalized matrix the index was built on.
+    """
+    with np.load(path) as data:
+        kind = str(data["kind"])
+        if kind not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{kind}' in {path}")
+        return INDEX_TYPES[kind].load(data, embeddings)
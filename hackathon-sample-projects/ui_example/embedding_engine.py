@@ -0,0 +1,197 @@
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+from tqdm import tqdm
+
+# Budget used when `max_tokens` is None but the input is too small to be worth tuning
+DEFAULT_MAX_TOKENS = 16384
+
+# Candidate budgets tried by `tune`, smallest first, and the tokens timed for each of them
+TUNING_BUDGETS = (2048, 4096, 8192, 16384, 32768)
+TUNING_SAMPLE_TOKENS = 32768
+MIN_TUNING_TOKENS = 20 * TUNING_SAMPLE_TOKENS
+
+
+def mean_pooling(last_hidden_state, attention_mask):
+    """
+    Average token embeddings while ignoring padding positions.
+
+    Args:
+        last_hidden_state (torch.Tensor): Token embeddings of shape [batch, seq_len, dim].
+        attention_mask (torch.Tensor): Mask of shape [batch, seq_len], 1 for real tokens.
+
+    Returns:
+        torch.Tensor: Sentence embeddings of shape [batch, dim].
+    """
+    mask = attention_mask.unsqueeze(-1).to(last_hidden_state.dtype)
+    summed = (last_hidden_state * mask).sum(dim=1)
+    counts = mask.sum(dim=1).clamp(min=1e-9)
+    return summed / counts
+
+
+class BatchedEmbeddingEngine:
+    """
+    Embed many texts with one forward pass per length bucket.
+
+    Texts are tokenized once, sorted by token length and packed into buckets whose
+    padded size stays under a token budget. Each bucket is padded only to its own
+    longest text, pooled with the attention mask and written back to its original row,
+    so the output matches embedding every text on its own.
+
+    With `max_tokens=None` the budget is tuned on the first large input by timing a
+    sample with a few candidate budgets, since the fastest one depends on the machine.
+    """
+
+    def __init__(self, tokenizer, model, device=None, max_tokens=16384, max_batch_size=256, max_length=512):
+        """
+        Args:
+            tokenizer: The Hugging Face tokenizer.
+            model: The Hugging Face model.
+            device (torch.device, optional): Device to run on. Defaults to the model's device.
+            max_tokens (int, optional): Upper bound on padded tokens (batch size x sequence length)
+                per bucket. None tunes it on the first input of at least MIN_TUNING_TOKENS tokens.
+            max_batch_size (int): Upper bound on texts per bucket.
+            max_length (int): Truncation length, same as the single-text path.
+        """
+        self.tokenizer = tokenizer
+        self.model = model
+        self.device = device or next(model.parameters()).device
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.max_length = max_length
+        self.last_stats = None
+
+    @staticmethod
+    def clean_texts(texts):
+        """Replace empty or NaN entries the same way `get_embedding` does."""
+        return ["empty content" if pd.isna(text) or text == "" else str(text) for text in texts]
+
+    def make_buckets(self, lengths, max_tokens=None):
+        """
+        Group row indices into length-sorted buckets under the token budget.
+
+        Args:
+            lengths (numpy.ndarray): Token count for every text.
+            max_tokens (int, optional): Budget to use instead of `self.max_tokens`.
+
+        Returns:
+            list[numpy.ndarray]: Row indices for each bucket, shortest texts first.
+        """
+        max_tokens = max_tokens or self.max_tokens or DEFAULT_MAX_TOKENS
+        order = np.argsort(lengths, kind="stable")
+        buckets = []
+        current = []
+        for idx in order:
+            # Lengths are ascending, so the newest text sets the padded width of the bucket
+            count = len(current) + 1
+            if current and (count > self.max_batch_size or count * lengths[idx] > max_tokens):
+                buckets.append(np.array(current))
+                current = []
+            current.append(idx)
+        if current:
+            buckets.append(np.array(current))
+        return buckets
+
+    def _run_buckets(self, encoded, buckets, output, show_progress=False):
+        """Embed each bucket of tokenized texts into its rows of `output`."""
+        self.model.eval()
+        for bucket in tqdm(buckets, disable=not show_progress):
+            features = [{key: encoded[key][i] for key in encoded.keys()} for i in bucket]
+            batch = self.tokenizer.pad(features, padding=True, return_tensors="pt")
+            batch = {key: val.to(self.device) for key, val in batch.items()}
+
+            with torch.no_grad():
+                model_output = self.model(**batch)
+
+            pooled = mean_pooling(model_output.last_hidden_state, batch["attention_mask"])
+            output[bucket] = pooled.float().cpu().numpy()
+
+    def tune(self, encoded, lengths, budgets=TUNING_BUDGETS, seed=0):
+        """
+        Pick the fastest token budget for this machine by timing a sample of the input.
+
+        Candidates are tried from smallest to largest, and tuning stops once a larger
+        budget is more than 10% slower than the best one so far.
+
+        Args:
+            encoded: Unpadded tokenizer output for the texts.
+            lengths (numpy.ndarray): Token count for every text.
+            budgets (tuple[int]): Candidate budgets.
+            seed (int): Seed for drawing the sample.
+
+        Returns:
+            int: The chosen budget, also stored in `max_tokens`.
+        """
+        # A random sample keeps the mix of short and long texts of the full input
+        order = np.random.default_rng(seed).permutation(len(lengths))
+        sample = order[:np.searchsorted(np.cumsum(lengths[order]), TUNING_SAMPLE_TOKENS) + 1]
+        sample_encoded = {key: [encoded[key][i] for i in sample] for key in encoded.keys()}
+        sample_lengths = lengths[sample]
+        output = np.zeros((len(sample), self.model.config.hidden_size), dtype=np.float32)
+
+        # Warm up once so the first candidate does not pay for lazy initialization
+        self._run_buckets(sample_encoded, self.make_buckets(sample_lengths, budgets[0])[:1], output)
+
+        best_budget, best_rate = budgets[0], 0.0
+        for budget in budgets:
+            start = time.perf_counter()
+            self._run_buckets(sample_encoded, self.make_buckets(sample_lengths, budget), output)
+            rate = sample_lengths.sum() / max(time.perf_counter() - start, 1e-9)
+            print(f"Token budget {budget}: {rate:.0f} tokens/sec")
+            if rate > best_rate:
+                best_budget, best_rate = budget, rate
+            elif rate < 0.9 * best_rate:
+                break
+
+        print(f"Using a token budget of {best_budget} per bucket")
+        self.max_tokens = best_budget
+        return best_budget
+
+    def embed(self, texts, show_progress=True):
+        """
+        Generate embeddings for a list of texts.
+
+        Throughput (real tokens per second and the share of padding) is printed and
+        kept in `last_stats`.
+
+        Args:
+            texts (list[str]): The input texts.
+            show_progress (bool): Show a progress bar over buckets.
+
+        Returns:
+            numpy.ndarray: float32 array of shape [len(texts), dim] in input order.
+        """
+        texts = self.clean_texts(texts)
+        if not texts:
+            return np.zeros((0, self.model.config.hidden_size), dtype=np.float32)
+
+        # Tokenize once without padding so bucket padding can be applied per group
+        encoded = self.tokenizer(texts, truncation=True, max_length=self.max_length)
+        input_ids = encoded["input_ids"]
+        lengths = np.fromiter((len(ids) for ids in input_ids), dtype=np.int64, count=len(input_ids))
+
+        if self.max_tokens is None and lengths.sum() >= MIN_TUNING_TOKENS:
+            self.tune(encoded, lengths)
+
+        all_embeddings = np.zeros((len(texts), self.model.config.hidden_size), dtype=np.float32)
+        buckets = self.make_buckets(lengths)
+
+        start = time.perf_counter()
+        self._run_buckets(encoded, buckets, all_embeddings, show_progress)
+        seconds = time.perf_counter() - start
+
+        padded = sum(len(bucket) * lengths[bucket].max() for bucket in buckets)
+        self.last_stats = {
+            "texts": len(texts),
+            "buckets": len(buckets),
+            "tokens": int(lengths.sum()),
+            "padded_tokens": int(padded),
+            "seconds": seconds,
+            "tokens_per_sec": float(lengths.sum() / max(seconds, 1e-9)),
+        }
+        print(f"Embedded {len(texts)} texts in {len(buckets)} buckets: "
+              f"{self.last_stats['tokens_per_sec']:.0f} tokens/sec, {1 - lengths.sum() / max(1, padded):.1%} padding")
+
+        return all_embeddings
@@ -0,0 +1,145 @@
+"""
+Binary embedding store.
+
+Layout (little endian):
+    header   64 bytes: magic, version, dtype code, rows, dim (zero padded)
+    matrix   rows x dim values of float32 or float16, row major
+    ids      rows int64 values
+
+The matrix and id column are opened with `np.memmap`, so loading a store does not
+parse or copy the vectors and the cost of opening it does not grow with the corpus.
+"""
+import os
+import struct
+import sys
+
+import numpy as np
+import pandas as pd
+
+MAGIC = b"EMBSTORE"
+VERSION = 1
+HEADER_SIZE = 64
+HEADER_FORMAT = "<8sIIQQ"
+
+DTYPE_CODES = {
+    np.dtype(np.float32): 0,
+    np.dtype(np.float16): 1,
+}
+CODE_DTYPES = {code: dtype for dtype, code in DTYPE_CODES.items()}
+
+
+class EmbeddingStore:
+    """Read-only view over a binary embedding store file."""
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Path to a store written by `write_embedding_store`.
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE:
+            raise ValueError(f"File too small to be an embedding store: {path}")
+
+        magic, version, dtype_code, rows, dim = struct.unpack_from(HEADER_FORMAT, header)
+        if magic != MAGIC:
+            raise ValueError(f"Not an embedding store: {path}")
+        if version != VERSION:
+            raise ValueError(f"Unsupported embedding store version {version}: {path}")
+        if dtype_code not in CODE_DTYPES:
+            raise ValueError(f"Unknown embedding dtype code {dtype_code}: {path}")
+
+        self.dtype = CODE_DTYPES[dtype_code]
+        self.shape = (rows, dim)
+
+        # Map the matrix and the id column straight from disk
+        matrix_bytes = rows * dim * self.dtype.itemsize
+        if rows == 0:
+            self.embeddings = np.zeros((0, dim), dtype=self.dtype)
+            self.ids = np.zeros(0, dtype=np.int64)
+        else:
+            self.embeddings = np.memmap(path, dtype=self.dtype, mode="r", offset=HEADER_SIZE, shape=(rows, dim))
+            self.ids = np.memmap(path, dtype=np.int64, mode="r", offset=HEADER_SIZE + matrix_bytes, shape=(rows,))
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def dim(self):
+        return self.shape[1]
+
+
+def open_embedding_store(path):
+    """
+    Open an embedding store without reading the vectors into memory.
+
+    Args:
+        path (str): Path to the store file.
+
+    Returns:
+        EmbeddingStore: Store with memory-mapped `embeddings` and `ids` arrays.
+    """
+    return EmbeddingStore(path)
+
+
+def write_embedding_store(path, embeddings, ids=None, dtype=np.float32):
+    """
+    Write embeddings to a binary store.
+
+    The file is written next to its destination and renamed into place, so readers
+    never see a partially written store.
+
+    Args:
+        path (str): Destination path.
+        embeddings (numpy.ndarray): Matrix of shape [rows, dim].
+        ids (array-like, optional): Integer id for each row. Defaults to the row number.
+        dtype: Storage dtype, float32 or float16.
+    """
+    dtype = np.dtype(dtype)
+    if dtype not in DTYPE_CODES:
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+
+    embeddings = np.ascontiguousarray(embeddings, dtype=dtype)
+    if embeddings.ndim != 2:
+        raise ValueError(f"Embeddings must be 2D, got shape {embeddings.shape}")
+    rows, dim = embeddings.shape
+
+    if ids is None:
+        ids = np.arange(rows, dtype=np.int64)
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+    if ids.shape != (rows,):
+        raise ValueError(f"Expected {rows} ids, got {ids.shape[0]}")
+
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, DTYPE_CODES[dtype], rows, dim)
+    header = header.ljust(HEADER_SIZE, b"\0")
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(embeddings.tobytes())
+        f.write(ids.tobytes())
+    os.replace(tmp_path, path)
+
+
+def convert_csv_store(csv_path, store_path, dtype=np.float32):
+    """
+    Convert an embeddings CSV (one row per record, one column per dimension) to a store.
+
+    Args:
+        csv_path (str): Path to the embeddings CSV.
+        store_path (str): Destination store path.
+        dtype: Storage dtype, float32 or float16.
+    """
+    embeddings = pd.read_csv(csv_path).values
+    write_embedding_store(store_path, embeddings, dtype=dtype)
+    print(f"Converted {embeddings.shape[0]} embeddings from {csv_path} to {store_path}")
+
+
+if __name__ == "__main__":
+    # Usage: python embedding_store.py data/embedded.csv data/embeddings.bin [float16]
+    convert_csv_store(sys.argv[1], sys.argv[2], dtype=sys.argv[3] if len(sys.argv) > 3 else np.float32)
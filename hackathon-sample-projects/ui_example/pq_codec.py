@@ -0,0 +1,255 @@
+"""
+Product quantization for embedding search.
+
+Each vector is split into `n_subspaces` equal slices and every slice is replaced by the
+id of its closest centroid in a per-subspace codebook of up to 256 entries. A 384-dim
+float32 vector becomes 48 one-byte codes.
+
+Queries are not quantized (asymmetric distance computation): each query builds a small
+table of its dot products with every codebook entry, and the score of a stored vector is
+the sum of table lookups over its codes. The best candidates can then be re-ranked with
+their exact vectors read from the embedding store.
+"""
+import numpy as np
+
+from similarity import l2_normalize, top_k
+
+
+def kmeans(vectors, n_clusters, n_iter=20, rng=None):
+    """
+    Plain Euclidean k-means.
+
+    Args:
+        vectors (numpy.ndarray): Training data of shape [rows, dim].
+        n_clusters (int): Number of centroids.
+        n_iter (int): Iterations.
+        rng (numpy.random.Generator, optional): Random source for initialization.
+
+    Returns:
+        numpy.ndarray: Centroids of shape [n_clusters, dim].
+    """
+    rng = rng or np.random.default_rng(0)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = nearest_centroid(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        counts = np.bincount(labels, minlength=n_clusters)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Re-seed empty clusters from random training rows
+        if not filled.all():
+            centroids[~filled] = vectors[rng.choice(len(vectors), int((~filled).sum()), replace=False)]
+    return centroids
+
+
+def nearest_centroid(vectors, centroids):
+    """Return the index of the closest centroid (Euclidean) for each vector."""
+    # ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2, and ||x||^2 does not change the argmin
+    distances = (centroids ** 2).sum(axis=1) - 2 * vectors @ centroids.T
+    return np.argmin(distances, axis=1)
+
+
+class ProductQuantizer:
+    """Codebooks for encoding vectors into one byte per subspace."""
+
+    def __init__(self, codebooks):
+        """
+        Args:
+            codebooks (numpy.ndarray): Centroids of shape [n_subspaces, n_codes, sub_dim].
+        """
+        self.codebooks = codebooks
+
+    @property
+    def n_subspaces(self):
+        return self.codebooks.shape[0]
+
+    @property
+    def sub_dim(self):
+        return self.codebooks.shape[2]
+
+    @classmethod
+    def train(cls, vectors, n_subspaces=None, n_codes=256, n_iter=20, seed=0):
+        """
+        Learn one k-means codebook per subspace.
+
+        Args:
+            vectors (numpy.ndarray): Training data of shape [rows, dim].
+            n_subspaces (int, optional): Slices per vector; must divide dim.
+                Defaults to one slice per 8 dimensions.
+            n_codes (int): Codebook size per subspace, at most 256.
+            n_iter (int): k-means iterations.
+            seed (int): Seed for k-means initialization.
+
+        Returns:
+            ProductQuantizer: The trained quantizer.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        rows, dim = vectors.shape
+        if n_subspaces is None:
+            n_subspaces = max(1, dim // 8)
+        if dim % n_subspaces:
+            raise ValueError(f"n_subspaces ({n_subspaces}) must divide the embedding dimension ({dim})")
+        if not 1 <= n_codes <= 256:
+            raise ValueError(f"n_codes must be between 1 and 256, got {n_codes}")
+        n_codes = min(n_codes, rows)
+
+        rng = np.random.default_rng(seed)
+        sub_dim = dim // n_subspaces
+        codebooks = np.stack([
+            kmeans(vectors[:, j * sub_dim:(j + 1) * sub_dim], n_codes, n_iter=n_iter, rng=rng)
+            for j in range(n_subspaces)
+        ])
+        return cls(codebooks)
+
+    def encode(self, vectors, chunk_size=65536):
+        """
+        Encode vectors into codes.
+
+        Args:
+            vectors (numpy.ndarray): Array of shape [rows, dim].
+            chunk_size (int): Rows encoded at a time.
+
+        Returns:
+            numpy.ndarray: uint8 codes of shape [rows, n_subspaces].
+        """
+        codes = np.empty((len(vectors), self.n_subspaces), dtype=np.uint8)
+        for start in range(0, len(vectors), chunk_size):
+            chunk = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+            chunk = chunk.reshape(len(chunk), self.n_subspaces, self.sub_dim)
+            for j in range(self.n_subspaces):
+                codes[start:start + len(chunk), j] = nearest_centroid(chunk[:, j], self.codebooks[j])
+        return codes
+
+    def decode(self, codes):
+        """Reconstruct approximate vectors of shape [rows, dim] from codes."""
+        parts = [self.codebooks[j][codes[:, j]] for j in range(self.n_subspaces)]
+        return np.concatenate(parts, axis=1)
+
+    def lookup_tables(self, queries):
+        """
+        Build the asymmetric distance tables for a batch of queries.
+
+        Args:
+            queries (numpy.ndarray): Array of shape [num_queries, dim].
+
+        Returns:
+            numpy.ndarray: Dot products of shape [num_queries, n_subspaces, n_codes].
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(len(queries), self.n_subspaces, self.sub_dim)
+        return np.einsum("qmd,mkd->qmk", queries, self.codebooks)
+
+    def score(self, table, codes, chunk_size=65536):
+        """
+        Approximate dot products between one query and every encoded vector.
+
+        Args:
+            table (numpy.ndarray): One query's lookup table of shape [n_subspaces, n_codes].
+            codes (numpy.ndarray): Codes of shape [rows, n_subspaces].
+            chunk_size (int): Rows scored at a time.
+
+        Returns:
+            numpy.ndarray: Approximate scores of shape [rows].
+        """
+        subspaces = np.arange(self.n_subspaces)
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), chunk_size):
+            scores[start:start + chunk_size] = table[subspaces, codes[start:start + chunk_size]].sum(axis=1)
+        return scores
+
+
+class PQIndex:
+    """Compressed search index with asymmetric distances and optional exact re-ranking."""
+
+    kind = "pq"
+
+    def __init__(self, embeddings, quantizer, codes, rerank_factor=10):
+        """
+        Args:
+            embeddings (numpy.ndarray, optional): Full vectors used only to re-rank the
+                shortlist; they may be a memory map and do not need to be normalized.
+            quantizer (ProductQuantizer): Trained codebooks.
+            codes (numpy.ndarray): uint8 codes of shape [rows, n_subspaces].
+            rerank_factor (int): Shortlist size as a multiple of k; 0 disables re-ranking.
+        """
+        self.embeddings = embeddings
+        self.quantizer = quantizer
+        self.codes = codes
+        self.rerank_factor = rerank_factor
+
+    @classmethod
+    def build(cls, embeddings, n_subspaces=None, n_codes=256, n_iter=20, sample_size=65536, rerank_factor=10, seed=0):
+        """
+        Train codebooks on a sample of the corpus and encode every row.
+
+        Rows are normalized a chunk at a time, so `embeddings` may be a raw memory map
+        and is kept as is for re-ranking.
+
+        Args:
+            embeddings (numpy.ndarray): Matrix of shape [rows, dim], normalized or not.
+            n_subspaces (int, optional): Codes per vector. Defaults to dim // 8.
+            n_codes (int): Codebook size per subspace, at most 256.
+            n_iter (int): k-means iterations.
+            sample_size (int): Rows used to train the codebooks.
+            rerank_factor (int): Shortlist size as a multiple of k; 0 disables re-ranking.
+            seed (int): Seed for sampling and k-means initialization.
+        """
+        rows = len(embeddings)
+        if rows == 0:
+            raise ValueError("Cannot build a PQ index over an empty corpus")
+        rng = np.random.default_rng(seed)
+        sample = l2_normalize(embeddings[np.sort(rng.choice(rows, min(rows, sample_size), replace=False))])
+        quantizer = ProductQuantizer.train(sample, n_subspaces=n_subspaces, n_codes=n_codes, n_iter=n_iter, seed=seed)
+        chunk_size = 65536
+        codes = np.concatenate([
+            quantizer.encode(l2_normalize(embeddings[start:start + chunk_size]))
+            for start in range(0, rows, chunk_size)
+        ])
+        return cls(embeddings, quantizer, codes, rerank_factor=rerank_factor)
+
+    def save(self, path):
+        np.savez(
+            path,
+            kind=self.kind,
+            codebooks=self.quantizer.codebooks,
+            codes=self.codes,
+            rerank_factor=self.rerank_factor,
+        )
+
+    @classmethod
+    def load(cls, data, embeddings):
+        return cls(
+            embeddings,
+            ProductQuantizer(data["codebooks"]),
+            data["codes"],
+            rerank_factor=int(data["rerank_factor"]),
+        )
+
+    def search(self, queries, k, nprobe=None):
+        """
+        Args:
+            queries (numpy.ndarray): L2-normalized queries of shape [num_queries, dim].
+            k (int): Number of results per query.
+            nprobe: Ignored; accepted so every index shares one search signature.
+
+        Returns:
+            list[tuple[numpy.ndarray, numpy.ndarray]]: (indices, similarities) per query.
+            Similarities are exact when re-ranking is on and approximate otherwise.
+        """
+        rerank = self.rerank_factor > 0 and self.embeddings is not None
+        shortlist_size = k * self.rerank_factor if rerank else k
+
+        results = []
+        for query, table in zip(queries, self.quantizer.lookup_tables(queries)):
+            approx = self.quantizer.score(table, self.codes)
+            shortlist = top_k(approx, shortlist_size)
+            if not rerank:
+                results.append((shortlist, approx[shortlist]))
+                continue
+
+            # Re-rank the shortlist with exact cosine similarity, reading rows in disk order
+            rows = np.sort(shortlist)
+            exact = l2_normalize(self.embeddings[rows]) @ query
+            best = top_k(exact, k)
+            results.append((rows[best], exact[best]))
+        return results
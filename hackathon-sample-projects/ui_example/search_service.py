@@ -0,0 +1,235 @@
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import torch
+from transformers import AutoTokenizer
+
+from ann_index import build_index, load_index, read_index_kind
+from embedding_engine import mean_pooling
+from embedding_store import open_embedding_store
+from quantization import load_model
+from similarity import l2_normalize
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+class NetflixSearchService:
+    """
+    Long-lived vector search over the Netflix catalog.
+
+    The model, the embedding matrix and the metadata frame are loaded once when the
+    service starts, so each query only pays for one forward pass and one scoring step.
+    """
+
+    def __init__(self, embeddings_path, netflix_csv, model_name=MODEL_NAME, device=None, warmup=True,
+                 index_type="exact", index_path=None, quantize=False):
+        """
+        Args:
+            embeddings_path (str): Path to the embedding store.
+            netflix_csv (str): Path to the Netflix reviews CSV.
+            index_type (str): Nearest-neighbor index to build at startup: "exact", "ivf" or "pq".
+            index_path (str, optional): Saved index to load instead of building one.
+            model_name (str): Hugging Face model used for query embeddings.
+            device (torch.device, optional): Device to run on. Defaults to GPU when available.
+            warmup (bool): Run a throwaway query at startup so the first request is not slow.
+            quantize (bool): Embed queries with int8 linear layers on CPU.
+        """
+        start = time.perf_counter()
+
+        print(f"Loading embeddings from {embeddings_path}")
+        self.store = open_embedding_store(embeddings_path)
+        if index_path:
+            index_type = read_index_kind(index_path)
+
+        if index_type == "pq":
+            # Compressed codes stay in memory; full vectors are read from the memory map
+            # only to re-rank each query's shortlist
+            self.embeddings = self.store.embeddings
+        else:
+            # Normalize once so each request scores with a single matrix-vector product
+            self.embeddings = l2_normalize(self.store.embeddings)
+
+        if index_path:
+            self.index = load_index(index_path, self.embeddings)
+        else:
+            self.index = build_index(index_type, self.embeddings)
+        print(f"Using '{self.index.kind}' nearest-neighbor index")
+
+        print(f"Loading Netflix data from {netflix_csv}")
+        self.netflix_df = pd.read_csv(netflix_csv)
+
+        if len(self.store) != len(self.netflix_df):
+            print(f"Warning: Embeddings count ({len(self.store)}) doesn't match Netflix data count ({len(self.netflix_df)})")
+
+        print(f"Loading Hugging Face model {model_name}")
+        if quantize:
+            self.device = torch.device("cpu")
+        else:
+            self.device = device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = load_model(model_name, quantize=quantize, device=self.device)
+
+        if warmup:
+            self.warmup()
+
+        print(f"Search service ready in {time.perf_counter() - start:.2f}s")
+
+    def warmup(self, query="warm up query"):
+        """Run one query end to end so lazy initialization happens before real traffic."""
+        self.search(query, top_n=1)
+
+    def embed_query(self, query):
+        """
+        Generate the embedding for a search query.
+
+        Args:
+            query (str): The search query text.
+
+        Returns:
+            numpy.ndarray: Query embedding of shape [1, dim].
+        """
+        encoded_input = self.tokenizer(
+            query,
+            padding=True,
+            truncation=True,
+            max_length=512,
+            return_tensors='pt'
+        )
+        encoded_input = {key: val.to(self.device) for key, val in encoded_input.items()}
+
+        with torch.no_grad():
+            model_output = self.model(**encoded_input)
+
+        embedding = mean_pooling(model_output.last_hidden_state, encoded_input["attention_mask"])
+        return embedding.cpu().numpy()
+
+    def search(self, query, top_n=3, nprobe=None):
+        """
+        Find the catalog entries most similar to a query.
+
+        Args:
+            query (str): The search query.
+            top_n (int): Number of top results to return.
+            nprobe (int, optional): Lists scanned by an IVF index; ignored for exact search.
+
+        Returns:
+            pandas.DataFrame: The top matching rows with a `similarity_score` column.
+        """
+        query_embedding = l2_normalize(self.embed_query(query))
+        top_indices, similarities = self.index.search(query_embedding, top_n, nprobe=nprobe)[0]
+
+        results = self.netflix_df.iloc[top_indices].copy()
+        results['similarity_score'] = similarities
+        return results
+
+
+def _parse_int(name, value, minimum, maximum=None):
+    """Parse a request parameter as an integer in [minimum, maximum], raising ValueError otherwise."""
+    try:
+        if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+            raise ValueError
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{name}' must be an integer, got {value!r}")
+    if number < minimum or (maximum is not None and number > maximum):
+        upper = maximum if maximum is not None else "inf"
+        raise ValueError(f"'{name}' must be in [{minimum}, {upper}], got {number}")
+    return number
+
+
+def make_handler(service):
+    """Build an HTTP request handler bound to a loaded search service."""
+
+    class SearchRequestHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _handle_search(self, query, top_n, nprobe=None):
+            if not query:
+                self._send_json(400, {"error": "Missing 'query'"})
+                return
+            try:
+                top_n = _parse_int("top_n", top_n, 1, len(service.store))
+                nprobe = _parse_int("nprobe", nprobe, 1) if nprobe is not None else None
+            except ValueError as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            start = time.perf_counter()
+            results = service.search(query, top_n=top_n, nprobe=nprobe)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            # Round-trip through pandas JSON so NaN and numpy types serialize cleanly
+            records = json.loads(results.to_json(orient="records"))
+            self._send_json(200, {"query": query, "results": records, "latency_ms": elapsed_ms})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/health":
+                self._send_json(200, {"status": "ok", "items": len(service.store)})
+            elif url.path == "/search":
+                params = parse_qs(url.query)
+                self._handle_search(params.get("q", [""])[0], params.get("top_n", [3])[0], params.get("nprobe", [None])[0])
+            else:
+                self._send_json(404, {"error": f"Unknown path: {url.path}"})
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/search":
+                self._send_json(404, {"error": f"Unknown path: {self.path}"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self._send_json(400, {"error": "Request body must be JSON"})
+                return
+            if not isinstance(payload, dict):
+                self._send_json(400, {"error": "Request body must be a JSON object"})
+                return
+            self._handle_search(payload.get("query", ""), payload.get("top_n", 3), payload.get("nprobe"))
+
+    return SearchRequestHandler
+
+
+def serve(service, host="127.0.0.1", port=8000):
+    """
+    Serve search requests over HTTP until interrupted.
+
+    Endpoints:
+        GET  /health
+        GET  /search?q=<query>&top_n=<n>[&nprobe=<lists>]
+        POST /search  {"query": "...", "top_n": n, "nprobe": lists}
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    print(f"Serving Netflix search on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the Netflix vector search service")
+    parser.add_argument("--embeddings", default="data/embeddings.bin")
+    parser.add_argument("--netflix-csv", default="data/netflix_reviews.csv")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--index-type", default="exact", choices=["exact", "ivf", "pq"])
+    parser.add_argument("--index-path", default=None, help="Saved index to load instead of building one")
+    parser.add_argument("--quantize", action="store_true", help="Embed queries with the int8 model on CPU")
+    args = parser.parse_args()
+
+    service = NetflixSearchService(
+        args.embeddings, args.netflix_csv, index_type=args.index_type, index_path=args.index_path,
+        quantize=args.quantize
+    )
+    serve(service, host=args.host, port=args.port)
@@ -0,0 +1,48 @@
+import numpy as np
+
+
+def l2_normalize(matrix, dtype=np.float32):
+    """
+    Scale each row to unit length so cosine similarity becomes a dot product.
+
+    Args:
+        matrix (numpy.ndarray): Array of shape [rows, dim] (or [dim] for a single vector).
+        dtype: Output dtype.
+
+    Returns:
+        numpy.ndarray: Row-normalized copy of the input. All-zero rows stay zero.
+    """
+    matrix = np.asarray(matrix, dtype=dtype)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def top_k(scores, k):
+    """
+    Return the indices of the k highest scores, best first.
+
+    Uses `np.argpartition` to select the candidates in linear time and only sorts
+    those k items, instead of sorting every score.
+
+    Args:
+        scores (numpy.ndarray): Scores of shape [n] or [queries, n].
+        k (int): Number of indices to return per row.
+
+    Returns:
+        numpy.ndarray: Indices of shape [k] or [queries, k], sorted by descending score.
+    """
+    scores = np.asarray(scores)
+    n = scores.shape[-1]
+    k = max(0, min(k, n))
+    if k == 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        candidates = np.broadcast_to(np.arange(n), scores.shape).copy()
+
+    candidate_scores = np.take_along_axis(scores, candidates, axis=-1)
+    order = np.argsort(-candidate_scores, axis=-1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=-1)
@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class QueryCache:
+    """
+    Bounded LRU cache with a time-to-live, for query embeddings and search results.
+
+    Keys are built from the model id and the normalized query text, so "Action Shows"
+    and "action  shows" share an entry. Entries older than `ttl_seconds` are treated as
+    misses, and the least recently used entry is evicted once `max_size` is reached.
+    """
+
+    def __init__(self, max_size=10000, ttl_seconds=3600, clock=time.monotonic):
+        """
+        Args:
+            max_size (int): Maximum number of entries kept.
+            ttl_seconds (float, optional): Lifetime of an entry; None keeps entries until evicted.
+            clock (callable): Time source, in seconds.
+        """
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def normalize_query(query):
+        """Lowercase the query and collapse runs of whitespace."""
+        return " ".join(str(query).lower().split())
+
+    def make_key(self, model_id, query, *extra):
+        """
+        Build a cache key.
+
+        Args:
+            model_id (str): Identifies the model (and corpus) that produced the value.
+            query (str): Raw query text.
+            *extra: Anything else the value depends on, such as top_n.
+        """
+        return (model_id, self.normalize_query(query)) + extra
+
+    def get(self, key):
+        """Return the cached value for `key`, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, stored_at = entry
+            if self.ttl_seconds is not None and self.clock() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Store `value` under `key`, evicting the least recently used entry if full."""
+        with self._lock:
+            self._entries[key] = (value, self.clock())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Return hit/miss counters and the current size."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }